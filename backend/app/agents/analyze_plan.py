@@ -0,0 +1,131 @@
+"""
+Fused Analyze & Plan
+Analysis and execution plan in a single LLM call (one prompt prefill
+instead of two), used instead of analyzer + planner where configured
+"""
+from typing import Any, Dict, Optional, Tuple
+from app.ai.base import AIProvider, AIMessage
+from app.ai.structured import StructuredOutputError
+from app.agents.analyzer import ANALYSIS_SCHEMA, analyze_task, fallback_analysis
+from app.agents.planner import PLAN_SCHEMA, create_plan
+from app.core.config import settings
+
+
+ANALYZE_AND_PLAN_PROMPT = """You are an expert task analyzer and planner.
+
+Analyze this task request:
+"{description}"
+
+User's preferred language: {language}
+
+Provide a JSON response with:
+{{
+    "analysis": {{
+        "intent": "Brief description of what user wants",
+        "category": "document|code|design|research|translation|other",
+        "complexity": "simple|medium|complex",
+        "output_type": "text|pdf|docx|code|image|zip",
+        "needs_clarification": true|false,
+        "questions": ["question1", "question2"] (if clarification needed),
+        "estimated_steps": 3,
+        "key_requirements": ["req1", "req2"]
+    }},
+    "plan": {{
+        "steps": [
+            {{
+                "step_number": 1,
+                "action": "What to do",
+                "details": "How to do it",
+                "estimated_tokens": 500,
+                "depends_on": []
+            }}
+        ],
+        "total_estimated_tokens": 2000,
+        "expected_output": "Description of final result",
+        "tools_needed": ["research", "writing", "formatting"]
+    }}
+}}
+
+"depends_on" lists the step numbers whose output a step needs.
+Steps without dependencies on each other run in parallel.
+If the task needs clarification, set "plan" to null.
+Otherwise make the plan clear, actionable, and complete."""
+
+
+ANALYZE_AND_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": ANALYSIS_SCHEMA,
+        "plan": {**PLAN_SCHEMA, "type": ["object", "null"]}
+    },
+    "required": ["analysis", "plan"]
+}
+
+
+def use_fused_pipeline(provider_name: str) -> bool:
+    """
+    Whether tasks on this provider analyze and plan in one call
+    
+    TASK_PIPELINE_MODE: "fused", "two_step", or "auto" (fused for the
+    providers in TASK_PIPELINE_FUSED_PROVIDERS, where prefill dominates)
+    """
+    
+    mode = settings.TASK_PIPELINE_MODE
+    if mode == "auto":
+        return provider_name in settings.TASK_PIPELINE_FUSED_PROVIDERS
+    return mode == "fused"
+
+
+async def analyze_and_plan(
+    description: str,
+    provider: AIProvider,
+    user_language: str = "en"
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Analyze the task and create its plan in one call
+    
+    Args:
+        description: Task description from user
+        provider: AI provider to use
+        user_language: User's preferred language
+    
+    Returns:
+        (analysis, plan) - plan is None when clarification is needed
+    """
+    
+    prompt = ANALYZE_AND_PLAN_PROMPT.format(
+        description=description,
+        language=user_language
+    )
+    
+    messages = [
+        AIMessage(role="system", content="You are a task analysis and planning expert."),
+        AIMessage(role="user", content=prompt)
+    ]
+    
+    try:
+        response = await provider.chat_completion(
+            messages=messages,
+            temperature=0.3,
+            max_tokens=1500,
+            json_schema=ANALYZE_AND_PLAN_SCHEMA,
+            phase="analyze_plan"
+        )
+    except StructuredOutputError as e:
+        # Fall back to the two-call path
+        print(f"⚠️  Fused analyze/plan JSON parsing failed: {e}")
+        analysis = await analyze_task(description, provider, user_language)
+        if analysis.get("needs_clarification", False):
+            return analysis, None
+        return analysis, await create_plan(description, analysis, provider, user_language)
+    
+    analysis = response.parsed.get("analysis") or fallback_analysis(description)
+    if analysis.get("needs_clarification", False):
+        return analysis, None
+    
+    plan = response.parsed.get("plan")
+    if not plan:
+        # Model skipped the plan although no clarification is needed
+        plan = await create_plan(description, analysis, provider, user_language)
+    
+    return analysis, plan
@@ -4,6 +4,7 @@ Understands user intent and determines what needs to be done
 """
 from typing import Dict, Any
 from app.ai.base import AIProvider, AIMessage
+from app.ai.structured import StructuredOutputError
 
 
 ANALYSIS_PROMPT = """You are an expert task analyzer. Your job is to understand what the user wants to accomplish.
@@ -28,6 +29,28 @@ Provide a JSON response with:
 Be concise and accurate."""
 
 
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string"},
+        "category": {
+            "type": "string",
+            "enum": ["document", "code", "design", "research", "translation", "other"]
+        },
+        "complexity": {"type": "string", "enum": ["simple", "medium", "complex"]},
+        "output_type": {
+            "type": "string",
+            "enum": ["text", "pdf", "docx", "code", "image", "zip"]
+        },
+        "needs_clarification": {"type": "boolean"},
+        "questions": {"type": "array", "items": {"type": "string"}},
+        "estimated_steps": {"type": "integer"},
+        "key_requirements": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["intent", "category", "complexity", "output_type", "needs_clarification"]
+}
+
+
 async def analyze_task(
     description: str,
     provider: AIProvider,
@@ -56,41 +79,34 @@ async def analyze_task(
         AIMessage(role="user", content=prompt)
     ]
     
-    # Get AI response
-    response = await provider.chat_completion(
-        messages=messages,
-        temperature=0.3,  # Low temperature for consistent analysis
-        max_tokens=500
-    )
-    
-    
-    # Parse JSON response with extraction (handles text-wrapped JSON from Ollama)
-    import json
-    import re
-    
-    def extract_json_from_text(text: str) -> dict:
-        """Extract JSON object from text that may contain surrounding content"""
-        # Try to find JSON object in text
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON object found in response")
-        return json.loads(match.group(0))
-    
+    # Get AI response (streamed JSON, stops as soon as the object is complete)
     try:
-        analysis = extract_json_from_text(response.content)
-    except (json.JSONDecodeError, ValueError) as e:
+        response = await provider.chat_completion(
+            messages=messages,
+            temperature=0.3,  # Low temperature for consistent analysis
+            max_tokens=500,
+            json_schema=ANALYSIS_SCHEMA,
+            phase="analysis"
+        )
+        analysis = response.parsed
+    except StructuredOutputError as e:
         print(f"⚠️  JSON parsing failed: {e}")
-        print(f"📄 Raw content: {response.content[:200]}")
         # Fallback if AI doesn't return valid JSON
-        analysis = {
-            "intent": description[:100],
-            "category": "other",
-            "complexity": "medium",
-            "output_type": "text",
-            "needs_clarification": False,
-            "questions": [],
-            "estimated_steps": 3,
-            "key_requirements": []
-        }
+        analysis = fallback_analysis(description)
     
     return analysis
+
+
+def fallback_analysis(description: str) -> Dict[str, Any]:
+    """Default analysis used when the model returns no valid JSON"""
+    
+    return {
+        "intent": description[:100],
+        "category": "other",
+        "complexity": "medium",
+        "output_type": "text",
+        "needs_clarification": False,
+        "questions": [],
+        "estimated_steps": 3,
+        "key_requirements": []
+    }
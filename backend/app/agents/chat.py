@@ -1,12 +1,12 @@
 """
 Chat Agent - Handles conversational responses for tasks
 """
-from app.core.ollama import OllamaClient
+from app.core.ollama import ollama_client
 
 
 class ChatAgent:
     def __init__(self):
-        self.ollama = OllamaClient()
+        self.ollama = ollama_client
     
     async def respond(
         self,
@@ -3,9 +3,10 @@ Task Executor
 Executes the plan and generates results
 """
 from typing import Dict, Any
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.ai.base import AIProvider, AIMessage
 from app.db.models import Task, User
+from app.core.config import settings
+from app.agents.step_engine import run_plan_steps
 import json
 
 
@@ -28,8 +29,7 @@ async def execute_plan(
     plan: Dict[str, Any],
     provider: AIProvider,
     task: Task,
-    user: User,
-    db: AsyncSession
+    user: User
 ) -> Dict[str, Any]:
     """
     Execute the task plan and generate results
@@ -39,8 +39,7 @@ async def execute_plan(
         provider: AI provider
         task: Task object
         user: User object
-        db: Database session
-        
+    
     Returns:
         Dict with results:
         - text: Generated text
@@ -49,6 +48,10 @@ async def execute_plan(
         - total_tokens: Total tokens used
     """
     
+    # Multi-step plans run step by step (parallel where independent)
+    if settings.STEP_ENGINE_ENABLED and len(plan.get("steps", [])) > 1:
+        return await run_plan_steps(plan, provider, task, user)
+    
     # Build execution prompt
     prompt = EXECUTION_PROMPT.format(
         description=task.description,
@@ -78,20 +81,9 @@ async def execute_plan(
         "files": [],  # TODO: File generation
         "total_cost": total_cost,
         "total_tokens": total_tokens,
-        "provider_used": provider.name,
+        "provider_used": response.provider,
         "model_used": response.model
     }
     
-    # Save execution message to database
-    from app.agents.task_manager import save_message
-    await save_message(
-        task_id=task.id,
-        role="assistant",
-        content=response.content,
-        tokens=total_tokens,
-        cost=total_cost,
-        provider=provider.name,
-        db=db
-    )
-    
+    # The assistant message is stored by complete_task, in the same commit
     return result
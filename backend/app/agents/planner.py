@@ -4,6 +4,7 @@ Creates step-by-step execution plan
 """
 from typing import Dict, Any
 from app.ai.base import AIProvider, AIMessage
+from app.ai.structured import StructuredOutputError
 import json
 
 
@@ -23,7 +24,8 @@ Create a JSON plan with:
             "step_number": 1,
             "action": "What to do",
             "details": "How to do it",
-            "estimated_tokens": 500
+            "estimated_tokens": 500,
+            "depends_on": []
         }}
     ],
     "total_estimated_tokens": 2000,
@@ -31,9 +33,38 @@ Create a JSON plan with:
     "tools_needed": ["research", "writing", "formatting"]
 }}
 
+"depends_on" lists the step numbers whose output a step needs.
+Steps without dependencies on each other run in parallel.
+
 Make the plan clear, actionable, and complete."""
 
 
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step_number": {"type": "integer"},
+                    "action": {"type": "string"},
+                    "details": {"type": "string"},
+                    "estimated_tokens": {"type": "integer"},
+                    "depends_on": {"type": "array", "items": {"type": "integer"}}
+                },
+                "required": ["step_number", "action"]
+            }
+        },
+        "total_estimated_tokens": {"type": "integer"},
+        "expected_output": {"type": "string"},
+        "tools_needed": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["steps"]
+}
+
+
 async def create_plan(
     description: str,
     analysis: Dict[str, Any],
@@ -65,48 +96,44 @@ async def create_plan(
         AIMessage(role="user", content=prompt)
     ]
     
-    # Get AI response
-    response = await provider.chat_completion(
-        messages=messages,
-        temperature=0.4,
-        max_tokens=1000
-    )
-    
-    
-    # Parse plan with extraction (handles text-wrapped JSON from Ollama)
-    import re
-    
-    def extract_json_from_text(text: str) -> dict:
-        """Extract JSON object from text that may contain surrounding content"""
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON object found in response")
-        return json.loads(match.group(0))
-    
+    # Get AI response (streamed JSON, stops as soon as the object is complete)
     try:
-        plan = extract_json_from_text(response.content)
-    except (json.JSONDecodeError, ValueError) as e:
+        response = await provider.chat_completion(
+            messages=messages,
+            temperature=0.4,
+            max_tokens=1000,
+            json_schema=PLAN_SCHEMA,
+            phase="planning"
+        )
+        plan = response.parsed
+    except StructuredOutputError as e:
         print(f"⚠️  Planner JSON parsing failed: {e}")
-        print(f"📄 Raw content: {response.content[:200]}")
         # Fallback plan
-        plan = {
-            "steps": [
-                {
-                    "step_number": 1,
-                    "action": "Analyze requirements",
-                    "details": description,
-                    "estimated_tokens": 500
-                },
-                {
-                    "step_number": 2,
-                    "action": "Generate solution",
-                    "details": "Create the requested output",
-                    "estimated_tokens": 1500
-                }
-            ],
-            "total_estimated_tokens": 2000,
-            "expected_output": analysis.get("output_type", "text"),
-            "tools_needed": ["ai_generation"]
-        }
+        plan = fallback_plan(description, analysis)
     
     return plan
+
+
+def fallback_plan(description: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Default two-step plan used when the model returns no valid JSON"""
+    
+    return {
+        "steps": [
+            {
+                "step_number": 1,
+                "action": "Analyze requirements",
+                "details": description,
+                "estimated_tokens": 500
+            },
+            {
+                "step_number": 2,
+                "action": "Generate solution",
+                "details": "Create the requested output",
+                "estimated_tokens": 1500,
+                "depends_on": [1]
+            }
+        ],
+        "total_estimated_tokens": 2000,
+        "expected_output": analysis.get("output_type", "text"),
+        "tools_needed": ["ai_generation"]
+    }
@@ -0,0 +1,299 @@
+"""
+Step Engine
+Runs a plan's steps as separate LLM calls along their dependencies,
+checkpoints each result on the task and assembles the final deliverable
+"""
+import asyncio
+from typing import Any, Dict, List
+from app.ai.base import AIProvider, AIMessage
+from app.core.config import settings
+from app.db.models import Task, User
+
+
+STEP_PROMPT = """You are an expert task executor working on one step of a larger plan.
+
+ORIGINAL REQUEST: {description}
+
+PLAN OVERVIEW:
+{outline}
+
+CURRENT STEP {step_number}: {action}
+{details}
+
+{context}User's language: {language}
+
+Complete ONLY this step. Output the step's result, without commentary."""
+
+
+ASSEMBLY_PROMPT = """You are an expert task executor. The steps of the plan below have been completed.
+
+ORIGINAL REQUEST: {description}
+
+EXPECTED OUTPUT: {expected_output}
+
+STEP RESULTS:
+{results}
+
+User's language: {language}
+
+Combine the step results into the final deliverable.
+Be thorough, accurate, and deliver exactly what was requested."""
+
+
+class StepFailedError(Exception):
+    """Raised when a plan step fails (completed steps stay checkpointed)"""
+    pass
+
+
+def build_step_graph(plan: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """
+    Normalize plan steps into {step_number: step} with clean dependencies
+    
+    Plans without any "depends_on" (created before dependencies existed)
+    run as a sequential chain. Unknown or self references are dropped,
+    and a cyclic plan falls back to sequential order.
+    
+    Args:
+        plan: Execution plan from planner
+    
+    Returns:
+        Steps keyed by step number, each with a "depends_on" list
+    """
+    
+    steps = {}
+    for step in plan.get("steps", []):
+        number = step.get("step_number")
+        if not isinstance(number, int) or number in steps:
+            number = max(steps, default=0) + 1
+        steps[number] = dict(step, step_number=number)
+    
+    order = sorted(steps)
+    declared = any("depends_on" in step for step in steps.values())
+    
+    for position, number in enumerate(order):
+        if declared:
+            depends_on = steps[number].get("depends_on") or []
+            steps[number]["depends_on"] = sorted({
+                dep for dep in depends_on
+                if isinstance(dep, int) and dep in steps and dep != number
+            })
+        else:
+            steps[number]["depends_on"] = [order[position - 1]] if position else []
+    
+    if _has_cycle(steps):
+        print("⚠️  Plan dependencies contain a cycle, running steps in order")
+        for position, number in enumerate(order):
+            steps[number]["depends_on"] = [order[position - 1]] if position else []
+    
+    return steps
+
+
+def _has_cycle(steps: Dict[int, Dict[str, Any]]) -> bool:
+    """Kahn's algorithm: a cycle leaves steps that never become ready"""
+    
+    remaining = {number: set(step["depends_on"]) for number, step in steps.items()}
+    while remaining:
+        ready = [number for number, deps in remaining.items() if not deps]
+        if not ready:
+            return True
+        for number in ready:
+            del remaining[number]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return False
+
+
+def _step_key(number: int) -> str:
+    # JSON columns store object keys as strings
+    return str(number)
+
+
+async def run_plan_steps(
+    plan: Dict[str, Any],
+    provider: AIProvider,
+    task: Task,
+    user: User
+) -> Dict[str, Any]:
+    """
+    Execute the plan step by step, independent steps in parallel
+    
+    Each finished step is checkpointed in task.step_results, so a retry
+    of the task only runs the steps that are still missing. Checkpoints
+    are short writes from here, one at a time; no session is held while
+    steps are generating.
+    
+    Args:
+        plan: Execution plan from planner
+        provider: AI provider
+        task: Task object
+        user: User object
+    
+    Returns:
+        Same shape as execute_plan (text, total_cost, total_tokens, ...)
+    """
+    
+    steps = build_step_graph(plan)
+    outline = "\n".join(
+        f"{number}. {step.get('action', '')}" for number, step in sorted(steps.items())
+    )
+    
+    results: Dict[int, Dict[str, Any]] = {}
+    for key, checkpoint in (task.step_results or {}).items():
+        if key.isdigit() and int(key) in steps:
+            results[int(key)] = checkpoint
+    if results:
+        print(f"♻️  Task {task.id}: resuming with {len(results)}/{len(steps)} step(s) checkpointed")
+    
+    from app.agents.task_manager import publish_event, set_phase, update_task
+    running: Dict[asyncio.Task, int] = {}
+    
+    try:
+        while len(results) < len(steps):
+            # Launch every ready step within the concurrency budget
+            for number in sorted(steps):
+                if len(running) >= settings.STEP_CONCURRENCY:
+                    break
+                if number in results or number in running.values():
+                    continue
+                if all(dep in results for dep in steps[number]["depends_on"]):
+                    coro = _run_step(steps[number], outline, results, provider, task, user)
+                    running[asyncio.create_task(coro)] = number
+            
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            
+            failure = None
+            for finished in sorted(done, key=running.get):
+                number = running.pop(finished)
+                try:
+                    results[number] = finished.result()
+                except Exception as e:
+                    failure = failure or StepFailedError(f"Step {number} failed: {e}")
+                    continue
+                
+                # Checkpoint
+                await update_task(task, step_results={
+                    **(task.step_results or {}),
+                    _step_key(number): results[number]
+                })
+                await publish_event(task, "output", step=number, text=results[number]["output"])
+                await set_phase(task, progress={"steps_done": len(results), "steps_total": len(steps)})
+                print(f"✅ Task {task.id}: step {number}/{len(steps)} done ({results[number]['tokens']} tokens)")
+            
+            if failure:
+                raise failure
+    finally:
+        for pending in running:
+            pending.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    
+    total_cost = sum(result["cost"] for result in results.values())
+    total_tokens = sum(result["tokens"] for result in results.values())
+    provider_used = provider.name
+    model_used = provider.get_default_model()
+    
+    if len(steps) == 1:
+        content = results[next(iter(steps))]["output"]
+    else:
+        response = await _assemble(plan, steps, results, provider, task, user)
+        content = response.content
+        total_cost += response.cost
+        total_tokens += response.tokens_used
+        provider_used = response.provider
+        model_used = response.model
+    
+    return {
+        "text": content,
+        "total_cost": total_cost,
+        "total_tokens": total_tokens,
+        "provider_used": provider_used,
+        "model_used": model_used
+    }
+
+
+async def _run_step(
+    step: Dict[str, Any],
+    outline: str,
+    results: Dict[int, Dict[str, Any]],
+    provider: AIProvider,
+    task: Task,
+    user: User
+) -> Dict[str, Any]:
+    """Run one step with the outputs of its dependencies as context"""
+    
+    context = ""
+    if step["depends_on"]:
+        context = "RESULTS OF PREVIOUS STEPS:\n" + "\n\n".join(
+            f"[Step {dep}]\n{results[dep]['output']}" for dep in step["depends_on"]
+        ) + "\n\n"
+    
+    prompt = STEP_PROMPT.format(
+        description=task.description,
+        outline=outline,
+        step_number=step["step_number"],
+        action=step.get("action", ""),
+        details=step.get("details", ""),
+        context=context,
+        language=user.output_language
+    )
+    
+    messages = [
+        AIMessage(role="system", content="You are an expert executor."),
+        AIMessage(role="user", content=prompt)
+    ]
+    
+    response = await provider.chat_completion(
+        messages=messages,
+        temperature=0.7,
+        max_tokens=_step_max_tokens(step)
+    )
+    
+    return {
+        "output": response.content,
+        "tokens": response.tokens_used,
+        "cost": response.cost,
+        "provider": response.provider
+    }
+
+
+def _step_max_tokens(step: Dict[str, Any]) -> int:
+    """Output budget from the planner's estimate, with headroom"""
+    
+    estimate = step.get("estimated_tokens")
+    if not isinstance(estimate, int) or estimate <= 0:
+        return settings.STEP_MAX_TOKENS
+    return max(256, min(settings.STEP_MAX_TOKENS, estimate * 2))
+
+
+async def _assemble(
+    plan: Dict[str, Any],
+    steps: Dict[int, Dict[str, Any]],
+    results: Dict[int, Dict[str, Any]],
+    provider: AIProvider,
+    task: Task,
+    user: User
+):
+    """Serial final step: merge the step results into the deliverable"""
+    
+    sections: List[str] = [
+        f"[Step {number}: {steps[number].get('action', '')}]\n{results[number]['output']}"
+        for number in sorted(steps)
+    ]
+    
+    prompt = ASSEMBLY_PROMPT.format(
+        description=task.description,
+        expected_output=plan.get("expected_output", "text"),
+        results="\n\n".join(sections),
+        language=user.output_language
+    )
+    
+    messages = [
+        AIMessage(role="system", content="You are an expert executor."),
+        AIMessage(role="user", content=prompt)
+    ]
+    
+    return await provider.chat_completion(
+        messages=messages,
+        temperature=0.5,
+        max_tokens=4000
+    )
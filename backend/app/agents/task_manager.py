@@ -1,20 +1,30 @@
 """
 Task Manager - Core execution engine
 Orchestrates the complete task lifecycle
+
+Database sessions are only opened for short read/write bursts, never
+across an LLM call, so long-running tasks don't pin pool connections.
+Phase changes go to the task state store (app/core/task_state.py) and
+reach the row with the next durable write: phase results, completion
+or failure.
 """
-import asyncio
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.sql import func
+from sqlalchemy import select, update
 
 from app.db.base import AsyncSessionLocal
 from app.db.models import Task, User, Message
 from app.ai.factory import get_ai_provider, ProviderFactory
-from app.ai.base import AIMessage
 from app.agents.analyzer import analyze_task
 from app.agents.planner import create_plan
+from app.agents.analyze_plan import analyze_and_plan, use_fused_pipeline
 from app.agents.executor import execute_plan
+from app.ai.usage import TaskUsage, current_usage, track_usage
+from app.billing.credits import charge
+from app.core.cancellation import TaskCancelledError, cancellation_watcher, is_cancel_requested
+from app.core.task_events import task_events
+from app.core.task_state import task_state
 
 
 async def execute_task_async(task_id: int):
@@ -22,159 +32,364 @@ async def execute_task_async(task_id: int):
     Execute task in background
     This is the main entry point for task execution
     
+    A cancelled task stops mid-call (see app/core/cancellation.py) and
+    is charged for the provider usage incurred up to that point.
+    
     Args:
         task_id: ID of task to execute
     """
-    async with AsyncSessionLocal() as db:
+    with track_usage() as usage:
         try:
-            await execute_task(task_id, db)
+            async with cancellation_watcher.watch(task_id):
+                await execute_task(task_id)
+        except TaskCancelledError:
+            await record_cancellation(task_id, usage)
         except Exception as e:
             # Handle any unexpected errors
-            result = await db.execute(select(Task).where(Task.id == task_id))
-            task = result.scalar_one_or_none()
-            
-            if task:
-                task.status = "failed"
-                task.error_message = str(e)
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Task)
+                    .where(Task.id == task_id, Task.status != "cancelled")
+                    .values(status="failed", error_message=str(e))
+                )
                 await db.commit()
+            await task_state.clear(task_id)
             
             print(f"Task {task_id} failed: {e}")
 
 
-async def execute_task(task_id: int, db: AsyncSession):
+# ============================================================================
+# SHORT-LIVED DB ACCESS
+# ============================================================================
+
+async def load_task(task_id: int) -> Tuple[Optional[Task], Optional[User]]:
+    """
+    Load a task and its user in one short session
+    
+    The returned objects are detached: read them freely, persist changes
+    with set_phase() / update_task() / complete_task().
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Task).where(Task.id == task_id))
+        task = result.scalar_one_or_none()
+        
+        if not task:
+            return None, None
+        
+        result = await db.execute(select(User).where(User.id == task.user_id))
+        return task, result.scalar_one_or_none()
+
+
+async def set_phase(task: Task, **fields):
+    """
+    Record live state (status, started_at, progress) without a database write
+    
+    Published through the task state store and written to the row with
+    the next update_task() / complete_task(). Every phase starts here, so
+    this is also where a pipeline notices that the task was cancelled.
+    
+    Args:
+        task: Task loaded by load_task()
+        **fields: Column values to set, or progress
+    
+    Raises:
+        TaskCancelledError: the task was cancelled
+    """
+    for name, value in fields.items():
+        if name != "progress":
+            setattr(task, name, value)
+    
+    await task_state.set(task.id, **fields)
+    if "status" in fields:
+        await publish_event(task, "status", status=fields["status"])
+    if "progress" in fields:
+        await publish_event(task, "progress", **fields["progress"])
+    
+    if await is_cancel_requested(task.id):
+        raise TaskCancelledError(f"Task {task.id} was cancelled")
+
+
+async def update_task(task: Task, **fields):
+    """
+    Apply fields to the (detached) task and persist them in one short
+    transaction, together with the live state buffered by set_phase()
+    
+    Args:
+        task: Task loaded by load_task()
+        **fields: Column values to set
+    
+    Raises:
+        TaskCancelledError: the task was cancelled (nothing is written)
+    """
+    for name, value in fields.items():
+        setattr(task, name, value)
+    
+    values = {**task_state.flush(task.id), **fields}
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.status != "cancelled")
+            .values(**values)
+        )
+        if result.rowcount == 0:
+            raise TaskCancelledError(f"Task {task.id} was cancelled")
+        await db.commit()
+    
+    if "status" in fields:
+        # The row has the current status again
+        await task_state.clear(task.id)
+        await publish_event(task, "status", **{
+            name: fields[name]
+            for name in ("status", "error_message", "clarification_questions")
+            if name in fields
+        })
+
+
+async def publish_event(task: Task, event: str, **data):
+    """Send an event to the user's live clients, with the cost billed so far"""
+    
+    usage = current_usage()
+    if usage is not None:
+        data.setdefault("cost", round(usage.billable_cost, 6))
+    await task_events.publish(task.user_id, task.id, event, **data)
+
+
+async def complete_task(task: Task, user: User, result: dict):
+    """Store the results and the assistant message, charge the user, in one transaction"""
+    
+    fields = {
+        **task_state.flush(task.id),
+        "result_text": result.get("text"),
+        "result_files": result.get("files", []),
+        "final_cost": result.get("total_cost", 0.0),
+        "tokens_used": result.get("total_tokens", 0),
+        "status": "completed",
+        "completed_at": datetime.now(timezone.utc)
+    }
+    for name, value in fields.items():
+        setattr(task, name, value)
+    
+    async with AsyncSessionLocal() as db:
+        updated = await db.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.status != "cancelled")
+            .values(**fields)
+        )
+        if updated.rowcount == 0:
+            # Cancelled during the last call, charged as a cancellation
+            raise TaskCancelledError(f"Task {task.id} was cancelled")
+        
+        db.add(Message(
+            task_id=task.id,
+            role="assistant",
+            content=result.get("text"),
+            tokens_used=task.tokens_used,
+            cost=task.final_cost,
+            provider_used=result.get("provider_used")
+        ))
+        
+        # Deduct cost from user (atomic, the user object may be stale)
+        await charge(db, user.id, task.final_cost)
+        await db.commit()
+    
+    await task_state.clear(task.id)
+    await publish_event(
+        task,
+        "status",
+        status="completed",
+        cost=task.final_cost,
+        tokens=task.tokens_used
+    )
+
+
+async def record_cancellation(task_id: int, usage: TaskUsage):
+    """
+    Store and charge the usage incurred before the task was cancelled
+    
+    Like complete_task(), only plan execution is charged (see
+    TaskUsage.start_billing); analysis and planning calls are not.
+    """
+    cost, tokens = usage.billable_cost, usage.billable_tokens
+    print(
+        f"🛑 Task {task_id} cancelled after {usage.calls} call(s), "
+        f"${usage.cost:.4f} incurred, ${cost:.4f} billable"
+    )
+    user_id = None
+    if cost > 0 or tokens > 0:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Task)
+                .where(Task.id == task_id, Task.status == "cancelled")
+                .values(
+                    final_cost=Task.final_cost + cost,
+                    tokens_used=Task.tokens_used + tokens,
+                    completed_at=datetime.now(timezone.utc)
+                )
+                .returning(Task.user_id)
+            )
+            user_id = result.scalar_one_or_none()
+            if user_id is not None:
+                await charge(db, user_id, cost)
+            await db.commit()
+    
+    # Also with nothing to charge: the checkpoints must not outlive the task
+    await task_state.clear(task_id)
+    if user_id is not None:
+        await task_events.publish(user_id, task_id, "cost", cost=cost, tokens=tokens)
+
+
+def has_analysis(task: Task) -> bool:
+    """Whether the task carries a stored analysis checkpoint"""
+    return isinstance(task.analysis, dict) and "needs_clarification" in task.analysis
+
+
+def has_plan(task: Task) -> bool:
+    """Whether the task carries a stored plan checkpoint"""
+    return isinstance(task.plan, dict) and bool(task.plan.get("steps"))
+
+
+# ============================================================================
+# PIPELINE
+# ============================================================================
+
+async def execute_task(task_id: int):
     """
     Main task execution logic
     
     Phases:
     1. ANALYZING - Understand what user wants
+       (fused mode also creates the plan in the same call)
     2. CLARIFYING - Ask questions if needed (optional)
     3. PLANNING - Create execution plan
     4. EXECUTING - Run the plan
     5. COMPLETED - Deliver results
     
+    The pipeline is resumable: a phase whose result is already stored on
+    the task (analysis, plan, step_results) is skipped, so re-running a
+    task after a crash, a provider fallback or answered clarification
+    questions doesn't repeat LLM calls that were already paid for.
+    
     Args:
         task_id: ID of task to execute
-        db: Database session
     """
     
-    # Load task
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
+    # Load task and user
+    task, user = await load_task(task_id)
     
     if not task:
         return
     
-    # Load user
-    result = await db.execute(select(User).where(User.id == task.user_id))
-    user = result.scalar_one_or_none()
+    if task.status in ("completed", "cancelled", "clarifying"):
+        # Finished, or waiting for the user (chat re-enqueues it)
+        print(f"ℹ️  Task {task_id} is {task.status}, nothing to do")
+        return
     
     if not user:
-        task.status = "failed"
-        task.error_message = "User not found"
-        await db.commit()
+        await update_task(task, status="failed", error_message="User not found")
         return
     
     # Get AI provider
     try:
-        provider = get_ai_provider(task.provider)
+        provider = get_ai_provider(task.provider, task.urgency)
     except Exception as e:
-        task.status = "failed"
-        task.error_message = f"Provider error: {e}"
-        await db.commit()
+        await update_task(task, status="failed", error_message=f"Provider error: {e}")
         return
     
+    if task.started_at is None:
+        await set_phase(task, started_at=datetime.now(timezone.utc))
+    
     # ========================================================================
-    # PHASE 1: ANALYZING
+    # PHASE 1: ANALYZING (skipped if analysis is checkpointed)
     # ========================================================================
-    task.status = "analyzing"
-    task.started_at = func.now()
-    await db.commit()
+    plan = task.plan if has_plan(task) else None
     
-    try:
-        analysis = await analyze_task(
-            description=task.description,
-            provider=provider,
-            user_language=user.output_language
-        )
+    if has_analysis(task):
+        analysis = task.analysis
+        print(f"♻️  Task {task_id}: reusing stored analysis")
+    else:
+        await set_phase(task, status="analyzing")
         
-        task.analysis = analysis
-        await db.commit()
+        try:
+            if use_fused_pipeline(provider.name):
+                analysis, plan = await analyze_and_plan(
+                    description=task.description,
+                    provider=provider,
+                    user_language=user.output_language
+                )
+                # Checkpoints belong to the previous plan
+                await update_task(task, analysis=analysis, plan=plan, step_results=None)
+            else:
+                analysis = await analyze_task(
+                    description=task.description,
+                    provider=provider,
+                    user_language=user.output_language
+                )
+                await update_task(task, analysis=analysis)
         
-    except Exception as e:
-        task.status = "failed"
-        task.error_message = f"Analysis failed: {e}"
-        await db.commit()
-        return
+        except Exception as e:
+            await update_task(task, status="failed", error_message=f"Analysis failed: {e}")
+            return
     
     # ========================================================================
     # PHASE 2: CLARIFYING (if needed)
     # ========================================================================
     if analysis.get("needs_clarification", False):
-        task.status = "clarifying"
-        task.clarification_questions = analysis.get("questions", [])
-        await db.commit()
+        await update_task(
+            task,
+            status="clarifying",
+            clarification_questions=analysis.get("questions", [])
+        )
         
         # Wait for user to answer questions
-        # This is handled by the chat endpoint
+        # The chat endpoint stores the answers and re-enqueues the task
         return
     
     # ========================================================================
-    # PHASE 3: PLANNING
+    # PHASE 3: PLANNING (skipped if plan is checkpointed)
     # ========================================================================
-    task.status = "planning"
-    await db.commit()
-    
-    try:
-        plan = await create_plan(
-            description=task.description,
-            analysis=analysis,
-            provider=provider,
-            user_language=user.output_language
-        )
+    if plan is None:
+        await set_phase(task, status="planning")
         
-        task.plan = plan
-        await db.commit()
+        try:
+            plan = await create_plan(
+                description=task.description,
+                analysis=analysis,
+                provider=provider,
+                user_language=user.output_language
+            )
+            
+            # Checkpoints belong to the previous plan
+            await update_task(task, plan=plan, step_results=None)
         
-    except Exception as e:
-        task.status = "failed"
-        task.error_message = f"Planning failed: {e}"
-        await db.commit()
-        return
+        except Exception as e:
+            await update_task(task, status="failed", error_message=f"Planning failed: {e}")
+            return
+    else:
+        print(f"♻️  Task {task_id}: reusing stored plan")
     
     # ========================================================================
     # PHASE 4: EXECUTING
     # ========================================================================
-    task.status = "executing"
-    await db.commit()
+    await set_phase(task, status="executing")
+    
+    # Completion charges execute_plan's cost, a cancellation the same phase
+    usage = current_usage()
+    if usage is not None:
+        usage.start_billing()
     
     try:
         result = await execute_plan(
             plan=plan,
             provider=provider,
             task=task,
-            user=user,
-            db=db
+            user=user
         )
         
-        # Update task with results
-        task.result_text = result.get("text")
-        task.result_files = result.get("files", [])
-        task.final_cost = result.get("total_cost", 0.0)
-        task.tokens_used = result.get("total_tokens", 0)
-        
-        # Deduct cost from user
-        user.credits_balance -= task.final_cost
-        user.monthly_usage += task.final_cost
-        
-        task.status = "completed"
-        task.completed_at = func.now()
-        
-        await db.commit()
-        
+        # Update task with results and deduct cost from user
+        await complete_task(task, user, result)
+    
     except Exception as e:
-        task.status = "failed"
-        task.error_message = f"Execution failed: {e}"
-        await db.commit()
+        await update_task(task, status="failed", error_message=f"Execution failed: {e}")
         
         # Try fallback provider
         tried_providers = [task.provider]
@@ -184,13 +399,51 @@ async def execute_task(task_id: int, db: AsyncSession):
         )
         
         if fallback and task.retry_count < 2:
-            task.retry_count += 1
-            task.provider = fallback.name
-            task.status = "pending"
-            await db.commit()
+            await update_task(
+                task,
+                retry_count=task.retry_count + 1,
+                provider=fallback.name,
+                status="pending"
+            )
             
             # Retry with fallback
-            await execute_task(task_id, db)
+            await execute_task(task_id)
+
+
+async def resume_after_clarification(task: Task, answer: str, db: AsyncSession) -> bool:
+    """
+    Store the user's answer to the clarification questions and requeue
+    the task, which continues at PLANNING with the stored analysis
+    
+    Args:
+        task: Task in status "clarifying"
+        answer: User's reply
+        db: Database session
+    
+    Returns:
+        True if the task was re-enqueued
+    """
+    from app.core.queue import task_queue, QueueError
+    
+    analysis = dict(task.analysis or {})
+    analysis["clarifications"] = analysis.get("clarifications", []) + [{
+        "questions": task.clarification_questions or [],
+        "answer": answer
+    }]
+    analysis["needs_clarification"] = False
+    
+    # Reassign so SQLAlchemy sees the JSON change
+    task.analysis = analysis
+    task.plan = None
+    task.status = "pending"
+    await db.commit()
+    
+    try:
+        await task_queue.enqueue(task.id, task.urgency)
+        return True
+    except QueueError as e:
+        print(f"⚠️ {e}")
+        return False
 
 
 async def save_message(
@@ -199,11 +452,10 @@ async def save_message(
     content: str,
     tokens: int,
     cost: float,
-    provider: str,
-    db: AsyncSession
+    provider: str
 ):
     """
-    Save a chat message to database
+    Save a chat message to database (in its own short session)
     
     Args:
         task_id: Task ID
@@ -212,7 +464,6 @@ async def save_message(
         tokens: Tokens used
         cost: Cost incurred
         provider: AI provider used
-        db: Database session
     """
     message = Message(
         task_id=task_id,
@@ -223,5 +474,6 @@ async def save_message(
         provider_used=provider
     )
     
-    db.add(message)
-    await db.commit()
+    async with AsyncSessionLocal() as db:
+        db.add(message)
+        await db.commit()
@@ -4,8 +4,20 @@ Analyzes task complexity and category using Ollama LLM.
 NO MOCKS. NO SLEEP.
 """
 from app.agents.base import BaseAgent
-from app.core.ollama import ollama_client
-import json
+from app.ai.base import AIMessage
+from app.ai.factory import get_ai_provider
+from app.ai.structured import StructuredOutputError
+
+
+TRIAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "complexity": {"type": "integer"},
+        "category": {"type": "string"},
+        "needs_clarification": {"type": "boolean"}
+    },
+    "required": ["complexity", "category", "needs_clarification"]
+}
 
 
 class TriageAgent(BaseAgent):
@@ -28,23 +40,27 @@ class TriageAgent(BaseAgent):
         prompt = f"Analyze this task:\n{task_description}"
         
         # REAL AI CALL - NO MOCK
-        response = await ollama_client.generate(
-            prompt=prompt,
-            system=system_prompt,
-            temperature=0.3
-        )
-        
+        # Through the provider like analysis and planning: limiter, circuit
+        # breaker, routing stats, usage metering and bounded JSON retries
+        provider = get_ai_provider(input_data.get("provider", "ollama"))
         try:
-            # Extract JSON from response
-            result = json.loads(response)
-            print(f"[{self.name}] AI Response: {result}")
-            return result
-        except json.JSONDecodeError:
+            response = await provider.chat_completion(
+                messages=[
+                    AIMessage(role="system", content=system_prompt),
+                    AIMessage(role="user", content=prompt)
+                ],
+                temperature=0.3,
+                json_schema=TRIAGE_SCHEMA,
+                phase="triage"
+            )
+            print(f"[{self.name}] AI Response: {response.parsed}")
+            return response.parsed
+        except StructuredOutputError as e:
             # Fallback if LLM doesn't return valid JSON
-            print(f"[{self.name}] AI returned invalid JSON: {response}")
+            print(f"[{self.name}] AI returned invalid JSON: {e}")
             return {
                 "complexity": 3,
                 "category": "general",
                 "needs_clarification": True,
-                "raw_response": response
+                "raw_response": str(e)
             }
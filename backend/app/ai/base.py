@@ -2,9 +2,31 @@
 Base AI Provider Interface
 All AI providers must implement this interface
 """
+import asyncio
+import time
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import AsyncGenerator, Awaitable, Callable, List, Dict, Any, Optional
+from dataclasses import dataclass, asdict, replace
+from app.ai.cache import response_cache
+from app.ai.health import health_monitor
+from app.ai.limiter import provider_limiter
+from app.ai.routing import provider_router
+from app.ai.singleflight import inflight
+from app.ai.structured import (
+    IncrementalJSONParser,
+    StructuredOutputError,
+    parse_structured,
+    streaming_stats,
+    structured_stats
+)
+from app.ai.tokenizer import tokenizer
+from app.ai.usage import TaskUsage, current_usage, record_usage
+from app.core.config import settings
+
+
+class ProviderUnavailableError(Exception):
+    """Provider is rejecting calls (circuit breaker open)"""
+    pass
 
 
 @dataclass
@@ -22,6 +44,50 @@ class AIResponse:
     cost: float
     model: str
     provider: str
+    cached: bool = False  # Served from cache or a shared in-flight call (no new cost)
+    input_tokens: int = 0  # Prompt tokens reported by the provider
+    output_tokens: int = 0  # Completion tokens reported by the provider
+    eval_duration: Optional[float] = None  # Seconds spent generating output
+    tokens_per_second: Optional[float] = None  # Output tokens / eval_duration
+    parsed: Optional[Any] = None  # Validated JSON for json_schema calls
+
+
+class ProviderStream:
+    """
+    Chunks of a streamed completion plus its token counts
+    
+    Providers that report usage at the end of a stream set `input_tokens`
+    and `output_tokens` once it arrives; they stay None until then (or if
+    the stream was closed before the provider reported them).
+    
+    Closing a generator that was never iterated skips its `finally`, so
+    `on_abandon` does that cleanup when the stream is closed unread.
+    """
+    
+    def __init__(
+        self,
+        source: Optional[AsyncGenerator[str, None]] = None,
+        on_abandon: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.source = source
+        self.on_abandon = on_abandon
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self._started = False
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self) -> str:
+        self._started = True
+        return await self.source.__anext__()
+    
+    async def aclose(self):
+        abandoned = not self._started and self.on_abandon is not None
+        self._started = True  # Clean up once
+        await self.source.aclose()
+        if abandoned:
+            await self.on_abandon()
 
 
 class AIProvider(ABC):
@@ -31,25 +97,447 @@ class AIProvider(ABC):
         self.api_key = api_key
         self.name = "base"
     
-    @abstractmethod
     async def chat_completion(
         self,
         messages: List[AIMessage],
         stream: bool = False,
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        cache: bool = True,
+        json_schema: Optional[Dict[str, Any]] = None,
+        phase: Optional[str] = None
     ) -> AIResponse | AsyncGenerator[str, None]:
         """
         Send chat completion request
         
+        Non-streaming, low-temperature calls are served from the response
+        cache when an identical request was answered before. Identical
+        concurrent calls (streaming or not) share one upstream request.
+        
         Args:
             messages: List of messages
             stream: Whether to stream response
             model: Specific model to use
             temperature: Creativity (0-1)
             max_tokens: Max response length
+            cache: Set False to always make a dedicated provider call
+            json_schema: Request JSON matching this schema (native JSON
+                mode where supported); the result is in AIResponse.parsed
+            phase: Label for JSON streaming stats (e.g. "analysis")
+        
+        Returns:
+            AIResponse or AsyncGenerator for streaming
+        
+        Raises:
+            StructuredOutputError: json_schema output still invalid after retries
+        """
+        
+        if json_schema is not None and stream:
+            raise ValueError("json_schema is not supported with stream=True")
+        
+        async def call() -> AIResponse | AsyncGenerator[str, None]:
+            if json_schema is not None:
+                return await self._structured_completion(
+                    messages, model, temperature, max_tokens, json_schema, phase
+                )
+            return await self._call_provider(
+                messages, stream, model, temperature, max_tokens
+            )
+        
+        if not cache:
+            return await call()
+        
+        key = response_cache.make_key(
+            self.name,
+            model or self.get_default_model(),
+            [{"role": msg.role, "content": msg.content} for msg in messages],
+            temperature,
+            max_tokens,
+            json_schema
+        )
+        
+        if stream:
+            if not settings.LLM_COALESCE_ENABLED:
+                return await call()
+            return inflight.stream(
+                key,
+                lambda: self._call_provider(
+                    messages, True, model, temperature, max_tokens
+                )
+            )
+        
+        use_cache = response_cache.is_cacheable(temperature)
+        if use_cache:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                # Already paid for - a cache hit costs nothing
+                return AIResponse(**{**cached, "cost": 0.0, "cached": True})
+        
+        async def complete() -> AIResponse:
+            response = await call()
+            if use_cache:
+                await response_cache.set(key, asdict(response))
+            return response
+        
+        if not settings.LLM_COALESCE_ENABLED:
+            return await complete()
+        
+        response, shared = await inflight.do(key, complete)
+        if shared:
+            # The caller that started the request pays for it
+            return replace(response, cost=0.0, cached=True)
+        
+        return response
+    
+    async def _structured_completion(
+        self,
+        messages: List[AIMessage],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_schema: Dict[str, Any],
+        phase: Optional[str] = None
+    ) -> AIResponse:
+        """
+        JSON-mode call validated against json_schema
+        
+        With STRUCTURED_STREAMING each attempt is streamed and the
+        generation is stopped as soon as a complete object has arrived.
+        Invalid output is repaired where possible; otherwise the model is
+        asked again (up to STRUCTURED_MAX_RETRIES) with the validation
+        errors. The returned cost and tokens cover every attempt.
+        """
+        
+        model_name = model or self.get_default_model()
+        attempt_messages = list(messages)
+        total_cost = 0.0
+        total_tokens = 0
+        error = None
+        
+        for attempt in range(settings.STRUCTURED_MAX_RETRIES + 1):
+            if settings.STRUCTURED_STREAMING:
+                response = await self._stream_json(
+                    attempt_messages, model, temperature, max_tokens, json_schema,
+                    phase or "default"
+                )
+            else:
+                response = await self._call_provider(
+                    attempt_messages, False, model, temperature, max_tokens, json_schema
+                )
+            total_cost += response.cost
+            total_tokens += response.tokens_used
+            
+            try:
+                parsed, repaired = parse_structured(response.content, json_schema)
+            except StructuredOutputError as e:
+                error = e
+                structured_stats.record(self.name, model_name, "parse_failure")
+                print(f"⚠️ {self.name}/{model_name} returned invalid JSON: {e}")
+                
+                if attempt < settings.STRUCTURED_MAX_RETRIES:
+                    structured_stats.record(self.name, model_name, "retry")
+                    attempt_messages = list(messages) + [
+                        AIMessage(role="assistant", content=response.content),
+                        AIMessage(
+                            role="user",
+                            content=(
+                                f"Your reply was not valid JSON for the required format ({e}). "
+                                "Reply again with only the corrected JSON."
+                            )
+                        ),
+                    ]
+                continue
             
+            structured_stats.record(self.name, model_name, "repaired" if repaired else "ok")
+            return replace(
+                response,
+                cost=total_cost,
+                tokens_used=total_tokens,
+                parsed=parsed
+            )
+        
+        structured_stats.record(self.name, model_name, "failed")
+        raise StructuredOutputError(
+            f"No valid JSON after {settings.STRUCTURED_MAX_RETRIES + 1} attempts: {error}"
+        )
+    
+    async def _stream_json(
+        self,
+        messages: List[AIMessage],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_schema: Dict[str, Any],
+        phase: str
+    ) -> AIResponse:
+        """Stream a JSON reply and stop generating once the object is complete"""
+        
+        model_name = model or self.get_default_model()
+        parser = IncrementalJSONParser()
+        chunks: List[str] = []
+        started = time.monotonic()
+        time_to_json = None
+        tail_chars = 0
+        
+        stream = await self._call_provider(
+            messages, True, model, temperature, max_tokens, json_schema
+        )
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                if time_to_json is not None:
+                    tail_chars += len(chunk)
+                elif parser.feed(chunk):
+                    time_to_json = time.monotonic() - started
+                    tail_chars = len(parser.tail)
+                    if settings.STRUCTURED_EARLY_STOP:
+                        break
+        finally:
+            # Closing the stream cancels the rest of the generation
+            await stream.aclose()
+        
+        total_time = time.monotonic() - started
+        stopped_early = settings.STRUCTURED_EARLY_STOP and parser.done
+        generated = "".join(chunks)
+        
+        # Counts settled by _track_stream (the provider's where reported)
+        input_tokens = stream.input_tokens
+        output_tokens = stream.output_tokens
+        tail_tokens = tokenizer.count(generated[len(generated) - tail_chars:], model_name) if tail_chars else 0
+        tokens_per_second = output_tokens / total_time if total_time > 0 else None
+        
+        streaming_stats.record(
+            phase,
+            stopped_early,
+            time_to_json,
+            total_time,
+            output_tokens,
+            tail_tokens,
+            max(max_tokens - output_tokens, 0) if max_tokens else None,
+            tokens_per_second
+        )
+        
+        return AIResponse(
+            content=parser.text if parser.done else generated,
+            tokens_used=input_tokens + output_tokens,
+            cost=self.calculate_cost(input_tokens, output_tokens, model_name),
+            model=model_name,
+            provider=self.name,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            eval_duration=round(total_time, 3),
+            tokens_per_second=round(tokens_per_second, 2) if tokens_per_second else None
+        )
+    
+    async def _call_provider(
+        self,
+        messages: List[AIMessage],
+        stream: bool,
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_schema: Optional[Dict[str, Any]] = None
+    ) -> AIResponse | AsyncGenerator[str, None]:
+        """
+        Call the provider through its circuit breaker and rate limiter
+        
+        Latency is measured after the limiter admits the call, so queue
+        wait (see provider_limiter.stats) is not counted as model latency.
+        """
+        
+        breaker = health_monitor.breaker(self.name)
+        if not breaker.allow_request():
+            raise ProviderUnavailableError(
+                f"Provider '{self.name}' is unavailable (circuit open)"
+            )
+        
+        model_name = model or self.get_default_model()
+        lease = await provider_limiter.acquire(
+            self.name,
+            model_name,
+            lambda: self._estimate_tokens(messages, model_name, max_tokens)
+        )
+        started = time.monotonic()
+        
+        try:
+            result = await self._chat_completion(
+                messages, stream, model, temperature, max_tokens, json_schema
+            )
+        except Exception:
+            await lease.release()
+            breaker.record_failure()
+            provider_router.record(self.name, model_name, None, error=True)
+            raise
+        except asyncio.CancelledError:
+            await lease.release()
+            breaker.release_trial()
+            # The prompt was sent, count it as incurred (output unknown)
+            prompt_tokens = self._prompt_tokens(messages, model_name)
+            record_usage(self.calculate_cost(prompt_tokens, 0, model_name), prompt_tokens, partial=True)
+            raise
+        
+        if stream:
+            prompt_tokens = self._prompt_tokens(messages, model_name)
+            usage = current_usage()
+            
+            async def abandoned():
+                # Closed before the first read: _track_stream never ran
+                await result.aclose()
+                await lease.release(prompt_tokens)
+                breaker.release_trial()
+                if usage is not None:
+                    usage.add(
+                        self.calculate_cost(prompt_tokens, 0, model_name),
+                        prompt_tokens,
+                        partial=True
+                    )
+            
+            tracked = ProviderStream(on_abandon=abandoned)
+            tracked.source = self._track_stream(
+                result, tracked, breaker, model_name, started, lease,
+                prompt_tokens, usage
+            )
+            return tracked
+        
+        await lease.release(result.tokens_used)
+        record_usage(result.cost, result.tokens_used)
+        breaker.record_success()
+        provider_router.record(
+            self.name,
+            model_name,
+            time.monotonic() - started,
+            cost=result.cost,
+            tokens=result.tokens_used,
+            output_tokens=result.output_tokens
+        )
+        return result
+    
+    async def _track_stream(
+        self,
+        stream: AsyncGenerator[str, None],
+        tracked: ProviderStream,
+        breaker,
+        model_name: str,
+        started: float,
+        lease,
+        prompt_tokens: int,
+        usage: Optional[TaskUsage]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Report the outcome, timing and usage of a streamed completion
+        
+        Counts the provider reported with the stream are preferred over
+        tokenizer estimates; the ones settled are left on `tracked`.
+        Usage goes to the meter active when the call was made, not to
+        whichever task happens to read or close the stream.
+        """
+        
+        ttft = None
+        chunks: List[str] = []
+        finished = False
+        output_tokens: Optional[int] = None
+        
+        def generated() -> int:
+            reported = getattr(stream, "output_tokens", None)
+            if reported is not None:
+                return reported
+            return tokenizer.count("".join(chunks), model_name)
+        
+        try:
+            async for chunk in stream:
+                if ttft is None:
+                    ttft = time.monotonic() - started
+                chunks.append(chunk)
+                yield chunk
+            finished = True
+        except (GeneratorExit, asyncio.CancelledError):
+            # Closed by the consumer (e.g. early stop) or cancelled - not a
+            # provider failure; without a first token there is no verdict
+            if ttft is not None:
+                breaker.record_success()
+                output_tokens = generated()
+                provider_router.record(
+                    self.name,
+                    model_name,
+                    time.monotonic() - started,
+                    ttft=ttft,
+                    output_tokens=output_tokens
+                )
+            else:
+                breaker.release_trial()
+            raise
+        except Exception:
+            breaker.record_failure()
+            provider_router.record(self.name, model_name, None, error=True)
+            raise
+        else:
+            breaker.record_success()
+            output_tokens = generated()
+            provider_router.record(
+                self.name,
+                model_name,
+                time.monotonic() - started,
+                ttft=ttft,
+                output_tokens=output_tokens
+            )
+        finally:
+            await stream.aclose()
+            # Also when closed early or cancelled: what was generated is
+            # settled against the TPM reservation and billed
+            if output_tokens is None:
+                output_tokens = generated()
+            reported_prompt = getattr(stream, "input_tokens", None)
+            if reported_prompt is not None:
+                prompt_tokens = reported_prompt
+            tracked.input_tokens = prompt_tokens
+            tracked.output_tokens = output_tokens
+            await lease.release(prompt_tokens + output_tokens)
+            if usage is not None:
+                usage.add(
+                    self.calculate_cost(prompt_tokens, output_tokens, model_name),
+                    prompt_tokens + output_tokens,
+                    partial=not finished
+                )
+    
+    def _prompt_tokens(self, messages: List[AIMessage], model: str) -> int:
+        return tokenizer.count_messages(
+            [{"role": msg.role, "content": msg.content} for msg in messages],
+            model
+        )
+    
+    def _estimate_tokens(
+        self,
+        messages: List[AIMessage],
+        model: str,
+        max_tokens: Optional[int]
+    ) -> int:
+        """Prompt tokens plus the expected output, reserved against TPM limits"""
+        
+        prompt_tokens = self._prompt_tokens(messages, model)
+        return prompt_tokens + (max_tokens or settings.AI_LIMITER_DEFAULT_OUTPUT_TOKENS)
+    
+    @abstractmethod
+    async def _chat_completion(
+        self,
+        messages: List[AIMessage],
+        stream: bool = False,
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None
+    ) -> AIResponse | AsyncGenerator[str, None]:
+        """
+        Provider-specific chat completion (called by chat_completion)
+        
+        Args:
+            messages: List of messages
+            stream: Whether to stream response
+            model: Specific model to use
+            temperature: Creativity (0-1)
+            max_tokens: Max response length
+            json_schema: Ask for JSON output (use the native JSON mode)
+        
         Returns:
             AIResponse or AsyncGenerator for streaming
         """
@@ -69,7 +557,7 @@ class AIProvider(ABC):
             input_tokens: Number of input tokens
             output_tokens: Number of output tokens
             model: Model name
-            
+        
         Returns:
             Cost in USD
         """
@@ -83,7 +571,7 @@ class AIProvider(ABC):
         Args:
             text: Text to count
             model: Model for tokenization
-            
+        
         Returns:
             Number of tokens
         """
@@ -99,6 +587,14 @@ class AIProvider(ABC):
         """
         pass
     
+    async def open(self):
+        """Open long-lived resources (HTTP sessions, pools)"""
+        pass
+    
+    async def close(self):
+        """Release long-lived resources"""
+        pass
+    
     def get_default_model(self) -> str:
         """Get default model for this provider"""
         return "default"
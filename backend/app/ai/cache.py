@@ -0,0 +1,176 @@
+"""
+LLM Response Cache
+Exact-match cache for chat completions: in-process LRU + shared Redis tier
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+class ResponseCache:
+    """Two-tier (memory LRU -> Redis) cache keyed by the exact request"""
+    
+    REDIS_PREFIX = "llm_cache:"
+    REDIS_RETRY_AFTER = 30  # Seconds to skip Redis after a connection error
+    
+    def __init__(self):
+        self.enabled = settings.LLM_CACHE_ENABLED
+        self.max_entries = settings.LLM_CACHE_MAX_ENTRIES
+        self.ttl = settings.LLM_CACHE_TTL
+        self.max_temperature = settings.LLM_CACHE_MAX_TEMPERATURE
+        
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._redis_down_until = 0.0
+        self._stats = {
+            "memory_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "skipped": 0,
+            "redis_errors": 0,
+        }
+    
+    # ========================================================================
+    # KEYS
+    # ========================================================================
+    
+    def is_cacheable(self, temperature: float) -> bool:
+        """High-temperature calls are meant to vary, so they are never cached"""
+        
+        cacheable = self.enabled and temperature <= self.max_temperature
+        if not cacheable:
+            self._stats["skipped"] += 1
+        return cacheable
+    
+    @staticmethod
+    def make_key(
+        provider: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int],
+        json_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Build a stable key from provider, model, normalized messages and params"""
+        
+        normalized = [
+            {
+                "role": msg["role"].strip().lower(),
+                "content": (msg["content"] or "").replace("\r\n", "\n").strip()
+            }
+            for msg in messages
+        ]
+        raw = json.dumps(
+            {
+                "provider": provider,
+                "model": model,
+                "messages": normalized,
+                "temperature": round(temperature, 3),
+                "max_tokens": max_tokens,
+                "json_schema": json_schema,
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    # ========================================================================
+    # LOOKUP / STORE
+    # ========================================================================
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached response (memory first, then Redis)"""
+        
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self._stats["expirations"] += 1
+        
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(self.REDIS_PREFIX + key)
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._remember(key, value)
+                    self._stats["redis_hits"] += 1
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+        
+        self._stats["misses"] += 1
+        return None
+    
+    async def set(self, key: str, value: Dict[str, Any]):
+        """Store a response in both tiers"""
+        
+        self._remember(key, value)
+        self._stats["stores"] += 1
+        
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.set(
+                    self.REDIS_PREFIX + key,
+                    json.dumps(value, ensure_ascii=False),
+                    ex=self.ttl
+                )
+            except Exception as e:
+                self._redis_failed(e)
+    
+    def _remember(self, key: str, value: Dict[str, Any]):
+        """Insert into the memory LRU, evicting the oldest entries if full"""
+        
+        self._memory[key] = (time.monotonic() + self.ttl, value)
+        self._memory.move_to_end(key)
+        
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+    
+    # ========================================================================
+    # REDIS
+    # ========================================================================
+    
+    def _get_redis(self):
+        """Redis client, or None while the tier is disabled or backing off"""
+        
+        if not settings.LLM_CACHE_REDIS or time.monotonic() < self._redis_down_until:
+            return None
+        return get_redis()
+    
+    def _redis_failed(self, error: Exception):
+        """Back off from Redis for a while; the memory tier keeps working"""
+        
+        self._stats["redis_errors"] += 1
+        self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+        print(f"⚠️ LLM cache Redis tier unavailable: {error}")
+    
+    # ========================================================================
+    # STATS
+    # ========================================================================
+    
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters"""
+        
+        stats = dict(self._stats)
+        hits = stats["memory_hits"] + stats["redis_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self._memory)
+        return stats
+
+
+# Global singleton
+response_cache = ResponseCache()
@@ -0,0 +1,366 @@
+"""
+Adaptive Provider Concurrency
+AIMD control of how many calls (and so task jobs) run per provider:
+back off multiplicatively when generation time per output token climbs
+above its baseline or errors rise, add one slot at a time while calls
+queue up and every slot is busy. Every process publishes its latency
+and error signals to Redis; one worker at a time runs the controller
+(Redis lock) on the cluster-wide signals. The limits are published to
+Redis and enforced by the provider limiter in every process.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+class ProviderConcurrency:
+    """Current limit and latency baseline for one provider"""
+    
+    def __init__(self, minimum: int, maximum: int, initial: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(maximum, initial))
+        self.baseline_latency: Optional[float] = None
+        self.last_decrease = 0.0
+    
+    def update_baseline(self, latency: float):
+        # Lowest per-token latency seen, drifting up slowly so it follows model changes
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency *= 1 + settings.AI_ADAPTIVE_BASELINE_DRIFT
+
+
+# Take or keep the controller lock
+# KEYS: lock
+# ARGV: owner id, ttl seconds
+CLAIM_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class AdaptiveConcurrency:
+    """Per-provider AIMD concurrency controller"""
+    
+    REDIS_PREFIX = "ai_limiter:adaptive:"
+    HISTORY_KEY = "ai_limiter:adaptive_history"
+    CONTROLLER_KEY = "ai_limiter:adaptive_controller"
+    SIGNALS_PREFIX = "ai_limiter:adaptive_signals:"
+    
+    def __init__(self):
+        self._providers: Dict[str, ProviderConcurrency] = {}
+        self._published: Dict[str, Tuple[Optional[int], float]] = {}
+        self.history: deque = deque(maxlen=settings.AI_ADAPTIVE_HISTORY)
+        self._task: Optional[asyncio.Task] = None
+        self._id = uuid.uuid4().hex
+        self._control = True
+        self.controller = False
+    
+    def _state(self, provider: str) -> Optional[ProviderConcurrency]:
+        bounds = settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS.get(provider)
+        if not bounds:
+            return None
+        if provider not in self._providers:
+            initial = settings.AI_CONCURRENCY_LIMITS.get(provider, bounds[0])
+            self._providers[provider] = ProviderConcurrency(bounds[0], bounds[1], initial)
+        return self._providers[provider]
+    
+    # ========================================================================
+    # LIMIT LOOKUP (any process)
+    # ========================================================================
+    
+    async def limit(self, provider: str) -> Optional[int]:
+        """
+        Current adaptive limit for a provider, None if not adaptive
+        
+        Processes without the controller (API, other workers) read the
+        limit it published, cached for one control interval.
+        """
+        if not settings.AI_ADAPTIVE_CONCURRENCY or provider not in settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS:
+            return None
+        
+        if self.controller:
+            return self._state(provider).limit
+        
+        cached, fetched_at = self._published.get(provider, (None, 0.0))
+        if time.monotonic() - fetched_at < settings.AI_ADAPTIVE_INTERVAL:
+            return cached
+        
+        try:
+            value = await get_redis().get(self.REDIS_PREFIX + provider)
+            cached = int(value) if value is not None else None
+        except Exception:
+            cached = None  # Static limits apply
+        self._published[provider] = (cached, time.monotonic())
+        return cached
+    
+    # ========================================================================
+    # CONTROL LOOP (signals: every process, control: workers)
+    # ========================================================================
+    
+    async def start(self, control: bool = True):
+        """
+        Start publishing signals (and adjusting limits) in the background
+        
+        Args:
+            control: Compete for the controller role (workers); the API
+                only publishes the signals of the calls it makes
+        """
+        if not settings.AI_ADAPTIVE_CONCURRENCY:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._control = control
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the control loop and hand the controller role to another worker"""
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        if self.controller:
+            self.controller = False
+            try:
+                redis = get_redis()
+                if await redis.get(self.CONTROLLER_KEY) == self._id:
+                    await redis.delete(self.CONTROLLER_KEY)
+            except Exception:
+                pass  # The lock expires on its own
+    
+    async def _claim_controller(self) -> bool:
+        """
+        Whether this worker runs the control step
+        
+        Every worker starts the loop, one holds the controller lock at a
+        time, so workers don't overwrite each other's limits. A new
+        controller continues from the published limits.
+        """
+        redis = get_redis()
+        try:
+            claimed = bool(await redis.eval(
+                CLAIM_SCRIPT,
+                1,
+                self.CONTROLLER_KEY,
+                self._id,
+                int(settings.AI_ADAPTIVE_INTERVAL * 3)
+            ))
+        except Exception:
+            self.controller = False
+            raise
+        
+        if claimed and not self.controller:
+            for provider in settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS:
+                value = await redis.get(self.REDIS_PREFIX + provider)
+                if value is not None:
+                    state = self._state(provider)
+                    state.limit = max(state.minimum, min(state.maximum, int(value)))
+            print("🎚️ Adaptive concurrency controller running in this worker")
+        self.controller = claimed
+        return claimed
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.AI_ADAPTIVE_INTERVAL)
+            try:
+                await self.adjust()
+            except Exception as e:
+                print(f"⚠️ Adaptive concurrency update failed: {e}")
+    
+    async def adjust(self) -> List[Dict[str, Any]]:
+        """
+        One control step for every provider with bounds
+        
+        Returns:
+            The samples recorded for this step (none if another worker
+            is the controller)
+        """
+        from app.core.queue import queue_stats
+        
+        await self._publish_signals()
+        if not self._control or not await self._claim_controller():
+            return []
+        
+        queued_tasks = sum(
+            entry.get("depth", 0)
+            for entry in (await queue_stats()).values()
+            if isinstance(entry, dict)
+        )
+        
+        samples = []
+        for provider in settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS:
+            state = self._state(provider)
+            signals = await self._signals(provider)
+            previous = state.limit
+            reason = self._decide(state, signals, queued_tasks)
+            
+            sample = {
+                "ts": round(time.time(), 1),
+                "provider": provider,
+                "limit": state.limit,
+                "previous": previous,
+                "reason": reason,
+                "token_latency_s": signals["latency"],
+                "baseline_s": state.baseline_latency,
+                "error_rate": signals["error_rate"],
+                "waiting": signals["waiting"],
+                "in_use": signals["in_use"],
+                "queued_tasks": queued_tasks,
+            }
+            self.history.append(sample)
+            samples.append(sample)
+            
+            if state.limit != previous:
+                print(f"🎚️ {provider} concurrency {previous} → {state.limit} ({reason})")
+            await self._publish(provider, state.limit, sample)
+        
+        return samples
+    
+    @staticmethod
+    def _local_signals(provider: str) -> Dict[str, Any]:
+        """Per-token latency and errors of this process's recent calls"""
+        from app.ai.routing import provider_router
+        
+        latencies, error_rates = [], []
+        for (name, _model), stats in provider_router._stats.items():
+            if name != provider or not stats.calls:
+                continue
+            if time.time() - stats.last_updated > settings.AI_ADAPTIVE_INTERVAL * 3:
+                continue  # No recent calls, the EWMA is stale
+            if stats.ewma_token_latency is not None:
+                latencies.append(stats.ewma_token_latency)
+            error_rates.append(stats.error_rate())
+        
+        return {
+            "latency": max(latencies) if latencies else None,
+            "error_rate": max(error_rates) if error_rates else None,
+        }
+    
+    async def _publish_signals(self):
+        """Share this process's signals with the controller"""
+        
+        try:
+            pipe = get_redis().pipeline()
+            for provider in settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS:
+                signals = self._local_signals(provider)
+                if signals["error_rate"] is None:
+                    continue  # No recent calls
+                key = self.SIGNALS_PREFIX + provider
+                pipe.hset(key, self._id, json.dumps({**signals, "ts": time.time()}))
+                pipe.expire(key, int(settings.AI_ADAPTIVE_INTERVAL * 6))
+            await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Adaptive concurrency signals not published: {e}")
+    
+    async def _signals(self, provider: str) -> Dict[str, Any]:
+        """Latency/errors published by every process, slots and waiters from the shared limiter"""
+        from app.ai.limiter import provider_limiter
+        
+        latencies, error_rates = [], []
+        published = await get_redis().hgetall(self.SIGNALS_PREFIX + provider)
+        for raw in published.values():
+            signals = json.loads(raw)
+            if time.time() - signals["ts"] > settings.AI_ADAPTIVE_INTERVAL * 3:
+                continue  # Process stopped or made no recent calls
+            if signals["latency"] is not None:
+                latencies.append(signals["latency"])
+            error_rates.append(signals["error_rate"])
+        
+        # Compared with the cluster-wide limit, so counted across processes
+        in_use, waiting = await provider_limiter.cluster_usage(provider)
+        
+        return {
+            "latency": max(latencies) if latencies else None,
+            "error_rate": max(error_rates) if error_rates else 0.0,
+            "waiting": waiting,
+            "in_use": in_use,
+        }
+    
+    @staticmethod
+    def _decide(state: ProviderConcurrency, signals: Dict[str, Any], queued_tasks: int) -> str:
+        """Apply AIMD to state.limit, return the reason"""
+        
+        latency = signals["latency"]
+        now = time.monotonic()
+        # One decrease per cooldown, so a single slow phase isn't punished twice
+        can_decrease = now - state.last_decrease >= settings.AI_ADAPTIVE_COOLDOWN
+        
+        if signals["error_rate"] > settings.AI_ADAPTIVE_MAX_ERROR_RATE and can_decrease:
+            state.limit = max(state.minimum, int(state.limit * settings.AI_ADAPTIVE_DECREASE))
+            state.last_decrease = now
+            return "errors"
+        
+        if latency is not None:
+            overloaded = (
+                state.baseline_latency is not None
+                and latency > state.baseline_latency * settings.AI_ADAPTIVE_LATENCY_FACTOR
+            )
+            state.update_baseline(latency)
+            if overloaded and can_decrease:
+                state.limit = max(state.minimum, int(state.limit * settings.AI_ADAPTIVE_DECREASE))
+                state.last_decrease = now
+                return "latency"
+        
+        saturated = signals["in_use"] >= state.limit
+        if saturated and (signals["waiting"] > 0 or queued_tasks > 0):
+            state.limit = min(state.maximum, state.limit + 1)
+            return "demand"
+        
+        return "hold"
+    
+    async def _publish(self, provider: str, limit: int, sample: Dict[str, Any]):
+        try:
+            redis = get_redis()
+            pipe = redis.pipeline()
+            # Expires if the worker stops; static limits apply again
+            pipe.set(self.REDIS_PREFIX + provider, limit, ex=int(settings.AI_ADAPTIVE_INTERVAL * 6))
+            pipe.lpush(self.HISTORY_KEY, json.dumps(sample))
+            pipe.ltrim(self.HISTORY_KEY, 0, settings.AI_ADAPTIVE_HISTORY - 1)
+            await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Adaptive concurrency not published: {e}")
+    
+    # ========================================================================
+    # STATS
+    # ========================================================================
+    
+    async def snapshot(self) -> dict:
+        """Current limits and recent history (from Redis, so any process can report)"""
+        
+        try:
+            redis = get_redis()
+            limits = {}
+            for provider in settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS:
+                value = await redis.get(self.REDIS_PREFIX + provider)
+                limits[provider] = int(value) if value is not None else None
+            history = [json.loads(entry) for entry in await redis.lrange(self.HISTORY_KEY, 0, 49)]
+        except Exception as e:
+            return {"enabled": settings.AI_ADAPTIVE_CONCURRENCY, "error": str(e)}
+        
+        return {
+            "enabled": settings.AI_ADAPTIVE_CONCURRENCY,
+            "bounds": settings.AI_ADAPTIVE_CONCURRENCY_BOUNDS,
+            "limits": limits,
+            "history": history,
+        }
+
+
+# Global singleton
+adaptive_concurrency = AdaptiveConcurrency()
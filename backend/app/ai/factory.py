@@ -7,6 +7,10 @@ from typing import Optional, List
 from app.ai.base import AIProvider
 from app.ai.openai_provider import OpenAIProvider
 from app.ai.ollama_provider import OllamaProvider
+from app.ai.health import health_monitor
+from app.ai.routing import provider_router
+from app.ai.hedging import HedgedProvider
+from app.core.config import settings
 
 
 class ProviderFactory:
@@ -14,21 +18,48 @@ class ProviderFactory:
     
     _instances = {}
     
+    # Implemented providers
+    _providers = {
+        "openai": lambda: OpenAIProvider(os.getenv("OPENAI_API_KEY")),
+        "ollama": lambda: OllamaProvider(),
+        # TODO: Add Claude and Gemini when implemented
+        # "claude": lambda: ClaudeProvider(os.getenv("ANTHROPIC_API_KEY")),
+        # "gemini": lambda: GeminiProvider(os.getenv("GOOGLE_API_KEY")),
+    }
+    
     @classmethod
-    def get_provider(cls, provider_name: str) -> AIProvider:
+    def get_provider(
+        cls,
+        provider_name: str,
+        urgency: Optional[str] = None
+    ) -> AIProvider:
         """
         Get AI provider instance
         
         Args:
             provider_name: Name of provider (openai, claude, gemini, ollama, auto)
+            urgency: Task urgency (flexible/today/asap), used by auto routing
             
         Returns:
             AIProvider instance
         """
         
+        # Accept DB enums as well as plain strings
+        provider_name = getattr(provider_name, "value", provider_name)
+        urgency = getattr(urgency, "value", urgency)
+        
         # Handle AUTO selection
         if provider_name == "auto":
-            provider_name = cls._select_best_provider()
+            provider_name = cls._select_best_provider(urgency)
+            
+            # ASAP: race a second backend if the chosen one is slow
+            if settings.AI_HEDGING_ENABLED and urgency == "asap":
+                secondary = cls._select_hedge_provider(provider_name)
+                if secondary is not None:
+                    return HedgedProvider(
+                        cls.get_provider(provider_name),
+                        cls.get_provider(secondary)
+                    )
         
         # Return cached instance if exists
         if provider_name in cls._instances:
@@ -43,33 +74,66 @@ class ProviderFactory:
     def _create_provider(cls, provider_name: str) -> AIProvider:
         """Create provider instance"""
         
-        providers = {
-            "openai": lambda: OpenAIProvider(os.getenv("OPENAI_API_KEY")),
-            "ollama": lambda: OllamaProvider(),
-            # TODO: Add Claude and Gemini when implemented
-            # "claude": lambda: ClaudeProvider(os.getenv("ANTHROPIC_API_KEY")),
-            # "gemini": lambda: GeminiProvider(os.getenv("GOOGLE_API_KEY")),
-        }
-        
-        if provider_name not in providers:
+        if provider_name not in cls._providers:
             print(f"Warning: Provider '{provider_name}' not found, falling back to ollama")
             provider_name = "ollama"
         
-        return providers[provider_name]()
+        return cls._providers[provider_name]()
     
     @classmethod
-    def _select_best_provider(cls) -> str:
+    def _is_configured(cls, provider_name: str) -> bool:
+        """Whether a provider has the credentials it needs"""
+        
+        if provider_name == "openai":
+            return bool(os.getenv("OPENAI_API_KEY"))
+        return provider_name == "ollama"
+    
+    @classmethod
+    def monitored_providers(cls) -> List[str]:
+        """Implemented providers with credentials, probed by the background health monitor"""
+        return [name for name in cls._providers if cls._is_configured(name)]
+    
+    @classmethod
+    def _select_best_provider(cls, urgency: Optional[str] = None) -> str:
         """
         Select best available provider
-        Priority: ollama (free) -> openai -> claude -> gemini
+        
+        Routes between configured, healthy providers using observed
+        latency / error rate / cost (see AI_ROUTING_POLICY).
+        ASAP tasks always go to the fastest healthy backend.
         """
         
-        # Check which providers have API keys
-        if os.getenv("OPENAI_API_KEY"):
-            return "openai"
+        candidates = [
+            (name, cls.get_provider(name).get_default_model())
+            for name in cls.monitored_providers()
+            if health_monitor.is_available(name)
+        ]
         
         # Default to free Ollama
-        return "ollama"
+        if not candidates:
+            return "ollama"
+        
+        def static_cost_per_1k(provider_name: str, model: str) -> float:
+            return cls.get_provider(provider_name).calculate_cost(500, 500, model)
+        
+        return provider_router.choose(candidates, static_cost_per_1k, urgency)
+    
+    @classmethod
+    def _select_hedge_provider(cls, primary: str) -> Optional[str]:
+        """Fastest healthy provider other than the primary, if any"""
+        
+        candidates = [
+            (name, cls.get_provider(name).get_default_model())
+            for name in cls.monitored_providers()
+            if name != primary and health_monitor.is_available(name)
+        ]
+        if not candidates:
+            return None
+        
+        def static_cost_per_1k(provider_name: str, model: str) -> float:
+            return cls.get_provider(provider_name).calculate_cost(500, 500, model)
+        
+        return provider_router.choose(candidates, static_cost_per_1k, "asap")
     
     @classmethod
     async def get_fallback_provider(
@@ -96,31 +160,54 @@ class ProviderFactory:
         
         for provider_name in fallback_order:
             if provider_name not in tried_providers:
-                provider = cls.get_provider(provider_name)
-                if await provider.health_check():
-                    return provider
+                # Cached health + circuit state, no network I/O
+                if provider_name not in cls.monitored_providers():
+                    continue
+                if health_monitor.is_available(provider_name):
+                    return cls.get_provider(provider_name)
         
         return None
     
     @classmethod
-    async def health_check_all(cls) -> dict:
-        """Check health of all providers"""
+    async def startup(cls):
+        """Open shared provider resources (called by app and worker startup)"""
+        
+        await cls.get_provider("ollama").open()
+        await health_monitor.start(cls.monitored_providers(), cls._probe)
+    
+    @classmethod
+    async def shutdown(cls):
+        """Close shared provider resources"""
         
-        providers = ["openai", "ollama"]  # TODO: Add claude, gemini
-        results = {}
+        await health_monitor.stop()
         
-        for provider_name in providers:
+        for provider in list(cls._instances.values()):
             try:
-                provider = cls.get_provider(provider_name)
-                is_healthy = await provider.health_check()
-                results[provider_name] = "healthy" if is_healthy else "unhealthy"
+                await provider.close()
             except Exception as e:
-                results[provider_name] = f"error: {str(e)}"
+                print(f"Warning: Failed to close provider '{provider.name}': {e}")
+    
+    @classmethod
+    async def _probe(cls, provider_name: str) -> bool:
+        """Live health check (only called by the background prober)"""
         
-        return results
+        provider = cls.get_provider(provider_name)
+        return await provider.health_check()
+    
+    @classmethod
+    async def health_check_all(cls) -> dict:
+        """Health of all providers (cached by the background prober)"""
+        
+        return {
+            provider_name: health_monitor.status(provider_name)
+            for provider_name in cls.monitored_providers()
+        }
 
 
 # Convenience function
-def get_ai_provider(provider_name: str = "auto") -> AIProvider:
+def get_ai_provider(
+    provider_name: str = "auto",
+    urgency: Optional[str] = None
+) -> AIProvider:
     """Get AI provider instance"""
-    return ProviderFactory.get_provider(provider_name)
+    return ProviderFactory.get_provider(provider_name, urgency)
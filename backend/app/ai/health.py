@@ -0,0 +1,230 @@
+"""
+Provider Health Monitor
+Background health probing plus per-provider circuit breakers,
+so request paths read provider state without any network I/O
+"""
+import asyncio
+import enum
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from app.core.config import settings
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"  # Normal operation
+    OPEN = "open"  # Failing - reject calls until recovery timeout
+    HALF_OPEN = "half_open"  # Trial calls decide whether to close again
+
+
+class CircuitBreaker:
+    """Circuit breaker fed by real call outcomes"""
+    
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+    
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state == CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self.recovery_timeout
+        ):
+            self._state = CircuitState.HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+    
+    def allow_request(self) -> bool:
+        """Whether a call may go to the provider right now"""
+        
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and self._trial_calls < self.half_open_max_calls:
+            self._trial_calls += 1
+            return True
+        return False
+    
+    @property
+    def accepting_calls(self) -> bool:
+        """Like allow_request, without taking a half-open trial slot"""
+        
+        state = self.state
+        if state == CircuitState.HALF_OPEN:
+            return self._trial_calls < self.half_open_max_calls
+        return state == CircuitState.CLOSED
+    
+    def release_trial(self):
+        """Give back a trial slot whose call ended without an outcome (cancelled)"""
+        
+        if self._state == CircuitState.HALF_OPEN and self._trial_calls > 0:
+            self._trial_calls -= 1
+    
+    def record_success(self):
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._trial_calls = 0
+    
+    def record_failure(self):
+        self._failures += 1
+        if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+    
+    def snapshot(self) -> dict:
+        return {"state": self.state.value, "failures": self._failures}
+
+
+class ProviderHealthMonitor:
+    """Cached provider health, refreshed by a background prober"""
+    
+    def __init__(self):
+        self._health: Dict[str, dict] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    # ========================================================================
+    # STATE (O(1), no I/O)
+    # ========================================================================
+    
+    def breaker(self, provider_name: str) -> CircuitBreaker:
+        """Get (or create) the circuit breaker for a provider"""
+        
+        if provider_name not in self._breakers:
+            self._breakers[provider_name] = CircuitBreaker(
+                failure_threshold=settings.AI_BREAKER_FAILURE_THRESHOLD,
+                recovery_timeout=settings.AI_BREAKER_RECOVERY_TIMEOUT
+            )
+        return self._breakers[provider_name]
+    
+    def is_available(self, provider_name: str) -> bool:
+        """Last probe did not fail and the circuit accepts calls"""
+        
+        health = self._health.get(provider_name)
+        if health is not None and not health["healthy"]:
+            return False
+        return self.breaker(provider_name).accepting_calls
+    
+    def status(self, provider_name: str) -> str:
+        """Human-readable status (same format as the old live checks)"""
+        
+        health = self._health.get(provider_name)
+        if health is None:
+            return "unknown"
+        if health.get("error"):
+            return f"error: {health['error']}"
+        if self.breaker(provider_name).state == CircuitState.OPEN:
+            return "unhealthy"
+        return "healthy" if health["healthy"] else "unhealthy"
+    
+    def snapshot(self) -> dict:
+        """Detailed health and breaker state for every known provider"""
+        
+        names = set(self._health) | set(self._breakers)
+        return {
+            name: {
+                "status": self.status(name),
+                "checked_at": self._health.get(name, {}).get("checked_at"),
+                "probe_latency_ms": self._health.get(name, {}).get("latency_ms"),
+                "circuit": self.breaker(name).snapshot(),
+            }
+            for name in sorted(names)
+        }
+    
+    # ========================================================================
+    # BACKGROUND PROBER
+    # ========================================================================
+    
+    async def probe(
+        self,
+        provider_name: str,
+        check: Callable[[str], Awaitable[bool]]
+    ):
+        """Run one health check and store the result"""
+        
+        started = time.monotonic()
+        error = None
+        
+        try:
+            healthy = await asyncio.wait_for(
+                check(provider_name),
+                timeout=settings.AI_HEALTH_PROBE_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            healthy, error = False, "health check timed out"
+        except Exception as e:
+            healthy, error = False, str(e)
+        
+        self._health[provider_name] = {
+            "healthy": healthy,
+            "error": error,
+            "checked_at": time.time(),
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        
+        # A healthy probe after the recovery timeout closes the circuit,
+        # so recovery does not depend on a trial call from live traffic
+        breaker = self.breaker(provider_name)
+        if healthy and breaker.state == CircuitState.HALF_OPEN:
+            breaker.record_success()
+    
+    async def probe_all(
+        self,
+        provider_names: List[str],
+        check: Callable[[str], Awaitable[bool]]
+    ):
+        """Probe all providers concurrently"""
+        
+        await asyncio.gather(
+            *(self.probe(name, check) for name in provider_names)
+        )
+    
+    async def start(
+        self,
+        provider_names: List[str],
+        check: Callable[[str], Awaitable[bool]]
+    ):
+        """Probe once, then keep probing in the background"""
+        
+        if self._task is not None and not self._task.done():
+            return
+        
+        await self.probe_all(provider_names, check)
+        self._task = asyncio.create_task(self._run(provider_names, check))
+    
+    async def _run(
+        self,
+        provider_names: List[str],
+        check: Callable[[str], Awaitable[bool]]
+    ):
+        while True:
+            await asyncio.sleep(settings.AI_HEALTH_PROBE_INTERVAL)
+            try:
+                await self.probe_all(provider_names, check)
+            except Exception as e:
+                print(f"⚠️ Provider health probe failed: {e}")
+    
+    async def stop(self):
+        """Stop the background prober"""
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global singleton
+health_monitor = ProviderHealthMonitor()
@@ -0,0 +1,304 @@
+"""
+Hedged Requests
+If the primary provider is slow to answer (or to stream its first token),
+send the same request to a second provider; the first answer wins
+
+Each leg is metered on its own; only the winner's usage (the primary's
+if there is no winner) is added to the task's meter, so the loser is
+never billed, whether the task completes or is cancelled.
+"""
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Dict, List, Optional
+from app.ai.base import AIProvider, AIMessage, AIResponse
+from app.ai.routing import provider_router
+from app.ai.usage import TaskUsage, current_usage, track_usage
+from app.core.config import settings
+
+
+class HedgeBudget:
+    """Token bucket capping the share of requests that get duplicated"""
+    
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+    
+    def on_request(self):
+        """Every request earns a fraction of a hedge"""
+        self._tokens = min(self._tokens + self.ratio, self.burst)
+    
+    def try_acquire(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+
+class HedgingStats:
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.secondary_wins = 0
+        self.budget_denied = 0
+    
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "secondary_wins": self.secondary_wins,
+            "budget_denied": self.budget_denied,
+            "budget_tokens": round(hedge_budget._tokens, 3),
+        }
+
+
+hedge_budget = HedgeBudget(
+    ratio=settings.AI_HEDGE_BUDGET_RATIO,
+    burst=settings.AI_HEDGE_BUDGET_BURST
+)
+hedging_stats = HedgingStats()
+
+
+class HedgedStream:
+    """
+    Chunks of a hedged stream
+    
+    `provider` is the backend that won the first-token race (the primary
+    until the race is decided), so callers bill and label the reply by it.
+    `input_tokens`/`output_tokens` are the winning leg's counts once the
+    stream has been closed.
+    """
+    
+    def __init__(self, provider: AIProvider):
+        self.provider = provider
+        self.stream: Optional[AsyncGenerator[str, None]] = None
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self) -> str:
+        return await self.stream.__anext__()
+    
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class HedgedProvider(AIProvider):
+    """Wraps a primary and a secondary provider and races them on slow calls"""
+    
+    def __init__(self, primary: AIProvider, secondary: AIProvider):
+        super().__init__()
+        self.primary = primary
+        self.secondary = secondary
+        self.name = primary.name
+    
+    def _hedge_delay(self, model: Optional[str], stream: bool) -> float:
+        """Wait this long for the primary before hedging (percentile-based)"""
+        
+        stats = provider_router.stats(
+            self.primary.name,
+            model or self.primary.get_default_model()
+        )
+        if stream:
+            observed = stats.ttft_percentile(settings.AI_HEDGE_PERCENTILE)
+        else:
+            observed = stats.latency_percentile(settings.AI_HEDGE_PERCENTILE)
+        
+        if observed is None:
+            return settings.AI_HEDGE_DEFAULT_DELAY
+        return max(observed, settings.AI_HEDGE_MIN_DELAY)
+    
+    async def chat_completion(
+        self,
+        messages: List[AIMessage],
+        stream: bool = False,
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        cache: bool = True,
+        json_schema: Optional[Dict[str, Any]] = None,
+        phase: Optional[str] = None
+    ) -> AIResponse | HedgedStream:
+        """Race primary and secondary; only the winner's response is returned"""
+        
+        hedging_stats.requests += 1
+        hedge_budget.on_request()
+        
+        # The model name belongs to the primary, the secondary uses its default
+        if stream:
+            if json_schema is not None:
+                raise ValueError("json_schema is not supported with stream=True")
+            hedged = HedgedStream(self.primary)
+            hedged.stream = self._hedged_stream(
+                hedged, messages, model, temperature, max_tokens, cache
+            )
+            return hedged
+        
+        delay = self._hedge_delay(model, stream=False)
+        task_usage = current_usage()
+        primary_usage, secondary_usage = TaskUsage(), TaskUsage()
+        winner_usage = primary_usage
+        primary = asyncio.create_task(self._metered(
+            primary_usage,
+            self.primary.chat_completion(
+                messages, False, model, temperature, max_tokens, cache, json_schema, phase
+            )
+        ))
+        tasks = {primary}
+        
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._may_hedge():
+                return await primary
+            
+            secondary = asyncio.create_task(self._metered(
+                secondary_usage,
+                self.secondary.chat_completion(
+                    messages, False, None, temperature, max_tokens, cache, json_schema, phase
+                )
+            ))
+            tasks.add(secondary)
+            
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for finished in done:
+                    if finished.exception() is None:
+                        if finished is secondary:
+                            hedging_stats.secondary_wins += 1
+                            winner_usage = secondary_usage
+                        return finished.result()
+                    if finished is primary or error is None:
+                        error = finished.exception()
+            
+            raise error
+        finally:
+            # Cancel the loser (its partial cost is never billed)
+            for task in tasks:
+                task.cancel()
+            winner_usage.bill_to(task_usage)
+    
+    @staticmethod
+    async def _metered(usage: TaskUsage, call: Awaitable[AIResponse]) -> AIResponse:
+        """Run one leg on its own usage meter"""
+        
+        with track_usage(usage):
+            return await call
+    
+    def _may_hedge(self) -> bool:
+        if hedge_budget.try_acquire():
+            hedging_stats.hedged += 1
+            return True
+        hedging_stats.budget_denied += 1
+        return False
+    
+    async def _hedged_stream(
+        self,
+        hedged: HedgedStream,
+        messages: List[AIMessage],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        cache: bool
+    ) -> AsyncGenerator[str, None]:
+        """Race on the first token, then keep streaming from the winner"""
+        
+        delay = self._hedge_delay(model, stream=True)
+        task_usage = current_usage()
+        primary_usage, secondary_usage = TaskUsage(), TaskUsage()
+        winner_usage = primary_usage
+        
+        # The stream's usage goes to the meter active when it was opened
+        with track_usage(primary_usage):
+            primary_stream = await self.primary.chat_completion(
+                messages, True, model, temperature, max_tokens, cache
+            )
+        streams = {}
+        first = asyncio.create_task(primary_stream.__anext__())
+        streams[first] = primary_stream
+        winner = None
+        
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            
+            if not done and self._may_hedge():
+                with track_usage(secondary_usage):
+                    secondary_stream = await self.secondary.chat_completion(
+                        messages, True, None, temperature, max_tokens, cache
+                    )
+                second = asyncio.create_task(secondary_stream.__anext__())
+                streams[second] = secondary_stream
+            
+            pending = set(streams)
+            error = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for finished in done:
+                    exc = finished.exception()
+                    if exc is None or isinstance(exc, StopAsyncIteration):
+                        winner = finished
+                        break
+                    if finished is first or error is None:
+                        error = exc
+            
+            if winner is None:
+                raise error
+            
+            if winner is not first:
+                hedging_stats.secondary_wins += 1
+                hedged.provider = self.secondary
+                winner_usage = secondary_usage
+            
+            # Stop the loser before streaming on
+            for task, stream in streams.items():
+                if task is not winner:
+                    await self._stop_stream(task, stream)
+            
+            if isinstance(winner.exception(), StopAsyncIteration):
+                return
+            
+            yield winner.result()
+            async for chunk in streams[winner]:
+                yield chunk
+        finally:
+            winner_usage.bill_to(task_usage)
+            for task, stream in streams.items():
+                await self._stop_stream(task, stream)
+            if winner is not None:
+                hedged.input_tokens = getattr(streams[winner], "input_tokens", None)
+                hedged.output_tokens = getattr(streams[winner], "output_tokens", None)
+    
+    @staticmethod
+    async def _stop_stream(task: asyncio.Task, stream: AsyncGenerator[str, None]):
+        """Cancel a pending first-token read and close its stream"""
+        
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await stream.aclose()
+    
+    async def _chat_completion(self, *args, **kwargs):
+        return await self.primary._chat_completion(*args, **kwargs)
+    
+    def calculate_cost(self, input_tokens: int, output_tokens: int, model: str) -> float:
+        return self.primary.calculate_cost(input_tokens, output_tokens, model)
+    
+    def count_tokens(self, text: str, model: str) -> int:
+        return self.primary.count_tokens(text, model)
+    
+    async def health_check(self) -> bool:
+        return await self.primary.health_check()
+    
+    def get_default_model(self) -> str:
+        return self.primary.get_default_model()
+    
+    def get_available_models(self) -> List[str]:
+        return self.primary.get_available_models()
@@ -0,0 +1,578 @@
+"""
+Provider Rate Limiter
+Caps concurrent requests and tokens per minute per provider/model.
+State lives in Redis so the API and every worker share the same limits;
+waiting callers queue in deadline order (see call_priority) instead
+of failing.
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.ai.concurrency import adaptive_concurrency
+
+
+# Enqueue (first call) and try to take a slot. Only the first `free`
+# waiters in priority order may acquire, which keeps the queue fair.
+# KEYS: queue, holders, heartbeats
+# ARGV: member, limit, now, lease expiry, stale-waiter cutoff, key ttl, priority
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])
+for _, waiter in ipairs(stale) do
+    redis.call('ZREM', KEYS[1], waiter)
+    redis.call('ZREM', KEYS[3], waiter)
+end
+redis.call('ZADD', KEYS[1], 'NX', ARGV[7], ARGV[1])
+redis.call('ZADD', KEYS[3], now, ARGV[1])
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ARGV[6])
+end
+local rank = redis.call('ZRANK', KEYS[1], ARGV[1])
+local free = tonumber(ARGV[2]) - redis.call('ZCARD', KEYS[2])
+if rank < free then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Reserve tokens in a sliding one-minute window. Returns "0" when
+# reserved, otherwise the seconds to wait (as a string - Lua numbers
+# are truncated to integers in replies).
+# KEYS: window
+# ARGV: member ("<id>:<tokens>"), tokens, limit, now, window seconds
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[4])
+local window = tonumber(ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local entries = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+local used = 0
+for i = 1, #entries, 2 do
+    used = used + tonumber(string.match(entries[i], ':(%d+)$'))
+end
+local tokens = tonumber(ARGV[2])
+if used + tokens <= tonumber(ARGV[3]) or #entries == 0 then
+    redis.call('ZADD', KEYS[1], now, ARGV[1])
+    redis.call('EXPIRE', KEYS[1], math.ceil(window) + 1)
+    return '0'
+end
+local needed = used + tokens - tonumber(ARGV[3])
+local freed = 0
+for i = 1, #entries, 2 do
+    freed = freed + tonumber(string.match(entries[i], ':(%d+)$'))
+    if freed >= needed then
+        return tostring(tonumber(entries[i + 1]) + window - now)
+    end
+end
+return tostring(window)
+"""
+
+# Replace a token reservation with the actual usage (same timestamp)
+# KEYS: window
+# ARGV: reserved member, settled member
+SETTLE_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZADD', KEYS[1], score, ARGV[2])
+end
+return 0
+"""
+
+
+# Limiter priority of the calls made in this context (lower goes first)
+_call_priority: ContextVar[Optional[float]] = ContextVar("call_priority", default=None)
+
+
+@contextmanager
+def call_priority(score: float) -> Iterator[None]:
+    """
+    Order the limiter waits of every call made inside the block by score
+    
+    The worker passes the job's queue score (app/core/queue.py), so jobs
+    keep their deadline order while they wait for a provider slot. Calls
+    outside a block (API requests) are ordered by arrival time.
+    """
+    token = _call_priority.set(score)
+    try:
+        yield
+    finally:
+        _call_priority.reset(token)
+
+
+class _LocalLimits:
+    """In-process fallback used while Redis is unreachable"""
+    
+    def __init__(self):
+        self.limit = 0
+        self.in_use = 0
+        self.waiters: deque = deque()  # Futures of callers waiting for a slot
+        self.window: deque = deque()  # [timestamp, tokens, member]
+    
+    async def acquire_slot(self, limit: int):
+        """
+        Wait (in FIFO order) for a slot under the current limit
+        
+        The limit is taken from every call, so an adaptive change applies
+        right away: a raised limit admits queued callers, a lowered one
+        holds new callers back until enough slots are released.
+        """
+        
+        self.limit = limit
+        self._wake()
+        if not self.waiters and self.in_use < self.limit:
+            self.in_use += 1
+            return
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # Handed a slot just as we were cancelled
+                self.release_slot()
+            raise
+    
+    def release_slot(self):
+        self.in_use -= 1
+        self._wake()
+    
+    def _wake(self):
+        """Hand free slots to waiters"""
+        
+        while self.waiters and self.in_use < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_use += 1
+                waiter.set_result(None)
+    
+    def reserve(self, member: str, tokens: int, limit: int, now: float) -> float:
+        """Reserve tokens, or return the seconds to wait"""
+        
+        while self.window and self.window[0][0] <= now - 60:
+            self.window.popleft()
+        
+        used = sum(entry[1] for entry in self.window)
+        if used + tokens <= limit or not self.window:
+            self.window.append([now, tokens, member])
+            return 0.0
+        
+        freed = 0
+        for timestamp, reserved, _ in self.window:
+            freed += reserved
+            if freed >= used + tokens - limit:
+                return timestamp + 60 - now
+        return 60.0
+    
+    def settle(self, member: str, tokens_used: int):
+        """Replace a reservation with the actual usage"""
+        
+        for entry in self.window:
+            if entry[2] == member:
+                entry[1] = tokens_used
+                return
+
+
+class WaitStats:
+    """Queue wait time for one provider/model (limiter wait, not model latency)"""
+    
+    def __init__(self, window: int = 200):
+        self.acquired = 0
+        self.queued = 0
+        self.waiting = 0
+        self.in_use = 0
+        self.token_waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits: deque = deque(maxlen=window)
+    
+    def record_wait(self, seconds: float):
+        self.acquired += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.waits.append(seconds)
+        if seconds > 0.001:
+            self.queued += 1
+    
+    def snapshot(self) -> dict:
+        ordered = sorted(self.waits)
+        p95 = ordered[min(int(round(0.95 * (len(ordered) - 1))), len(ordered) - 1)] if ordered else None
+        
+        return {
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "waiting_now": self.waiting,
+            "in_use": self.in_use,
+            "token_waits": self.token_waits,
+            "wait_avg_s": round(self.total_wait / self.acquired, 4) if self.acquired else 0.0,
+            "wait_p95_s": round(p95, 4) if p95 is not None else None,
+            "wait_max_s": round(self.max_wait, 4),
+        }
+
+
+class Lease:
+    """A held concurrency slot plus a token reservation"""
+    
+    def __init__(
+        self,
+        limiter: "ProviderLimiter",
+        key: Tuple[str, str],
+        member: str,
+        backend: str,
+        tokens: int = 0,
+        holds_slot: bool = False
+    ):
+        self.limiter = limiter
+        self.key = key
+        self.member = member
+        self.backend = backend
+        self.tokens = tokens
+        self.token_backend = backend
+        self.holds_slot = holds_slot
+        self.counted = False
+        self.released = False
+        self.renewal: Optional[asyncio.Task] = None
+    
+    async def release(self, tokens_used: Optional[int] = None):
+        """
+        Free the slot and settle the token reservation
+        
+        Args:
+            tokens_used: Actual usage; replaces the up-front estimate
+        """
+        
+        if self.released:
+            return
+        self.released = True
+        if self.renewal is not None:
+            self.renewal.cancel()
+        await self.limiter._release(self, tokens_used)
+
+
+class ProviderLimiter:
+    """Distributed (Redis) concurrency + tokens-per-minute limiter"""
+    
+    PREFIX = "ai_limiter:"
+    POLL_INTERVAL = 0.05  # Seconds, doubled per retry up to MAX_POLL_INTERVAL
+    MAX_POLL_INTERVAL = 0.5
+    WAITER_TIMEOUT = 10  # Waiters silent for this long are dropped from the queue
+    REDIS_RETRY_AFTER = 30  # Seconds to use local limits after a Redis error
+    TOKEN_WINDOW = 60  # Seconds
+    
+    def __init__(self):
+        self._local: Dict[Tuple[str, str], _LocalLimits] = {}
+        self._stats: Dict[Tuple[str, str], WaitStats] = {}
+        self._scripts = None
+        self._redis_down_until = 0.0
+        self.redis_errors = 0
+    
+    # ========================================================================
+    # LIMITS
+    # ========================================================================
+    
+    @staticmethod
+    def _limit(limits: Dict[str, int], provider: str, model: str) -> Optional[int]:
+        """Model-specific limit ("provider/model"), else the provider limit"""
+        
+        limit = limits.get(f"{provider}/{model}", limits.get(provider))
+        return limit if limit and limit > 0 else None
+    
+    def concurrency_limit(self, provider: str, model: str) -> Optional[int]:
+        return self._limit(settings.AI_CONCURRENCY_LIMITS, provider, model)
+    
+    def tpm_limit(self, provider: str, model: str) -> Optional[int]:
+        return self._limit(settings.AI_TPM_LIMITS, provider, model)
+    
+    def _wait_stats(self, key: Tuple[str, str]) -> WaitStats:
+        if key not in self._stats:
+            self._stats[key] = WaitStats()
+        return self._stats[key]
+    
+    # ========================================================================
+    # ACQUIRE / RELEASE
+    # ========================================================================
+    
+    async def acquire(
+        self,
+        provider: str,
+        model: str,
+        estimate_tokens: Callable[[], int]
+    ) -> Lease:
+        """
+        Wait (in FIFO order) for a concurrency slot and token budget
+        
+        Args:
+            provider: Provider name
+            model: Model name
+            estimate_tokens: Prompt + expected output tokens (only called
+                when a tokens-per-minute limit applies)
+        
+        Returns:
+            Lease - release it when the call (or stream) is finished
+        """
+        
+        key = (provider, model)
+        concurrency = self.concurrency_limit(provider, model)
+        if f"{provider}/{model}" not in settings.AI_CONCURRENCY_LIMITS:
+            # Worker-tuned provider limit replaces the static one
+            adaptive = await adaptive_concurrency.limit(provider)
+            if adaptive is not None:
+                concurrency = adaptive
+        tpm = self.tpm_limit(provider, model)
+        
+        redis = self._get_redis()
+        lease = Lease(
+            self, key, uuid.uuid4().hex, "redis" if redis is not None else "local"
+        )
+        if not settings.AI_LIMITER_ENABLED or (concurrency is None and tpm is None):
+            lease.released = True
+            return lease
+        
+        stats = self._wait_stats(key)
+        started = time.monotonic()
+        stats.waiting += 1
+        
+        try:
+            if concurrency is not None:
+                await self._acquire_slot(lease, concurrency)
+            if tpm is not None:
+                lease.tokens = max(int(estimate_tokens()), 1)
+                await self._reserve_tokens(lease, tpm, stats)
+        except BaseException:
+            await lease.release()
+            raise
+        finally:
+            stats.waiting -= 1
+        
+        stats.record_wait(time.monotonic() - started)
+        stats.in_use += 1
+        lease.counted = True
+        return lease
+    
+    async def _acquire_slot(self, lease: Lease, limit: int):
+        if lease.backend == "redis":
+            try:
+                await self._acquire_slot_redis(lease, limit)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._redis_failed(e)
+                lease.backend = "local"
+        
+        await self._local_limits(lease.key).acquire_slot(limit)
+        lease.holds_slot = True
+    
+    async def _acquire_slot_redis(self, lease: Lease, limit: int):
+        provider, model = lease.key
+        base = f"{self.PREFIX}{provider}:{model}"
+        keys = [f"{base}:queue", f"{base}:holders", f"{base}:heartbeats"]
+        acquire = self._get_scripts()["acquire"]
+        interval = self.POLL_INTERVAL
+        priority = _call_priority.get()
+        if priority is None:
+            priority = time.time()
+        
+        try:
+            while True:
+                now = time.time()
+                acquired = await acquire(
+                    keys=keys,
+                    args=[
+                        lease.member,
+                        limit,
+                        now,
+                        now + settings.AI_LIMITER_LEASE_SECONDS,
+                        now - self.WAITER_TIMEOUT,
+                        int(settings.AI_LIMITER_LEASE_SECONDS) * 2,
+                        priority,
+                    ]
+                )
+                if int(acquired) == 1:
+                    lease.holds_slot = True
+                    lease.renewal = asyncio.create_task(self._renew_slot(lease))
+                    return
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+        finally:
+            if not lease.holds_slot:
+                # Leave the queue (cancelled or Redis error)
+                try:
+                    await get_redis().zrem(keys[0], lease.member)
+                except Exception:
+                    pass
+    
+    async def _renew_slot(self, lease: Lease):
+        """
+        Extend the slot lease while the call (or stream) runs
+        
+        The lease only has to outlive a crashed caller by a little, so
+        long generations don't need a lease as long as the call timeout.
+        """
+        provider, model = lease.key
+        holders = f"{self.PREFIX}{provider}:{model}:holders"
+        
+        while True:
+            await asyncio.sleep(settings.AI_LIMITER_LEASE_SECONDS / 3)
+            try:
+                redis = get_redis()
+                await redis.zadd(
+                    holders,
+                    {lease.member: time.time() + settings.AI_LIMITER_LEASE_SECONDS},
+                    xx=True
+                )
+                await redis.expire(holders, int(settings.AI_LIMITER_LEASE_SECONDS) * 2)
+            except Exception as e:
+                self._redis_failed(e)
+    
+    async def _reserve_tokens(self, lease: Lease, limit: int, stats: WaitStats):
+        provider, model = lease.key
+        waited = False
+        
+        while True:
+            if lease.token_backend == "redis":
+                try:
+                    wait = float(await self._get_scripts()["reserve"](
+                        keys=[f"{self.PREFIX}{provider}:{model}:tokens"],
+                        args=[
+                            f"{lease.member}:{lease.tokens}",
+                            lease.tokens,
+                            limit,
+                            time.time(),
+                            self.TOKEN_WINDOW,
+                        ]
+                    ))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._redis_failed(e)
+                    lease.token_backend = "local"
+                    continue
+            else:
+                local = self._local_limits(lease.key)
+                wait = local.reserve(lease.member, lease.tokens, limit, time.time())
+            
+            if wait <= 0:
+                return
+            
+            if not waited:
+                stats.token_waits += 1
+                waited = True
+            await asyncio.sleep(min(wait, self.TOKEN_WINDOW))
+    
+    async def _release(self, lease: Lease, tokens_used: Optional[int]):
+        if lease.counted:
+            self._stats[lease.key].in_use -= 1
+        
+        provider, model = lease.key
+        base = f"{self.PREFIX}{provider}:{model}"
+        settle = tokens_used is not None and lease.tokens > 0
+        
+        if lease.holds_slot and lease.backend == "local":
+            self._local[lease.key].release_slot()
+        if settle and lease.token_backend == "local" and lease.key in self._local:
+            self._local[lease.key].settle(lease.member, tokens_used)
+        
+        try:
+            if lease.holds_slot and lease.backend == "redis":
+                await get_redis().zrem(f"{base}:holders", lease.member)
+            if settle and lease.token_backend == "redis":
+                await self._get_scripts()["settle"](
+                    keys=[f"{base}:tokens"],
+                    args=[f"{lease.member}:{lease.tokens}", f"{lease.member}:{tokens_used}"]
+                )
+        except Exception as e:
+            # No longer renewed, the slot lease expires on its own
+            self._redis_failed(e)
+    
+    # ========================================================================
+    # BACKENDS
+    # ========================================================================
+    
+    def _local_limits(self, key: Tuple[str, str]) -> _LocalLimits:
+        if key not in self._local:
+            self._local[key] = _LocalLimits()
+        return self._local[key]
+    
+    def _get_redis(self):
+        """Redis client, or None while backing off after an error"""
+        
+        if time.monotonic() < self._redis_down_until:
+            return None
+        return get_redis()
+    
+    def _get_scripts(self) -> dict:
+        if self._scripts is None:
+            redis = get_redis()
+            self._scripts = {
+                "acquire": redis.register_script(ACQUIRE_SCRIPT),
+                "reserve": redis.register_script(RESERVE_SCRIPT),
+                "settle": redis.register_script(SETTLE_SCRIPT),
+            }
+        return self._scripts
+    
+    def _redis_failed(self, error: Exception):
+        """Fall back to per-process limits for a while"""
+        
+        self.redis_errors += 1
+        self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+        self._scripts = None
+        print(f"⚠️ Provider limiter using local limits, Redis unavailable: {error}")
+    
+    # ========================================================================
+    # STATS
+    # ========================================================================
+    
+    async def cluster_usage(self, provider: str) -> Tuple[int, int]:
+        """
+        Slots in use and callers waiting for a provider, in all processes
+        
+        Falls back to this process's counts while Redis is unavailable.
+        """
+        if self._get_redis() is not None:
+            try:
+                redis = get_redis()
+                now = time.time()
+                in_use = waiting = 0
+                async for key in redis.scan_iter(match=f"{self.PREFIX}{provider}:*:holders"):
+                    base = key[:-len(":holders")]
+                    in_use += await redis.zcount(key, now, "+inf")
+                    waiting += await redis.zcount(
+                        f"{base}:heartbeats", now - self.WAITER_TIMEOUT, "+inf"
+                    )
+                return in_use, waiting
+            except Exception as e:
+                self._redis_failed(e)
+        
+        in_use = waiting = 0
+        for (name, _model), stats in self._stats.items():
+            if name == provider:
+                in_use += stats.in_use
+                waiting += stats.waiting
+        return in_use, waiting
+    
+    def stats(self) -> dict:
+        """Queue wait stats per provider/model"""
+        
+        return {
+            "backend": "local" if time.monotonic() < self._redis_down_until else "redis",
+            "redis_errors": self.redis_errors,
+            "limits": {
+                f"{provider}/{model}": stats.snapshot()
+                for (provider, model), stats in sorted(self._stats.items())
+            },
+        }
+
+
+# Global singleton
+provider_limiter = ProviderLimiter()
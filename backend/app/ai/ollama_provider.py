@@ -3,9 +3,11 @@ Ollama Provider Implementation
 Free, local AI provider
 """
 import os
-import aiohttp
-from typing import List, Optional, AsyncGenerator
-from app.ai.base import AIProvider, AIMessage, AIResponse
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from app.ai.base import AIProvider, AIMessage, AIResponse, ProviderStream
+from app.ai.tokenizer import tokenizer
+from app.core.config import settings
+from app.core.ollama_transport import ollama_transport
 
 
 class OllamaProvider(AIProvider):
@@ -17,13 +19,30 @@ class OllamaProvider(AIProvider):
         self.name = "ollama"
         self.default_model = "llama3.2"  # Better JSON compliance than tinyllama
     
-    async def chat_completion(
+    # ========================================================================
+    # CONNECTION POOL
+    # ========================================================================
+    
+    async def open(self):
+        """Open the shared Ollama transport"""
+        await ollama_transport.open()
+    
+    async def close(self):
+        """Close the shared Ollama transport"""
+        await ollama_transport.close()
+    
+    # ========================================================================
+    # COMPLETIONS
+    # ========================================================================
+    
+    async def _chat_completion(
         self,
         messages: List[AIMessage],
         stream: bool = False,
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AIResponse | AsyncGenerator[str, None]:
         """Send chat completion to Ollama"""
         
@@ -36,81 +55,120 @@ class OllamaProvider(AIProvider):
         ]
         
         if stream:
-            return self._stream_completion(
-                ollama_messages, model, temperature
+            result = ProviderStream()
+            result.source = self._stream_completion(
+                result, ollama_messages, model, temperature, max_tokens, json_schema
             )
+            return result
         else:
             return await self._complete(
-                ollama_messages, model, temperature
+                ollama_messages, model, temperature, max_tokens, json_schema
             )
     
+    @staticmethod
+    def _options(temperature: float, max_tokens: Optional[int]) -> dict:
+        """Sampling options; num_predict is Ollama's max_tokens"""
+        
+        options = {"temperature": temperature}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        return options
+    
     async def _complete(
         self,
         messages: List[dict],
         model: str,
-        temperature: float
+        temperature: float,
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AIResponse:
         """Non-streaming completion"""
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "stream": False,
-                    "options": {"temperature": temperature}
-                }
-            ) as response:
-                data = await response.json()
-                
-                # DEBUG: Log raw response
-                print(f"🔍 Ollama raw response: {data}")
-                
-                content = data.get("message", {}).get("content", "")
-                
-                # DEBUG: Log extracted content
-                print(f"📝 Extracted content: '{content}'")
-                
-                # Ollama doesn't return exact token counts
-                # Estimate: ~4 chars per token
-                estimated_tokens = len(content) // 4
-                
-                return AIResponse(
-                    content=content,
-                    tokens_used=estimated_tokens,
-                    cost=0.0,  # Free!
-                    model=model,
-                    provider=self.name
-                )
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "options": self._options(temperature, max_tokens)
+        }
+        if json_schema is not None:
+            # Constrained decoding: schema-guided, or plain JSON mode
+            payload["format"] = json_schema if settings.OLLAMA_JSON_SCHEMA else "json"
+        
+        data = await ollama_transport.post_json(
+            f"{self.base_url}/api/chat",
+            payload
+        )
+        
+        # DEBUG: Log raw response
+        print(f"🔍 Ollama raw response: {data}")
+        
+        content = data.get("message", {}).get("content", "")
+        
+        # DEBUG: Log extracted content
+        print(f"📝 Extracted content: '{content}'")
+        
+        # Exact counts from Ollama; prompt_eval_count is omitted when the
+        # prompt was fully served from Ollama's KV cache
+        input_tokens = data.get("prompt_eval_count")
+        if input_tokens is None:
+            input_tokens = tokenizer.count_messages(messages, model)
+        output_tokens = data.get("eval_count")
+        if output_tokens is None:
+            output_tokens = tokenizer.count(content, model)
+        
+        # Durations are reported in nanoseconds
+        eval_duration = data.get("eval_duration")
+        eval_seconds = eval_duration / 1e9 if eval_duration else None
+        
+        return AIResponse(
+            content=content,
+            tokens_used=input_tokens + output_tokens,
+            cost=0.0,  # Free!
+            model=model,
+            provider=self.name,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            eval_duration=eval_seconds,
+            tokens_per_second=(
+                round(output_tokens / eval_seconds, 2) if eval_seconds else None
+            )
+        )
     
     async def _stream_completion(
         self,
+        counts: ProviderStream,
         messages: List[dict],
         model: str,
-        temperature: float
+        temperature: float,
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AsyncGenerator[str, None]:
-        """Streaming completion"""
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "stream": True,
-                    "options": {"temperature": temperature}
-                }
-            ) as response:
-                async for line in response.content:
-                    if line:
-                        import json
-                        try:
-                            data = json.loads(line)
-                            if "message" in data and "content" in data["message"]:
-                                yield data["message"]["content"]
-                        except json.JSONDecodeError:
-                            continue
+        """
+        Streaming completion (closing the generator stops the generation)
+        
+        The final `done` chunk carries Ollama's exact token counts; they
+        are set on `counts` for billing.
+        """
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": self._options(temperature, max_tokens)
+        }
+        if json_schema is not None:
+            payload["format"] = json_schema if settings.OLLAMA_JSON_SCHEMA else "json"
+        
+        async for data in ollama_transport.stream_json(
+            f"{self.base_url}/api/chat",
+            payload
+        ):
+            if data.get("done"):
+                # prompt_eval_count is omitted on a full KV cache hit
+                counts.input_tokens = data.get("prompt_eval_count")
+                counts.output_tokens = data.get("eval_count")
+            if "message" in data and "content" in data["message"]:
+                yield data["message"]["content"]
     
     def calculate_cost(
         self,
@@ -122,16 +180,15 @@ class OllamaProvider(AIProvider):
         return 0.0
     
     def count_tokens(self, text: str, model: str) -> int:
-        """Estimate tokens (4 chars ≈ 1 token)"""
-        return len(text) // 4
+        """Approximate tokens (cl100k_base is close to llama's tokenizer)"""
+        return tokenizer.count(text, model)
     
     async def health_check(self) -> bool:
         """Check if Ollama is running"""
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.base_url}/api/tags") as response:
-                    return response.status == 200
+            response = await ollama_transport.get(f"{self.base_url}/api/tags")
+            return response.status_code == 200
         except Exception as e:
             print(f"Ollama health check failed: {e}")
             return False
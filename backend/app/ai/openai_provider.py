@@ -3,10 +3,11 @@ OpenAI Provider Implementation
 Supports GPT-4, GPT-3.5-turbo, and other OpenAI models
 """
 import os
-from typing import List, Optional, AsyncGenerator
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
 from openai import AsyncOpenAI
-import tiktoken
 from app.ai.base import AIProvider, AIMessage, AIResponse
+from app.ai.tokenizer import tokenizer
 
 
 class OpenAIProvider(AIProvider):
@@ -27,13 +28,14 @@ class OpenAIProvider(AIProvider):
         self.name = "openai"
         self.default_model = "gpt-4o-mini"
     
-    async def chat_completion(
+    async def _chat_completion(
         self,
         messages: List[AIMessage],
         stream: bool = False,
         model: Optional[str] = None,
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AIResponse | AsyncGenerator[str, None]:
         """Send chat completion to OpenAI"""
         
@@ -47,11 +49,11 @@ class OpenAIProvider(AIProvider):
         
         if stream:
             return self._stream_completion(
-                openai_messages, model, temperature, max_tokens
+                openai_messages, model, temperature, max_tokens, json_schema
             )
         else:
             return await self._complete(
-                openai_messages, model, temperature, max_tokens
+                openai_messages, model, temperature, max_tokens, json_schema
             )
     
     async def _complete(
@@ -59,15 +61,22 @@ class OpenAIProvider(AIProvider):
         messages: List[dict],
         model: str,
         temperature: float,
-        max_tokens: Optional[int]
+        max_tokens: Optional[int],
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AIResponse:
         """Non-streaming completion"""
         
+        extra = {}
+        if json_schema is not None:
+            extra["response_format"] = self._response_format(model, json_schema)
+        
+        started = time.monotonic()
         response = await self.client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            **extra
         )
         
         content = response.choices[0].message.content
@@ -77,12 +86,21 @@ class OpenAIProvider(AIProvider):
         
         cost = self.calculate_cost(input_tokens, output_tokens, model)
         
+        # OpenAI doesn't report generation time, use the request time
+        elapsed = time.monotonic() - started
+        
         return AIResponse(
             content=content,
             tokens_used=total_tokens,
             cost=cost,
             model=model,
-            provider=self.name
+            provider=self.name,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            eval_duration=round(elapsed, 3),
+            tokens_per_second=(
+                round(output_tokens / elapsed, 2) if elapsed > 0 else None
+            )
         )
     
     async def _stream_completion(
@@ -90,21 +108,42 @@ class OpenAIProvider(AIProvider):
         messages: List[dict],
         model: str,
         temperature: float,
-        max_tokens: Optional[int]
+        max_tokens: Optional[int],
+        json_schema: Optional[Dict[str, Any]] = None
     ) -> AsyncGenerator[str, None]:
-        """Streaming completion"""
+        """Streaming completion (closing the generator stops the generation)"""
+        
+        extra = {}
+        if json_schema is not None:
+            extra["response_format"] = self._response_format(model, json_schema)
         
         stream = await self.client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
-            stream=True
+            stream=True,
+            **extra
         )
         
-        async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Drop the HTTP response so OpenAI stops generating
+            await stream.response.aclose()
+    
+    @staticmethod
+    def _response_format(model: str, json_schema: Dict[str, Any]) -> dict:
+        """Structured outputs on models that support schemas, else JSON mode"""
+        
+        if model.startswith("gpt-4o"):
+            return {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": json_schema}
+            }
+        return {"type": "json_object"}
     
     def calculate_cost(
         self,
@@ -122,20 +161,15 @@ class OpenAIProvider(AIProvider):
         return round(input_cost + output_cost, 6)
     
     def count_tokens(self, text: str, model: str) -> int:
-        """Count tokens using tiktoken"""
-        
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
-        
-        return len(encoding.encode(text))
+        """Count tokens using tiktoken (cached encoders)"""
+        return tokenizer.count(text, model)
     
     async def health_check(self) -> bool:
         """Check if OpenAI API is accessible"""
         
         try:
-            await self.client.models.list()
+            # Single-model lookup is much cheaper than listing all models
+            await self.client.models.retrieve(self.default_model)
             return True
         except Exception as e:
             print(f"OpenAI health check failed: {e}")
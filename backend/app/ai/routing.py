@@ -0,0 +1,248 @@
+"""
+Adaptive Provider Routing
+Rolling latency / time-to-first-token / error / cost stats per provider
+and model, used to route provider="auto" calls
+"""
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+
+class RoutingPolicy:
+    CHEAPEST_WITHIN_SLA = "cheapest_within_sla"
+    FASTEST = "fastest"
+    WEIGHTED = "weighted"
+
+
+class ProviderStats:
+    """EWMA + sliding-window percentiles for one provider/model"""
+    
+    # Shorter completions are dominated by fixed overhead (prompt, network)
+    TOKEN_LATENCY_MIN_TOKENS = 32
+    
+    def __init__(self, alpha: float, window: int, error_half_life: float):
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.latencies: deque = deque(maxlen=window)
+        self.ttfts: deque = deque(maxlen=window)
+        self.ewma_latency: Optional[float] = None
+        self.ewma_ttft: Optional[float] = None
+        self.ewma_token_latency: Optional[float] = None  # Seconds per output token
+        self.ewma_error_rate = 0.0
+        self.ewma_cost_per_1k: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.last_updated = 0.0
+    
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * current
+    
+    def error_rate(self) -> float:
+        """
+        EWMA error rate, halved for every error_half_life without calls
+        
+        A backend skipped for failing gets no new samples, so without the
+        decay it would stay excluded after it recovers.
+        """
+        if not self.last_updated or self.error_half_life <= 0:
+            return self.ewma_error_rate
+        idle = max(0.0, time.time() - self.last_updated)
+        return self.ewma_error_rate * 0.5 ** (idle / self.error_half_life)
+    
+    def record(
+        self,
+        latency: Optional[float],
+        ttft: Optional[float] = None,
+        error: bool = False,
+        cost: float = 0.0,
+        tokens: int = 0,
+        output_tokens: int = 0
+    ):
+        self.calls += 1
+        self.ewma_error_rate = self._ewma(self.error_rate(), 1.0 if error else 0.0)
+        self.last_updated = time.time()
+        
+        if error:
+            self.errors += 1
+            return
+        
+        if latency is not None:
+            self.latencies.append(latency)
+            self.ewma_latency = self._ewma(self.ewma_latency, latency)
+        if ttft is not None:
+            self.ttfts.append(ttft)
+            self.ewma_ttft = self._ewma(self.ewma_ttft, ttft)
+        if latency is not None and output_tokens >= self.TOKEN_LATENCY_MIN_TOKENS:
+            # Generation time per token, comparable across short and long calls
+            generation = latency - ttft if ttft is not None else latency
+            self.ewma_token_latency = self._ewma(
+                self.ewma_token_latency, generation / output_tokens
+            )
+        if tokens > 0:
+            self.ewma_cost_per_1k = self._ewma(
+                self.ewma_cost_per_1k, cost / tokens * 1000
+            )
+    
+    @staticmethod
+    def _percentile(samples: deque, p: float) -> Optional[float]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+    
+    def latency_percentile(self, p: float) -> Optional[float]:
+        return self._percentile(self.latencies, p)
+    
+    def ttft_percentile(self, p: float) -> Optional[float]:
+        return self._percentile(self.ttfts, p)
+    
+    def snapshot(self) -> dict:
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+        
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": rounded(self.error_rate()),
+            "latency_ewma_s": rounded(self.ewma_latency),
+            "latency_p50_s": rounded(self.latency_percentile(50)),
+            "latency_p95_s": rounded(self.latency_percentile(95)),
+            "ttft_ewma_s": rounded(self.ewma_ttft),
+            "ttft_p95_s": rounded(self.ttft_percentile(95)),
+            "s_per_output_token": rounded(self.ewma_token_latency),
+            "cost_per_1k": rounded(self.ewma_cost_per_1k),
+        }
+
+
+class ProviderRouter:
+    """Chooses a provider for provider="auto" from observed performance"""
+    
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], ProviderStats] = {}
+    
+    # ========================================================================
+    # RECORDING
+    # ========================================================================
+    
+    def stats(self, provider: str, model: str) -> ProviderStats:
+        """Get (or create) the stats for a provider/model"""
+        
+        key = (provider, model)
+        if key not in self._stats:
+            self._stats[key] = ProviderStats(
+                alpha=settings.AI_ROUTING_EWMA_ALPHA,
+                window=settings.AI_ROUTING_WINDOW,
+                error_half_life=settings.AI_ROUTING_ERROR_HALF_LIFE
+            )
+        return self._stats[key]
+    
+    def record(
+        self,
+        provider: str,
+        model: str,
+        latency: Optional[float],
+        ttft: Optional[float] = None,
+        error: bool = False,
+        cost: float = 0.0,
+        tokens: int = 0,
+        output_tokens: int = 0
+    ):
+        """Record the outcome of one provider call"""
+        
+        self.stats(provider, model).record(latency, ttft, error, cost, tokens, output_tokens)
+    
+    # ========================================================================
+    # ROUTING
+    # ========================================================================
+    
+    def choose(
+        self,
+        candidates: List[Tuple[str, str]],
+        static_cost_per_1k: Callable[[str, str], float],
+        urgency: Optional[str] = None,
+        policy: Optional[str] = None
+    ) -> str:
+        """
+        Pick a provider from (provider, model) candidates
+        
+        Args:
+            candidates: Healthy, configured providers with their default model
+            static_cost_per_1k: Price-list cost, used until costs are observed
+            urgency: Task urgency - ASAP always routes to the fastest backend
+            policy: Routing policy (defaults to AI_ROUTING_POLICY)
+        
+        Returns:
+            Provider name
+        """
+        
+        if len(candidates) == 1:
+            return candidates[0][0]
+        
+        policy = policy or settings.AI_ROUTING_POLICY
+        if urgency == "asap":
+            policy = RoutingPolicy.FASTEST
+        
+        # Skip backends that are mostly failing, unless all of them are
+        reliable = [
+            c for c in candidates
+            if self.stats(*c).error_rate() <= settings.AI_ROUTING_MAX_ERROR_RATE
+        ]
+        candidates = reliable or candidates
+        
+        def latency(c) -> float:
+            stats = self.stats(*c)
+            # Unmeasured backends are tried first so they get measured
+            return stats.ewma_latency if stats.ewma_latency is not None else 0.0
+        
+        def p95(c) -> float:
+            value = self.stats(*c).latency_percentile(95)
+            return value if value is not None else 0.0
+        
+        def cost(c) -> float:
+            observed = self.stats(*c).ewma_cost_per_1k
+            return observed if observed is not None else static_cost_per_1k(*c)
+        
+        if policy == RoutingPolicy.FASTEST:
+            best = min(candidates, key=latency)
+        
+        elif policy == RoutingPolicy.WEIGHTED:
+            max_latency = max(latency(c) for c in candidates) or 1.0
+            max_cost = max(cost(c) for c in candidates) or 1.0
+            
+            def score(c) -> float:
+                return (
+                    settings.AI_ROUTING_LATENCY_WEIGHT * latency(c) / max_latency
+                    + settings.AI_ROUTING_COST_WEIGHT * cost(c) / max_cost
+                    + settings.AI_ROUTING_ERROR_WEIGHT * self.stats(*c).error_rate()
+                )
+            
+            best = min(candidates, key=score)
+        
+        else:
+            # Cheapest backend whose p95 latency meets the SLA
+            within_sla = [
+                c for c in candidates
+                if p95(c) <= settings.AI_ROUTING_SLA_SECONDS
+            ]
+            if within_sla:
+                best = min(within_sla, key=lambda c: (cost(c), latency(c)))
+            else:
+                best = min(candidates, key=latency)
+        
+        return best[0]
+    
+    def snapshot(self) -> dict:
+        """Stats for every provider/model seen so far"""
+        
+        return {
+            f"{provider}/{model}": stats.snapshot()
+            for (provider, model), stats in sorted(self._stats.items())
+        }
+
+
+# Global singleton
+provider_router = ProviderRouter()
@@ -0,0 +1,178 @@
+"""
+In-flight Request Coalescing (single-flight)
+Identical concurrent LLM calls share one upstream request and one result
+"""
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class _Call:
+    """One shared upstream call and the number of callers awaiting it"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SharedStream:
+    """Fan one upstream token stream out to any number of subscribers"""
+    
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]],
+        on_idle: Callable[[], None]
+    ):
+        self._factory = factory
+        self._on_idle = on_idle
+        self._cond = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+    
+    async def _pump(self):
+        """Read the upstream stream and publish every chunk"""
+        
+        source = None
+        try:
+            source = await self._factory()
+            async for chunk in source:
+                async with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("Shared stream was cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            if source is not None:
+                await source.aclose()
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+    
+    def attach(self):
+        """Register a subscriber (starts the upstream call for the first one)"""
+        
+        self.subscribers += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+    
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """Yield the full stream (buffered chunks first, then live ones)"""
+        
+        index = 0
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(
+                        lambda: index < len(self.chunks) or self.done
+                    )
+                    pending = self.chunks[index:]
+                    finished = self.done
+                
+                for chunk in pending:
+                    yield chunk
+                index += len(pending)
+                
+                if finished and index >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                # Last subscriber gone: stop the upstream generation
+                if not self.done:
+                    self._task.cancel()
+                self._on_idle()
+
+
+class SingleFlight:
+    """Deduplicates identical in-flight requests by key"""
+    
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self._stats = {
+            "leaders": 0,
+            "coalesced": 0,
+            "stream_leaders": 0,
+            "stream_coalesced": 0,
+        }
+    
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Run fn once per key; concurrent callers with the same key share it
+        
+        Returns:
+            (result, shared) - shared is True for callers that joined a
+            request started by someone else
+        """
+        
+        call = self._calls.get(key)
+        shared = call is not None
+        
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            # Nobody is waiting any more: don't keep generating for no one
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+        
+        return result, shared
+    
+    def stream(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[AsyncGenerator[str, None]]]
+    ) -> AsyncGenerator[str, None]:
+        """Subscribe to the shared token stream for key, starting it if needed"""
+        
+        shared_stream = self._streams.get(key)
+        
+        if shared_stream is None or shared_stream.done:
+            shared_stream = SharedStream(
+                factory,
+                on_idle=lambda: self._forget(self._streams, key, shared_stream)
+            )
+            self._streams[key] = shared_stream
+            self._stats["stream_leaders"] += 1
+        else:
+            self._stats["stream_coalesced"] += 1
+        
+        shared_stream.attach()
+        return shared_stream.subscribe()
+    
+    @staticmethod
+    def _forget(registry: dict, key: str, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
+    
+    def stats(self) -> dict:
+        """Coalescing counters"""
+        
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls)
+        stats["in_flight_streams"] = len(self._streams)
+        return stats
+
+
+# Global singleton
+inflight = SingleFlight()
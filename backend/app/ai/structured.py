@@ -0,0 +1,481 @@
+"""
+Structured Output
+Linear-time JSON extraction and repair, a minimal JSON Schema validator
+and parse-failure stats per provider/model
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class StructuredOutputError(Exception):
+    """Model output could not be turned into JSON matching the schema"""
+    pass
+
+
+# ============================================================================
+# EXTRACTION & REPAIR
+# ============================================================================
+
+_OPENERS = {"{": "}", "[": "]"}
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+# Openers tried before giving up (each try is one linear scan)
+MAX_JSON_CANDIDATES = 20
+
+
+def _scan_value(text: str, start: int) -> Tuple[int, List[str]]:
+    """
+    Scan one JSON object/array starting at text[start]
+    
+    Returns:
+        (end index after the value or len(text) if unterminated,
+         stack of still-open closers)
+    """
+    
+    stack = [_OPENERS[text[start]]]
+    in_string = False
+    escaped = False
+    i = start + 1
+    
+    while i < len(text) and stack:
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _OPENERS:
+            stack.append(_OPENERS[char])
+        elif char == stack[-1]:
+            stack.pop()
+        i += 1
+    
+    if in_string:
+        stack.append('"')
+    return i, stack
+
+
+def repair_json(fragment: str, closers: Optional[List[str]] = None) -> str:
+    """
+    Fix common LLM JSON mistakes in one pass
+    
+    - trailing commas before } or ]
+    - Python literals (True/False/None) outside strings
+    - truncated output: closes the open string and brackets
+    
+    Args:
+        fragment: JSON-ish text of one object/array
+        closers: Still-open closers from the scan (innermost last)
+    """
+    
+    out: List[str] = []
+    in_string = False
+    escaped = False
+    i = 0
+    
+    while i < len(fragment):
+        char = fragment[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char in "}]":
+            _drop_trailing_comma(out)
+        elif char.isalpha():
+            j = i
+            while j < len(fragment) and fragment[j].isalpha():
+                j += 1
+            word = fragment[i:j]
+            out.append(_PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        
+        out.append(char)
+        i += 1
+    
+    for closer in reversed(closers or []):
+        if closer == '"':
+            out.append('"')
+            continue
+        # Drop a dangling separator or a key without a value
+        _drop_trailing_comma(out)
+        if closer == "}":
+            _drop_dangling_key(out)
+        out.append(closer)
+    
+    return "".join(out)
+
+
+def _drop_trailing_comma(out: List[str]):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j:]
+
+
+def _drop_dangling_key(out: List[str]):
+    """Remove a trailing `"key":` or lone `"key"` left by truncation"""
+    
+    def skip_space(j: int) -> int:
+        while j >= 0 and out[j].isspace():
+            j -= 1
+        return j
+    
+    j = skip_space(len(out) - 1)
+    has_colon = j >= 0 and out[j] == ":"
+    if has_colon:
+        j = skip_space(j - 1)
+    if j < 1 or out[j] != '"':
+        return
+    
+    # Opening quote of the string
+    k = j - 1
+    while k >= 0 and not (out[k] == '"' and (k == 0 or out[k - 1] != "\\")):
+        k -= 1
+    if k < 0:
+        return
+    
+    before = skip_space(k - 1)
+    if not has_colon and (before < 0 or out[before] not in "{,"):
+        return  # A complete "key": "value" pair
+    
+    del out[k:]
+    _drop_trailing_comma(out)
+
+
+def extract_json(text: str) -> Tuple[Any, bool]:
+    """
+    Find and parse the first JSON object/array in free text
+    
+    No backtracking regex: at most MAX_JSON_CANDIDATES linear scans, so
+    cost stays linear in the output size. Handles code fences, prose
+    around the JSON and truncated or slightly malformed output.
+    
+    Returns:
+        (value, repaired) - repaired is True if the JSON had to be fixed
+    
+    Raises:
+        StructuredOutputError: No parsable JSON found
+    """
+    
+    text = text or ""
+    stripped = text.strip()
+    if stripped[:1] in _OPENERS:
+        try:
+            return json.loads(stripped), False
+        except (json.JSONDecodeError, RecursionError):
+            pass
+    
+    i = 0
+    candidates = 0
+    while i < len(text) and candidates < MAX_JSON_CANDIDATES:
+        if text[i] not in _OPENERS:
+            i += 1
+            continue
+        
+        candidates += 1
+        end, open_closers = _scan_value(text, i)
+        candidate = text[i:end]
+        
+        if not open_closers:
+            try:
+                return json.loads(candidate), False
+            except (json.JSONDecodeError, RecursionError):
+                pass
+        
+        try:
+            return json.loads(repair_json(candidate, open_closers)), True
+        except (json.JSONDecodeError, RecursionError):
+            i += 1
+    
+    raise StructuredOutputError("No JSON object found in response")
+
+
+class IncrementalJSONParser:
+    """
+    Detects the first complete top-level JSON object in a token stream
+    
+    Each character is looked at once, so feeding a whole response costs
+    the same as one scan of it. Lets callers stop the generation as soon
+    as the object is closed instead of waiting for trailing prose.
+    """
+    
+    def __init__(self):
+        self._parts: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self.value: Any = None
+        self.text: Optional[str] = None  # The JSON text of the object
+        self.tail = ""  # Text received after the object in the same chunk
+    
+    @property
+    def done(self) -> bool:
+        return self.text is not None
+    
+    def feed(self, chunk: str) -> bool:
+        """
+        Add a chunk of the stream
+        
+        Returns:
+            True once a complete, parsable object has arrived
+        """
+        
+        if self.done:
+            self.tail += chunk
+            return True
+        
+        segment_start = 0 if self._stack else None
+        
+        for offset, char in enumerate(chunk):
+            if not self._stack:
+                if char == "{":
+                    self._stack.append("}")
+                    segment_start = offset
+                continue
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _OPENERS:
+                self._stack.append(_OPENERS[char])
+            elif char == self._stack[-1]:
+                self._stack.pop()
+                if not self._stack:
+                    candidate = "".join(self._parts) + chunk[segment_start:offset + 1]
+                    self._parts = []
+                    try:
+                        self.value = json.loads(candidate)
+                    except (json.JSONDecodeError, RecursionError):
+                        # Not JSON after all (e.g. braces in prose), keep looking
+                        segment_start = None
+                        continue
+                    self.text = candidate
+                    self.tail = chunk[offset + 1:]
+                    return True
+        
+        if self._stack and segment_start is not None:
+            self._parts.append(chunk[segment_start:])
+        return False
+
+
+# ============================================================================
+# VALIDATION
+# ============================================================================
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _is_type(value: Any, type_name: str) -> bool:
+    if type_name == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if type_name == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _TYPES.get(type_name, object))
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Validate a value against a JSON Schema subset
+    
+    Supports type, properties, required, items, enum and
+    minItems / maxItems - enough for the agent response schemas.
+    
+    Returns:
+        List of error messages (empty if valid)
+    """
+    
+    errors: List[str] = []
+    
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_is_type(value, t) for t in types):
+            return [f"{path}: expected {'|'.join(types)}, got {type(value).__name__}"]
+    
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], subschema, f"{path}.{key}"))
+    
+    if isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    
+    return errors
+
+
+def parse_structured(text: str, schema: Dict[str, Any]) -> Tuple[Any, bool]:
+    """
+    Extract JSON from model output and validate it
+    
+    Returns:
+        (value, repaired)
+    
+    Raises:
+        StructuredOutputError: No JSON, or JSON not matching the schema
+    """
+    
+    value, repaired = extract_json(text)
+    errors = validate(value, schema)
+    if errors:
+        raise StructuredOutputError("; ".join(errors[:5]))
+    return value, repaired
+
+
+# ============================================================================
+# STATS
+# ============================================================================
+
+class StructuredStats:
+    """Structured-output outcomes per provider/model"""
+    
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+    
+    def record(self, provider: str, model: str, outcome: str):
+        """
+        Count one attempt
+        
+        Args:
+            outcome: ok | repaired | parse_failure | retry | failed
+        """
+        
+        stats = self._stats.setdefault(
+            (provider, model),
+            {"ok": 0, "repaired": 0, "parse_failure": 0, "retry": 0, "failed": 0}
+        )
+        stats[outcome] += 1
+    
+    def snapshot(self) -> dict:
+        result = {}
+        for (provider, model), stats in sorted(self._stats.items()):
+            attempts = stats["ok"] + stats["repaired"] + stats["parse_failure"]
+            result[f"{provider}/{model}"] = {
+                **stats,
+                "parse_failure_rate": (
+                    round(stats["parse_failure"] / attempts, 4) if attempts else 0.0
+                ),
+            }
+        return result
+
+
+class StreamingStats:
+    """Time and tokens saved by stopping JSON streams early, per phase"""
+    
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+    
+    def record(
+        self,
+        phase: str,
+        stopped_early: bool,
+        time_to_json: Optional[float],
+        total_time: float,
+        output_tokens: int,
+        tail_tokens: int,
+        tokens_left: Optional[int],
+        tokens_per_second: Optional[float]
+    ):
+        """
+        Record one streamed JSON call
+        
+        Args:
+            stopped_early: Generation was cancelled right after the object
+            time_to_json: Seconds until the object was complete
+            total_time: Seconds until the stream was closed
+            output_tokens: Tokens generated (including any tail)
+            tail_tokens: Tokens generated after the object
+            tokens_left: max_tokens budget not used (None if unbounded)
+            tokens_per_second: Observed generation speed
+        """
+        
+        stats = self._stats.setdefault(phase, {
+            "calls": 0,
+            "stopped_early": 0,
+            "output_tokens": 0,
+            "time_to_json_s": 0.0,
+            "total_time_s": 0.0,
+            "tail_tokens": 0,
+            "tail_time_s": 0.0,
+            "saved_tokens_max": 0,
+            "saved_time_max_s": 0.0,
+        })
+        
+        stats["calls"] += 1
+        stats["output_tokens"] += output_tokens
+        stats["total_time_s"] += total_time
+        if time_to_json is not None:
+            stats["time_to_json_s"] += time_to_json
+        
+        if stopped_early:
+            stats["stopped_early"] += 1
+            # Upper bound: the model could have used the rest of its budget
+            if tokens_left:
+                stats["saved_tokens_max"] += tokens_left
+                if tokens_per_second:
+                    stats["saved_time_max_s"] += tokens_left / tokens_per_second
+        elif time_to_json is not None:
+            # Ran to completion: this tail is what an early stop saves
+            stats["tail_tokens"] += tail_tokens
+            stats["tail_time_s"] += total_time - time_to_json
+    
+    def snapshot(self) -> dict:
+        result = {}
+        for phase, stats in sorted(self._stats.items()):
+            calls = stats["calls"] or 1
+            completed = (stats["calls"] - stats["stopped_early"]) or 1
+            result[phase] = {
+                "calls": stats["calls"],
+                "stopped_early": stats["stopped_early"],
+                "avg_output_tokens": round(stats["output_tokens"] / calls, 1),
+                "avg_time_to_json_s": round(stats["time_to_json_s"] / calls, 3),
+                "avg_total_time_s": round(stats["total_time_s"] / calls, 3),
+                "avg_tail_tokens": round(stats["tail_tokens"] / completed, 1),
+                "avg_tail_time_s": round(stats["tail_time_s"] / completed, 3),
+                "saved_tokens_max": stats["saved_tokens_max"],
+                "saved_time_max_s": round(stats["saved_time_max_s"], 3),
+            }
+        return result
+
+
+# Global singletons
+structured_stats = StructuredStats()
+streaming_stats = StreamingStats()
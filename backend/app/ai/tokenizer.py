@@ -0,0 +1,100 @@
+"""
+Tokenizer Service
+One place to count tokens, with cached encoders and batch counting
+"""
+import asyncio
+from functools import lru_cache
+from typing import List, Optional
+import tiktoken
+from app.core.config import settings
+
+
+# Tokens added per chat message for role and separators (OpenAI chat format)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# encode_batch spins up a thread pool, only worth it for larger batches
+BATCH_MIN_CHARS = 20_000
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    """
+    Load (once) the encoder for a model
+    
+    Non-OpenAI models (e.g. Ollama's llama) use cl100k_base as a close
+    approximation. Returns None if no encoder can be loaded (tiktoken
+    downloads its BPE files on first use), in which case counts fall
+    back to the 4-chars-per-token rule.
+    """
+    
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Tokenizer for '{model}' unavailable: {e}")
+        return None
+    
+    try:
+        return tiktoken.get_encoding(settings.TOKENIZER_DEFAULT_ENCODING)
+    except Exception as e:
+        print(f"⚠️ Tokenizer '{settings.TOKENIZER_DEFAULT_ENCODING}' unavailable: {e}")
+        return None
+
+
+class TokenizerService:
+    """Token counting shared by providers, the limiter and pricing"""
+    
+    def count(self, text: str, model: str = "gpt-4o-mini") -> int:
+        """Count tokens in one text"""
+        
+        if not text:
+            return 0
+        
+        encoding = _get_encoding(model)
+        if encoding is None:
+            return len(text) // 4
+        return len(encoding.encode(text, disallowed_special=()))
+    
+    def count_batch(self, texts: List[str], model: str = "gpt-4o-mini") -> List[int]:
+        """Count tokens for many texts (tiktoken encodes them in parallel)"""
+        
+        encoding = _get_encoding(model)
+        if encoding is None:
+            return [len(text or "") // 4 for text in texts]
+        
+        if sum(len(text or "") for text in texts) < BATCH_MIN_CHARS:
+            return [self.count(text, model) for text in texts]
+        
+        encoded = encoding.encode_batch(
+            [text or "" for text in texts],
+            disallowed_special=()
+        )
+        return [len(tokens) for tokens in encoded]
+    
+    async def count_batch_async(
+        self,
+        texts: List[str],
+        model: str = "gpt-4o-mini"
+    ) -> List[int]:
+        """
+        Batch count without blocking the event loop on large inputs
+        
+        Inputs above TOKENIZER_THREAD_THRESHOLD characters are encoded
+        in the default thread pool.
+        """
+        
+        total_chars = sum(len(text or "") for text in texts)
+        if total_chars < settings.TOKENIZER_THREAD_THRESHOLD:
+            return self.count_batch(texts, model)
+        return await asyncio.to_thread(self.count_batch, texts, model)
+    
+    def count_messages(self, messages: List[dict], model: str = "gpt-4o-mini") -> int:
+        """Prompt tokens for a list of {"role", "content"} chat messages"""
+        
+        counts = self.count_batch([msg["content"] for msg in messages], model)
+        return sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+
+# Global singleton
+tokenizer = TokenizerService()
@@ -0,0 +1,98 @@
+"""
+Usage Metering
+Adds up the cost of every provider call made on behalf of one task,
+including calls that were cut off (cancelled, stopped early), so the
+cost actually incurred is known even if the task never completes.
+Only the calls made after start_billing() (plan execution) are charged.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class TaskUsage:
+    """Cost and tokens of the calls made in one tracked context"""
+    
+    def __init__(self):
+        self.cost = 0.0
+        self.tokens = 0
+        self.calls = 0
+        self.partial_calls = 0
+        self._billing_start: Optional[tuple] = None
+        self._billed_to: Optional["TaskUsage"] = None
+    
+    def add(self, cost: float, tokens: int, partial: bool = False):
+        self.cost += cost
+        self.tokens += tokens
+        self.calls += 1
+        if partial:
+            self.partial_calls += 1
+        if self._billed_to is not None:
+            self._billed_to.add(cost, tokens, partial)
+    
+    def bill_to(self, usage: Optional["TaskUsage"]):
+        """
+        Add this meter's calls so far, and every later one, to another
+        meter (a hedged call's winning leg to the task's meter)
+        """
+        if usage is None or self._billed_to is not None:
+            return
+        self._billed_to = usage
+        usage.cost += self.cost
+        usage.tokens += self.tokens
+        usage.calls += self.calls
+        usage.partial_calls += self.partial_calls
+    
+    def start_billing(self):
+        """Charge the calls made from here on (restarts on a provider fallback)"""
+        self._billing_start = (self.cost, self.tokens)
+    
+    @property
+    def billable_cost(self) -> float:
+        if self._billing_start is None:
+            return 0.0
+        return self.cost - self._billing_start[0]
+    
+    @property
+    def billable_tokens(self) -> int:
+        if self._billing_start is None:
+            return 0
+        return self.tokens - self._billing_start[1]
+    
+    def snapshot(self) -> dict:
+        return {
+            "cost": round(self.cost, 6),
+            "tokens": self.tokens,
+            "calls": self.calls,
+            "partial_calls": self.partial_calls,
+            "billable_cost": round(self.billable_cost, 6),
+        }
+
+
+# Child tasks (parallel steps, hedged calls) inherit the same meter
+_current_usage: ContextVar[Optional[TaskUsage]] = ContextVar("current_usage", default=None)
+
+
+@contextmanager
+def track_usage(usage: Optional[TaskUsage] = None) -> Iterator[TaskUsage]:
+    """Meter every provider call made inside the block (on a new meter by default)"""
+    
+    usage = usage if usage is not None else TaskUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_usage(cost: float, tokens: int, partial: bool = False):
+    """Add one provider call to the active meter (no-op outside track_usage)"""
+    
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(cost, tokens, partial)
+
+
+def current_usage() -> Optional[TaskUsage]:
+    """The active meter, None outside track_usage"""
+    return _current_usage.get()
@@ -1,17 +1,24 @@
 """
 Chat API endpoints for task interaction
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from sqlalchemy import select, update
+from typing import List, Optional, Tuple
 
-from app.db.base import get_db
+from app.db.base import get_db, AsyncSessionLocal
 from app.db.models import User, Task, Message
+from app.db.pagination import InvalidCursorError, keyset_page, next_cursor
+from app.billing.credits import charge
 from app.schemas import MessageCreate, MessageResponse
 from app.core.security import get_current_user
 from app.ai.factory import get_ai_provider
 from app.ai.base import AIMessage
+from app.ai.tokenizer import tokenizer
+from app.agents.task_manager import resume_after_clarification
 
 
 router = APIRouter(prefix="/tasks/{task_id}/chat", tags=["chat"])
@@ -20,10 +27,19 @@ router = APIRouter(prefix="/tasks/{task_id}/chat", tags=["chat"])
 @router.get("/", response_model=List[MessageResponse])
 async def get_messages(
     task_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get all messages for a task"""
+    """
+    Get the messages of a task, oldest first
+    
+    - Without ?limit= all messages are returned
+    - With ?limit= one page; pass its X-Next-Cursor header as ?cursor=
+      for the next page (absent on the last page)
+    """
     
     # Verify task ownership
     result = await db.execute(
@@ -41,30 +57,35 @@ async def get_messages(
         )
     
     # Get messages
-    result = await db.execute(
-        select(Message)
-        .where(Message.task_id == task_id)
-        .order_by(Message.created_at)
-    )
+    query = select(Message).where(Message.task_id == task_id)
+    
+    if limit is None:
+        result = await db.execute(query.order_by(Message.created_at, Message.id))
+        return result.scalars().all()
+    
+    try:
+        query = keyset_page(query, Message.created_at, Message.id, cursor, limit)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    messages = result.scalars().all()
+    result = await db.execute(query)
+    messages, cursor = next_cursor(result.scalars().all(), limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
     return messages
 
 
-@router.post("/", response_model=MessageResponse)
-async def send_message(
+async def _prepare_conversation(
     task_id: int,
     message_data: MessageCreate,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
+    db: AsyncSession,
+    current_user: User
+) -> Tuple[Task, List[AIMessage]]:
     """
-    Send a message in task chat
+    Verify task ownership, save the user message and build the AI history
     
-    - User can send text messages or file attachments
-    - Text files (.txt, .md) are processed by AI immediately
+    - Text files (.txt, .md) are included for the AI
     - Images/PDFs are stored but AI processing pending (Phase 2: Vision API)
-    - AI responds based on task context
     """
     import httpx
     import os
@@ -133,9 +154,6 @@ async def send_message(
     await db.commit()
     await db.refresh(user_message)
     
-    # Get AI response
-    provider = get_ai_provider(task.provider)
-    
     # Build conversation history
     result = await db.execute(
         select(Message)
@@ -149,32 +167,259 @@ async def send_message(
         for msg in all_messages
     ]
     
-    # Get AI response
-    response = await provider.chat_completion(
-        messages=ai_messages,
-        temperature=0.7
-    )
+    # End the read transaction: the pool connection goes back while the
+    # LLM call runs (objects stay usable, expire_on_commit=False)
+    await db.commit()
+    
+    return task, ai_messages
+
+
+async def _save_ai_reply(
+    db: AsyncSession,
+    task: Task,
+    user_id: int,
+    content: str,
+    tokens: int,
+    cost: float,
+    provider_name: str
+) -> Message:
+    """Save the assistant message and charge its cost to task and user"""
     
-    # Save AI response
     ai_message = Message(
-        task_id=task_id,
+        task_id=task.id,
         role="assistant",
-        content=response.content,
-        tokens_used=response.tokens_used,
-        cost=response.cost,
-        provider_used=provider.name
+        content=content,
+        tokens_used=tokens,
+        cost=cost,
+        provider_used=provider_name
     )
     db.add(ai_message)
     
-    # Update task costs
-    task.final_cost += response.cost
-    task.tokens_used += response.tokens_used
+    # Update task costs (in SQL, the worker may update the same row)
+    await db.execute(
+        update(Task)
+        .where(Task.id == task.id)
+        .values(
+            final_cost=Task.final_cost + cost,
+            tokens_used=Task.tokens_used + tokens
+        )
+    )
     
-    # Deduct from user balance
-    current_user.credits_balance -= response.cost
-    current_user.monthly_usage += response.cost
+    # Deduct from user balance (the reply was generated, so unconditional)
+    await charge(db, user_id, cost)
     
     await db.commit()
     await db.refresh(ai_message)
     
     return ai_message
+
+
+async def _answer_clarification(
+    db: AsyncSession,
+    task: Task,
+    user: User,
+    ai_messages: List[AIMessage]
+) -> Message:
+    """
+    Treat the user's message as the answer to the clarification questions:
+    store it, requeue the task (continues at PLANNING with the stored
+    analysis) and acknowledge without an LLM call
+    """
+    
+    queued = await resume_after_clarification(task, ai_messages[-1].content or "", db)
+    content = (
+        "Thanks! I'm continuing with your task now."
+        if queued else
+        "Thanks! Your answer is saved, but the task couldn't be restarted yet."
+    )
+    return await _save_ai_reply(db, task, user.id, content, 0, 0.0, None)
+
+
+@router.post("/", response_model=MessageResponse)
+async def send_message(
+    task_id: int,
+    message_data: MessageCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Send a message in task chat
+    
+    - User can send text messages or file attachments
+    - Text files (.txt, .md) are processed by AI immediately
+    - Images/PDFs are stored but AI processing pending (Phase 2: Vision API)
+    - AI responds based on task context
+    """
+    
+    task, ai_messages = await _prepare_conversation(
+        task_id, message_data, db, current_user
+    )
+    
+    if task.status == "clarifying":
+        return await _answer_clarification(db, task, current_user, ai_messages)
+    
+    # Get AI response
+    provider = get_ai_provider(task.provider, task.urgency)
+    response = await provider.chat_completion(
+        messages=ai_messages,
+        temperature=0.7
+    )
+    
+    return await _save_ai_reply(
+        db,
+        task,
+        current_user.id,
+        response.content,
+        response.tokens_used,
+        response.cost,
+        response.provider
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/stream")
+async def send_message_stream(
+    task_id: int,
+    message_data: MessageCreate,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Send a message and stream the AI reply as Server-Sent Events
+    
+    Events:
+    - token: {"content": "...", "tokens": running output token count}
+    - done: the saved assistant message (same shape as POST /chat/)
+    - error: {"detail": "..."}
+    
+    The reply is saved and charged when the stream ends. If the client
+    disconnects, the upstream generation is cancelled and only the
+    tokens generated so far are charged.
+    """
+    
+    task, ai_messages = await _prepare_conversation(
+        task_id, message_data, db, current_user
+    )
+    
+    if task.status == "clarifying":
+        ai_message = await _answer_clarification(db, task, current_user, ai_messages)
+        done = MessageResponse.model_validate(ai_message).model_dump(mode="json")
+        
+        async def clarification_stream():
+            yield _sse("done", done)
+        
+        return StreamingResponse(clarification_stream(), media_type="text/event-stream")
+    
+    provider = get_ai_provider(task.provider, task.urgency)
+    model = provider.get_default_model()
+    user_id = current_user.id
+    
+    async def event_stream():
+        chunks: List[str] = []
+        output_tokens = 0
+        disconnected = False
+        stream = None
+        ai_message = None
+        
+        try:
+            # A dedicated upstream call: the reply is charged to this stream,
+            # which a shared (coalesced) stream would charge every subscriber
+            stream = await provider.chat_completion(
+                messages=ai_messages,
+                stream=True,
+                temperature=0.7,
+                cache=False
+            )
+            
+            async for chunk in stream:
+                if await request.is_disconnected():
+                    disconnected = True
+                    print(f"🔌 Chat stream for task {task_id} disconnected")
+                    break
+                
+                chunks.append(chunk)
+                output_tokens += tokenizer.count(chunk, model)
+                yield _sse("token", {"content": chunk, "tokens": output_tokens})
+        except Exception as e:
+            print(f"❌ Chat stream for task {task_id} failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            # Closing the stream cancels the upstream generation
+            if stream is not None:
+                await stream.aclose()
+            
+            # Charge whatever was generated, even if the client left, to the
+            # backend that produced it (a hedged stream may switch to another)
+            if chunks:
+                served_by = getattr(stream, "provider", provider)
+                ai_message = await asyncio.shield(
+                    _finish_stream(
+                        task_id,
+                        user_id,
+                        ai_messages,
+                        "".join(chunks),
+                        served_by,
+                        served_by.get_default_model(),
+                        getattr(stream, "input_tokens", None),
+                        getattr(stream, "output_tokens", None)
+                    )
+                )
+        
+        if ai_message is not None and not disconnected:
+            yield _sse(
+                "done",
+                MessageResponse.model_validate(ai_message).model_dump(mode="json")
+            )
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Don't let nginx buffer the stream
+        }
+    )
+
+
+async def _finish_stream(
+    task_id: int,
+    user_id: int,
+    ai_messages: List[AIMessage],
+    content: str,
+    provider,
+    model: str,
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None
+) -> Message:
+    """
+    Charge and save a streamed reply (request-scoped session is already closed)
+    
+    Token counts reported with the stream are used when given; otherwise
+    they are estimated with the tokenizer.
+    """
+    
+    if input_tokens is None:
+        input_tokens = tokenizer.count_messages(
+            [{"role": msg.role, "content": msg.content or ""} for msg in ai_messages],
+            model
+        )
+    if output_tokens is None:
+        output_tokens = tokenizer.count(content, model)
+    cost = provider.calculate_cost(input_tokens, output_tokens, model)
+    
+    async with AsyncSessionLocal() as db:
+        task = await db.get(Task, task_id)
+        return await _save_ai_reply(
+            db,
+            task,
+            user_id,
+            content,
+            input_tokens + output_tokens,
+            cost,
+            provider.name
+        )
@@ -2,12 +2,11 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.db.base import get_db
-from app.db.models import Task, Payment, TaskStatus
+from app.db.models import Task, Payment, PaymentStatus, TaskStatus
 from app.core.config import settings
 import stripe
 import json
-from arq import create_pool
-from arq.connections import RedisSettings
+from app.core.queue import task_queue, QueueError
 
 router = APIRouter()
 
@@ -72,29 +71,42 @@ async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
         
         if task_id:
             task_id = int(task_id)
-            # Update Payment Record
-            new_payment = Payment(
-                task_id=task_id,
-                stripe_charge_id=session.get('payment_intent'),
-                amount=session.get('amount_total', 0) / 100,
-                status="succeeded"
+            # Row lock: a concurrent delivery of the same event waits here
+            result = await db.execute(
+                select(Task).where(Task.id == task_id).with_for_update()
             )
-            db.add(new_payment)
-            
-            # Update Task
-            result = await db.execute(select(Task).where(Task.id == task_id))
             task = result.scalar_one_or_none()
             if task:
-                task.is_paid = True
-                task.status = TaskStatus.EXECUTING.value
-                db.add(task)
+                # Stripe retries the webhook (after a 5xx or a timeout): the
+                # payment is recorded once, the job id is keyed by the session
+                if task.is_paid:
+                    if task.status != TaskStatus.EXECUTING.value:
+                        return {"status": "success"}
+                else:
+                    db.add(Payment(
+                        user_id=task.user_id,
+                        task_id=task_id,
+                        amount=session.get('amount_total', 0) / 100,
+                        currency=(session.get('currency') or 'usd').upper(),
+                        status=PaymentStatus.SUCCEEDED,
+                        provider="stripe",
+                        provider_payment_id=session.get('payment_intent'),
+                        provider_session_id=session.get('id')
+                    ))
+                    task.is_paid = True
+                    task.status = TaskStatus.EXECUTING.value
                 await db.commit()
                 
-                # Trigger Execution Stub
-                # In production, use shared redis pool
-                redis = await create_pool(RedisSettings.from_dsn(settings.REDIS_URL))
-                await redis.enqueue_job('execute_task_job', task_id)
-                await redis.close()
+                # Trigger Execution (5xx lets Stripe retry the webhook, a
+                # retry after a successful enqueue is dropped by ARQ)
+                try:
+                    await task_queue.enqueue(
+                        task_id,
+                        task.urgency,
+                        key=(session.get('id') or '').replace(':', '') or 'paid'
+                    )
+                except QueueError as e:
+                    raise HTTPException(status_code=503, detail=str(e))
                 
     return {"status": "success"}
 
@@ -114,8 +126,9 @@ async def mock_pay_task(task_id: int, db: AsyncSession = Depends(get_db)):
     await db.commit()
     
     # Trigger Execution
-    redis = await create_pool(RedisSettings.from_dsn(settings.REDIS_URL))
-    await redis.enqueue_job('execute_task_job', task_id)
-    await redis.close()
+    try:
+        await task_queue.enqueue(task_id, task.urgency)
+    except QueueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
     return {"status": "paid", "message": "Task marked as paid and execution triggered"}
@@ -2,21 +2,40 @@
 Task API endpoints
 Core business logic for task management
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
-from typing import List
+from sqlalchemy.orm import load_only
+from typing import List, Optional
 
-from app.db.base import get_db
+from app.db.base import get_db, AsyncSessionLocal
 from app.db.models import User, Task
-from app.schemas import TaskCreate, TaskResponse, TaskDetail, PriceEstimate
-from app.core.security import get_current_user
+from app.db.pagination import InvalidCursorError, keyset_page, next_cursor
+from app.schemas import TaskCreate, TaskResponse, TaskSummary, TaskDetail, PriceEstimate, TaskStatusEnum
+from app.core.config import settings
+from app.core.security import get_current_user, decode_access_token
+from app.core.queue import task_queue, QueueError
+from app.core.cancellation import request_cancel
+from app.core.task_events import task_events, valid_event_id
+from app.core.task_state import task_state
+from app.billing.credits import InsufficientCreditsError, debit, refund
 from app.billing.pricing import calculate_task_price, estimate_tokens
 
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
 
+def _task_columns(schema) -> list:
+    """Task columns a response schema reads"""
+    return [getattr(Task, name) for name in schema.model_fields if name in Task.__table__.columns]
+
+
+# Lists leave out the JSON blobs and result text, details leave out step_results
+SUMMARY_COLUMNS = _task_columns(TaskSummary)
+DETAIL_COLUMNS = _task_columns(TaskDetail)
+
+
 @router.post("/estimate-price", response_model=PriceEstimate)
 async def estimate_price(
     task_data: TaskCreate,
@@ -115,10 +134,13 @@ async def create_task(
     return new_task
 
 
-@router.get("/", response_model=List[TaskResponse])
+@router.get("/", response_model=List[TaskSummary])
 async def get_tasks(
+    response: Response,
     skip: int = 0,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status_filter: Optional[TaskStatusEnum] = Query(None, alias="status"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -126,19 +148,42 @@ async def get_tasks(
     Get all tasks for current user
     
     - Returns tasks ordered by creation date (newest first)
-    - Supports pagination
+    - Summaries only: result text, plan and analysis via GET /tasks/{id}
+    - Optional ?status= filter
+    - Pagination: pass the X-Next-Cursor header of a page as ?cursor= to
+      get the next one (absent on the last page). ?skip= still works but
+      gets slower the deeper the page.
     """
     
-    result = await db.execute(
-        select(Task)
-        .where(Task.user_id == current_user.id)
-        .order_by(desc(Task.created_at))
-        .offset(skip)
-        .limit(limit)
-    )
-    
-    tasks = result.scalars().all()
-    return tasks
+    # Plain rows of the needed columns, no entities
+    query = select(*SUMMARY_COLUMNS).where(Task.user_id == current_user.id)
+    if status_filter is not None:
+        # Same index (user_id, created_at, id), the status is checked per row
+        query = query.where(Task.status == status_filter.value)
+    
+    if skip and not cursor:
+        # Offset paging (compatibility)
+        query = query.order_by(desc(Task.created_at), desc(Task.id)).offset(skip).limit(limit + 1)
+    else:
+        try:
+            query = keyset_page(query, Task.created_at, Task.id, cursor, limit, descending=True)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    result = await db.execute(query)
+    tasks, cursor = next_cursor(result.all(), limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    
+    # Live phase of running tasks (written to the rows at durable points only)
+    states = await task_state.get_many(task.id for task in tasks)
+    return [
+        TaskSummary(**task_state.merge(
+            TaskSummary.model_validate(task).model_dump(),
+            states.get(task.id, {})
+        ))
+        for task in tasks
+    ]
 
 
 @router.get("/{task_id}", response_model=TaskDetail)
@@ -151,11 +196,15 @@ async def get_task(
     Get specific task details
     
     - Returns full task info including plan and analysis
+    - Live status and step progress of a running task come from the
+      task state store, the rest from the database
     - Only owner can access
     """
     
     result = await db.execute(
-        select(Task).where(
+        select(Task)
+        .options(load_only(*DETAIL_COLUMNS))
+        .where(
             Task.id == task_id,
             Task.user_id == current_user.id
         )
@@ -169,7 +218,11 @@ async def get_task(
             detail="Task not found"
         )
     
-    return task
+    live = task_state.merge(
+        TaskDetail.model_validate(task).model_dump(),
+        await task_state.get(task.id)
+    )
+    return TaskDetail(**live)
 
 
 @router.delete("/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -200,7 +253,9 @@ async def delete_task(
             detail="Task not found"
         )
     
-    if task.status in ["analyzing", "planning", "executing"]:
+    # The row may still say "pending" while the worker is running it
+    live_status = task_state.merge({"status": task.status}, await task_state.get(task.id))["status"]
+    if live_status in ["analyzing", "planning", "executing"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot delete running task. Cancel it first."
@@ -221,15 +276,19 @@ async def cancel_task(
     """
     Cancel a running task
     
-    - Stops execution
-    - Refunds unused credits
+    - Stops execution, also in the middle of an LLM call
+    - Refunds the prepaid estimate; the worker then charges the
+      provider usage actually incurred (see record_cancellation)
     """
     
+    # Row lock: a parallel cancel or confirm waits, no double refund
     result = await db.execute(
-        select(Task).where(
+        select(Task)
+        .where(
             Task.id == task_id,
             Task.user_id == current_user.id
         )
+        .with_for_update()
     )
     
     task = result.scalar_one_or_none()
@@ -246,17 +305,23 @@ async def cancel_task(
             detail="Task already finished"
         )
     
+    # Refund if paid and not started (unconfirmed tasks were never debited)
+    if task.status != "awaiting_payment" and task.final_cost == 0:
+        await refund(db, current_user.id, task.estimated_cost)
+    
     # Cancel task
     task.status = "cancelled"
     
-    # Refund if not started
-    if task.final_cost == 0:
-        current_user.credits_balance += task.estimated_cost
-        current_user.monthly_usage -= task.estimated_cost
-    
     await db.commit()
     await db.refresh(task)
     
+    # Abort the running job (between phases the worker sees the status anyway)
+    try:
+        await request_cancel(task.id)
+    except Exception as e:
+        print(f"⚠️ Cancel signal for task {task.id} not sent: {e}")
+    await task_events.publish(current_user.id, task.id, "status", status="cancelled")
+    
     return task
 
 
@@ -278,11 +343,14 @@ async def confirm_task_payment(
     User muss VOR diesem Call AGB akzeptiert haben!
     """
     
+    # Row lock: a second confirm waits and then sees 'pending', no double debit
     result = await db.execute(
-        select(Task).where(
+        select(Task)
+        .where(
             Task.id == task_id,
             Task.user_id == current_user.id
         )
+        .with_for_update()
     )
     
     task = result.scalar_one_or_none()
@@ -299,17 +367,16 @@ async def confirm_task_payment(
             detail=f"Task status is {task.status}, expected awaiting_payment"
         )
     
-    # Final check: Hat User genug Credits?
-    if current_user.credits_balance < task.estimated_cost:
+    # Geld abziehen (WICHTIG!) - nur wenn das Guthaben reicht, atomar in SQL
+    try:
+        await debit(db, current_user.id, task.estimated_cost)
+    except InsufficientCreditsError:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail=f"Insufficient credits"
         )
     
-    # Geld abziehen (WICHTIG!)
-    current_user.credits_balance -= task.estimated_cost
-    current_user.monthly_usage += task.estimated_cost
-    
     # Status auf pending setzen
     task.status = "pending"
     
@@ -317,21 +384,121 @@ async def confirm_task_payment(
     await db.refresh(task)
     
     # JETZT Task in Queue stellen
-    from arq import create_pool
-    from arq.connections import RedisSettings
-    import os
-    
     try:
-        redis = await create_pool(
-            RedisSettings(
-                host=os.getenv("REDIS_HOST", "redis"),
-                port=int(os.getenv("REDIS_PORT", "6379"))
-            )
+        await task_queue.enqueue(task.id, task.urgency)
+    except QueueError as e:
+        # Zahlung zurücknehmen, Client kann erneut bestätigen
+        await refund(db, current_user.id, task.estimated_cost)
+        task.status = "awaiting_payment"
+        await db.commit()
+        
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Task queue unavailable, payment not taken: {e}"
         )
-        await redis.enqueue_job('process_task', task.id)
-        await redis.close()
-        print(f"✅ Task {task.id} payment confirmed, enqueued to worker")
-    except Exception as e:
-        print(f"⚠️ Failed to enqueue task {task.id}: {e}")
+    
+    print(f"✅ Task {task.id} payment confirmed, enqueued to worker")
     
     return task
+
+
+# ============================================================================
+# LIVE PROGRESS (WEBSOCKET)
+# ============================================================================
+
+@router.websocket("/ws")
+async def task_events_feed(
+    websocket: WebSocket,
+    token: str = Query(...),
+    task_id: Optional[int] = None,
+    last_event_id: Optional[str] = None
+):
+    """
+    Live progress of the user's tasks, instead of polling GET /tasks/{id}
+    
+    Query parameters:
+    - token: JWT access token (browsers can't set headers on WebSockets)
+    - task_id: only follow this task
+    - last_event_id: resume after the last event received before a reconnect
+    
+    Messages (JSON):
+    - {"id", "task_id", "event", "data"} with event status, progress,
+      output (step results) or cost; data carries the cost so far
+    - {"event": "heartbeat"} after WS_HEARTBEAT_SECONDS without events
+    - {"event": "resync"} events since last_event_id are gone, reload
+      the task with GET /tasks/{id}
+    
+    Events are read from Redis one batch at a time, only after the last
+    batch was sent, so a slow client never piles up memory here. A client
+    that doesn't take a batch within WS_SEND_TIMEOUT is closed with 1013
+    and resumes from its last event id.
+    """
+    
+    try:
+        token_data = decode_access_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    # Short session, the feed itself never holds a database connection
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.id == token_data.user_id))
+        user = result.scalar_one_or_none()
+    
+    if user is None or not user.is_active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    if task_events.connections >= settings.WS_MAX_CONNECTIONS:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    
+    await websocket.accept()
+    task_events.connections += 1
+    
+    async def drain():
+        # Detects the disconnect while we wait on Redis
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+    
+    receiver = asyncio.create_task(drain())
+    try:
+        if last_event_id and valid_event_id(last_event_id):
+            last_id = last_event_id
+            if await task_events.missed_events(user.id, last_id):
+                await websocket.send_json({"event": "resync"})
+                last_id = await task_events.latest_id(user.id)
+        else:
+            last_id = await task_events.latest_id(user.id)
+        
+        while True:
+            read = asyncio.create_task(task_events.read(
+                user.id, last_id, settings.WS_HEARTBEAT_SECONDS * 1000, task_id
+            ))
+            await asyncio.wait({read, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                read.cancel()
+                break  # Client went away
+            
+            events, last_id = read.result()
+            for message in events or [{"event": "heartbeat"}]:
+                await asyncio.wait_for(websocket.send_json(message), settings.WS_SEND_TIMEOUT)
+    
+    except asyncio.TimeoutError:
+        try:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"⚠️ Task event feed for user {user.id} failed: {e}")
+        try:
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        except Exception:
+            pass
+    finally:
+        receiver.cancel()
+        task_events.connections -= 1
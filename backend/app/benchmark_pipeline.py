@@ -0,0 +1,110 @@
+"""
+Benchmark: fused vs two-step analyze/plan pipeline
+Compares end-to-end latency, LLM calls and token usage of both modes
+against a real provider (responses are never served from the cache)
+
+Usage:
+    python -m app.benchmark_pipeline --provider ollama --runs 3
+    python -m app.benchmark_pipeline --provider openai "Write a cover letter"
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+from app.ai.factory import ProviderFactory, get_ai_provider
+from app.agents.analyzer import analyze_task
+from app.agents.planner import create_plan
+from app.agents.analyze_plan import analyze_and_plan
+
+
+DEFAULT_TASKS = [
+    "Write a 300-word blog post about the benefits of remote work",
+    "Translate my product description into French and Spanish",
+    "Create a Python script that renames all .jpeg files in a folder to .jpg",
+    "Summarize the key points of the attached quarterly report",
+]
+
+
+class UsageMeter:
+    """Provider proxy that counts calls and tokens and bypasses the cache"""
+    
+    def __init__(self, provider):
+        self.provider = provider
+        self.name = provider.name
+        self.calls = 0
+        self.tokens = 0
+    
+    async def chat_completion(self, *args, **kwargs):
+        kwargs["cache"] = False
+        response = await self.provider.chat_completion(*args, **kwargs)
+        self.calls += 1
+        self.tokens += response.tokens_used
+        return response
+
+
+async def run_two_step(description: str, meter: UsageMeter):
+    analysis = await analyze_task(description, meter)
+    if analysis.get("needs_clarification", False):
+        return analysis, None
+    return analysis, await create_plan(description, analysis, meter)
+
+
+async def run_fused(description: str, meter: UsageMeter):
+    return await analyze_and_plan(description, meter)
+
+
+async def benchmark(provider_name: str, tasks: List[str], runs: int):
+    await ProviderFactory.startup()
+    provider = get_ai_provider(provider_name)
+    print(f"🏁 Benchmarking {provider.name} ({provider.get_default_model()}), {runs} run(s) x {len(tasks)} task(s)\n")
+    
+    modes = {"two_step": run_two_step, "fused": run_fused}
+    results = {mode: {"latency": [], "tokens": [], "calls": [], "clarify": 0} for mode in modes}
+    
+    try:
+        for run in range(runs):
+            for description in tasks:
+                # Alternate the order so warm-up effects hit both modes
+                order = list(modes) if run % 2 == 0 else list(reversed(modes))
+                for mode in order:
+                    meter = UsageMeter(provider)
+                    started = time.perf_counter()
+                    analysis, plan = await modes[mode](description, meter)
+                    elapsed = time.perf_counter() - started
+                    
+                    results[mode]["latency"].append(elapsed)
+                    results[mode]["tokens"].append(meter.tokens)
+                    results[mode]["calls"].append(meter.calls)
+                    if plan is None:
+                        results[mode]["clarify"] += 1
+                    print(f"  {mode:<9} {elapsed:6.2f}s  {meter.tokens:5d} tokens  {meter.calls} call(s)  {description[:40]}")
+    finally:
+        await ProviderFactory.shutdown()
+    
+    print(f"\n{'mode':<9} {'avg s':>8} {'p50 s':>8} {'max s':>8} {'avg tokens':>11} {'avg calls':>10} {'clarify':>8}")
+    for mode, data in results.items():
+        print(
+            f"{mode:<9} "
+            f"{statistics.mean(data['latency']):8.2f} "
+            f"{statistics.median(data['latency']):8.2f} "
+            f"{max(data['latency']):8.2f} "
+            f"{statistics.mean(data['tokens']):11.0f} "
+            f"{statistics.mean(data['calls']):10.2f} "
+            f"{data['clarify']:8d}"
+        )
+    
+    two_step = statistics.mean(results["two_step"]["latency"])
+    fused = statistics.mean(results["fused"]["latency"])
+    if two_step > 0:
+        print(f"\n⚡ Fused vs two-step: {(1 - fused / two_step) * 100:.1f}% less latency")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fused and two-step analyze/plan")
+    parser.add_argument("tasks", nargs="*", help="Task descriptions (default: built-in set)")
+    parser.add_argument("--provider", default="ollama")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    
+    asyncio.run(benchmark(args.provider, args.tasks or DEFAULT_TASKS, args.runs))
@@ -0,0 +1,146 @@
+"""
+Benchmark: task list with full entities vs. column projection
+Seeds one user with tasks of realistic size (plan/analysis JSON, long
+result text, step checkpoints) and pages through them both ways:
+selecting whole Task entities, as GET /tasks/ used to, and selecting
+only the summary columns, as it does now. Reports latency and peak
+Python memory per page (measured in separate runs, tracing slows
+allocation down).
+
+Usage:
+    python -m app.benchmark_task_list --tasks 500 --page 50 --result-kb 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+import uuid
+from sqlalchemy import delete, desc, select
+from app.api.tasks import SUMMARY_COLUMNS
+from app.db.base import AsyncSessionLocal
+from app.db.models import Task, User
+from app.schemas import TaskSummary
+
+
+def _task(user_id: int, number: int, result_kb: int) -> Task:
+    steps = [
+        {
+            "step_number": step,
+            "action": f"Step {step}: research, draft and check section {step} " * 4,
+            "details": "Cover sources, structure and tone. " * 20,
+            "depends_on": [step - 1] if step > 1 else []
+        }
+        for step in range(1, 7)
+    ]
+    return Task(
+        user_id=user_id,
+        description=f"Benchmark task {number}: write a detailed report " * 5,
+        status="completed",
+        plan={"steps": steps, "output_format": "markdown"},
+        analysis={
+            "intent": "report " * 30,
+            "category": "writing",
+            "complexity": "complex",
+            "output_type": "text",
+            "needs_clarification": False,
+            "key_points": ["point " * 20 for _ in range(10)]
+        },
+        step_results={
+            str(step["step_number"]): {"output": "x" * 3000, "tokens": 800, "cost": 0.001}
+            for step in steps
+        },
+        result_text=("Lorem ipsum dolor sit amet. " * 40 + "\n") * (result_kb * 1024 // 1121 + 1),
+        final_cost=0.01,
+        tokens_used=5000
+    )
+
+
+async def _page(query, entities: bool) -> int:
+    """One page: query, materialize rows, build the response models"""
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(query)
+        rows = result.scalars().all() if entities else result.all()
+        return len([TaskSummary.model_validate(row) for row in rows])
+
+
+async def _measure(query, entities: bool) -> tuple:
+    """(seconds, peak bytes) of one page, memory traced in a separate run"""
+    
+    started = time.perf_counter()
+    await _page(query, entities)
+    elapsed = time.perf_counter() - started
+    
+    tracemalloc.start()
+    await _page(query, entities)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+async def run(task_count: int, page: int, result_kb: int, rounds: int):
+    print(f"🏁 {task_count} tasks (~{result_kb} KB result each), pages of {page}, {rounds} rounds\n")
+    
+    async with AsyncSessionLocal() as db:
+        user = User(
+            email=f"benchmark-{uuid.uuid4().hex[:8]}@omnitask.ai",
+            hashed_password="benchmark",
+            credits_balance=0.0
+        )
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+        
+        for offset in range(0, task_count, 100):
+            db.add_all(_task(user_id, n, result_kb) for n in range(offset, min(offset + 100, task_count)))
+            await db.commit()
+    
+    variants = {
+        "entities": (select(Task), True),
+        "projection": (select(*SUMMARY_COLUMNS), False),
+    }
+    
+    try:
+        results = {name: [] for name in variants}
+        for _ in range(rounds):
+            for name, (base, entities) in variants.items():
+                query = (
+                    base.where(Task.user_id == user_id)
+                    .order_by(desc(Task.created_at), desc(Task.id))
+                    .limit(page)
+                )
+                results[name].append(await _measure(query, entities))
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Task).where(Task.user_id == user_id))
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+    
+    for name, samples in results.items():
+        latencies = [elapsed * 1000 for elapsed, _ in samples]
+        peaks = [peak / 1024 for _, peak in samples]
+        print(
+            f"📄 {name:<10} median {statistics.median(latencies):7.1f} ms, "
+            f"max {max(latencies):7.1f} ms, peak memory {statistics.median(peaks):8.0f} KB"
+        )
+    
+    entity_ms = statistics.median(elapsed for elapsed, _ in results["entities"])
+    projection_ms = statistics.median(elapsed for elapsed, _ in results["projection"])
+    entity_kb = statistics.median(peak for _, peak in results["entities"])
+    projection_kb = statistics.median(peak for _, peak in results["projection"])
+    print(
+        f"\n✅ Projection: {entity_ms / projection_ms:.1f}x faster, "
+        f"{entity_kb / max(projection_kb, 1):.1f}x less memory per page"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Task list query benchmark")
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--result-kb", type=int, default=20, help="Size of each task's result text")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    
+    asyncio.run(run(args.tasks, args.page, args.result_kb, args.rounds))
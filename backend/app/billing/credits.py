@@ -0,0 +1,96 @@
+"""
+Credits
+Atomic changes to a user's credit balance and monthly usage
+
+Every change is a single UPDATE ... RETURNING that Postgres applies to
+the current row, never a read-modify-write of a loaded User: parallel
+debits (a chat reply and the worker charging the same user) can't
+overwrite each other, and the row lock only lasts one statement.
+
+The functions run in the caller's session; the caller commits, so a
+debit can share a transaction with the task update it pays for.
+"""
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import User
+
+
+class InsufficientCreditsError(Exception):
+    """The balance doesn't cover the debit (nothing was changed)"""
+    pass
+
+
+@dataclass
+class Balance:
+    """User's balance after a change"""
+    credits_balance: float
+    monthly_usage: float
+
+
+async def _apply(db: AsyncSession, user_id: int, amount: float, condition=None) -> Optional[Balance]:
+    statement = (
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            credits_balance=User.credits_balance - amount,
+            monthly_usage=User.monthly_usage + amount
+        )
+        .returning(User.credits_balance, User.monthly_usage)
+        # The statement is the source of truth, loaded Users aren't synced
+        .execution_options(synchronize_session=False)
+    )
+    if condition is not None:
+        statement = statement.where(condition)
+    
+    row = (await db.execute(statement)).one_or_none()
+    return Balance(row.credits_balance, row.monthly_usage) if row else None
+
+
+async def debit(db: AsyncSession, user_id: int, amount: float) -> Balance:
+    """
+    Take credits for work that hasn't been done yet (e.g. a task payment)
+    
+    Args:
+        db: Session (the caller commits)
+        user_id: User to debit
+        amount: Credits to take
+    
+    Returns:
+        Balance after the debit
+    
+    Raises:
+        InsufficientCreditsError: balance below amount (or unknown user)
+    """
+    balance = await _apply(db, user_id, amount, User.credits_balance >= amount)
+    if balance is None:
+        raise InsufficientCreditsError(f"Insufficient credits for ${amount:.2f}")
+    return balance
+
+
+async def charge(db: AsyncSession, user_id: int, amount: float) -> Optional[Balance]:
+    """
+    Bill usage that already happened (LLM calls of a task or chat reply)
+    
+    Unconditional: the cost was incurred, so the balance may go below
+    zero and the next debit() is refused.
+    
+    Returns:
+        Balance after the charge, None for a zero amount or unknown user
+    """
+    if amount <= 0:
+        return None
+    return await _apply(db, user_id, amount)
+
+
+async def refund(db: AsyncSession, user_id: int, amount: float) -> Optional[Balance]:
+    """
+    Give back credits taken by debit()
+    
+    Returns:
+        Balance after the refund, None for a zero amount or unknown user
+    """
+    if amount <= 0:
+        return None
+    return await _apply(db, user_id, -amount)
@@ -8,6 +8,7 @@ FINALE PREISREGEL (VERBINDLICH):
 - Kein Output vor Payment/Credit-OK
 """
 from typing import Dict
+from app.ai.tokenizer import tokenizer
 
 
 # Provider base costs per 1K tokens (USD)
@@ -50,8 +51,7 @@ def estimate_tokens(description: str) -> int:
     Returns:
         Estimated total tokens
     """
-    # Rough estimate: 4 characters ≈ 1 token
-    input_tokens = len(description) // 4
+    input_tokens = tokenizer.count(description)
     
     # Assume output is 3x input
     output_tokens = input_tokens * 3
@@ -0,0 +1,159 @@
+"""
+Check: hedged calls bill only the winning leg
+Races a slow primary against a fast secondary with fake providers (no
+network, no limiter) and compares the task's usage meter with what each
+leg generated: a completed call, a streamed call cancelled by the user
+mid-stream, and a call cancelled before either leg answered.
+
+Usage:
+    python -m app.check_hedge_billing
+"""
+import asyncio
+from typing import AsyncGenerator, Dict, List, Optional
+from app.core.config import settings
+from app.ai.base import AIMessage, AIProvider, AIResponse
+from app.ai.hedging import HedgedProvider
+from app.ai.tokenizer import tokenizer
+from app.ai.usage import track_usage
+
+
+COST_PER_TOKEN = 0.001
+
+
+class FakeProvider(AIProvider):
+    """Answers after `delay` seconds, one word per `interval` when streaming"""
+    
+    def __init__(self, name: str, delay: float, interval: float = 0.01, words: int = 200):
+        super().__init__()
+        self.name = name
+        self.delay = delay
+        self.interval = interval
+        self.words = words
+    
+    async def _chat_completion(
+        self,
+        messages: List[AIMessage],
+        stream: bool = False,
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        json_schema: Optional[Dict] = None
+    ) -> AIResponse | AsyncGenerator[str, None]:
+        if stream:
+            return self._stream()
+        
+        await asyncio.sleep(self.delay)
+        content = " ".join([self.name] * self.words)
+        tokens = tokenizer.count(content, "fake")
+        return AIResponse(
+            content=content,
+            tokens_used=tokens,
+            cost=self.calculate_cost(0, tokens, "fake"),
+            model="fake",
+            provider=self.name,
+            output_tokens=tokens
+        )
+    
+    async def _stream(self) -> AsyncGenerator[str, None]:
+        await asyncio.sleep(self.delay)
+        for _ in range(self.words):
+            yield f"{self.name} "
+            await asyncio.sleep(self.interval)
+    
+    def calculate_cost(self, input_tokens: int, output_tokens: int, model: str) -> float:
+        return (input_tokens + output_tokens) * COST_PER_TOKEN
+    
+    def count_tokens(self, text: str, model: str) -> int:
+        return tokenizer.count(text, model)
+    
+    async def health_check(self) -> bool:
+        return True
+    
+    def get_default_model(self) -> str:
+        return "fake"
+    
+    def get_available_models(self) -> List[str]:
+        return ["fake"]
+
+
+def _hedged() -> HedgedProvider:
+    # Unique names keep breaker and router state apart between runs
+    return HedgedProvider(FakeProvider("slowprimary", 0.5), FakeProvider("fastsecondary", 0.0))
+
+
+MESSAGES = [AIMessage(role="user", content="Say something")]
+
+
+async def completed_call() -> bool:
+    with track_usage() as usage:
+        response = await _hedged().chat_completion(MESSAGES, temperature=0.9, cache=False)
+        await asyncio.sleep(0.6)  # The cancelled loser would have answered by now
+    
+    ok = response.provider == "fastsecondary" and abs(usage.cost - response.cost) < 1e-9
+    print(f"{'✅' if ok else '❌'} completed: billed ${usage.cost:.4f}, winner cost ${response.cost:.4f}")
+    return ok
+
+
+async def cancelled_stream() -> bool:
+    chunks: List[str] = []
+    
+    async def consume():
+        stream = await _hedged().chat_completion(MESSAGES, stream=True, temperature=0.9, cache=False)
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+        finally:
+            await stream.aclose()
+    
+    with track_usage() as usage:
+        job = asyncio.create_task(consume())
+        await asyncio.sleep(0.3)  # Secondary won and streamed for a while
+        job.cancel()
+        try:
+            await job
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.3)
+    
+    prompt = tokenizer.count_messages([{"role": "user", "content": "Say something"}], "fake")
+    expected = (prompt + tokenizer.count("".join(chunks), "fake")) * COST_PER_TOKEN
+    ok = bool(chunks) and all(c.startswith("fastsecondary") for c in chunks) and abs(usage.cost - expected) < 1e-9
+    print(f"{'✅' if ok else '❌'} cancelled mid-stream: billed ${usage.cost:.4f}, winner generated ${expected:.4f}")
+    return ok
+
+
+async def cancelled_before_winner() -> bool:
+    hedged = HedgedProvider(FakeProvider("slowprimary", 0.5), FakeProvider("slowsecondary", 0.5))
+    
+    with track_usage() as usage:
+        job = asyncio.create_task(hedged.chat_completion(MESSAGES, temperature=0.9, cache=False))
+        await asyncio.sleep(0.4)  # Both legs running
+        job.cancel()
+        try:
+            await job
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.1)
+    
+    prompt = tokenizer.count_messages([{"role": "user", "content": "Say something"}], "fake")
+    expected = prompt * COST_PER_TOKEN
+    ok = usage.calls == 1 and abs(usage.cost - expected) < 1e-9
+    print(f"{'✅' if ok else '❌'} cancelled before a winner: billed ${usage.cost:.4f} over {usage.calls} call(s), primary prompt ${expected:.4f}")
+    return ok
+
+
+async def run():
+    settings.AI_LIMITER_ENABLED = False
+    settings.AI_HEDGE_DEFAULT_DELAY = 0.05
+    
+    print("🏁 Hedged calls: slow primary vs. fast secondary\n")
+    results = [
+        await completed_call(),
+        await cancelled_stream(),
+        await cancelled_before_winner(),
+    ]
+    print("\n✅ Only the winning leg is billed" if all(results) else "\n⚠️  A losing leg was billed")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,128 @@
+"""
+Task Cancellation
+Cancelling a task sets a Redis flag and publishes the task id. Workers
+subscribe and cancel the asyncio task running that job, which aborts
+the in-flight LLM call (streams are closed, limiter slots released).
+Between phases the task manager also refuses to write a cancelled task.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Set
+from app.core.redis import get_redis
+
+
+CANCEL_CHANNEL = "task_cancel"
+CANCEL_PREFIX = "task_cancel:"
+CANCEL_FLAG_TTL = 86400  # Seconds
+
+
+class TaskCancelledError(Exception):
+    """The task was cancelled by the user"""
+    pass
+
+
+async def request_cancel(task_id: int):
+    """Flag the task as cancelled and notify running workers"""
+    
+    redis = get_redis()
+    await redis.set(f"{CANCEL_PREFIX}{task_id}", 1, ex=CANCEL_FLAG_TTL)
+    await redis.publish(CANCEL_CHANNEL, str(task_id))
+
+
+async def is_cancel_requested(task_id: int) -> bool:
+    """Whether cancellation was requested (False if Redis is unreachable)"""
+    
+    try:
+        return bool(await get_redis().exists(f"{CANCEL_PREFIX}{task_id}"))
+    except Exception:
+        return False
+
+
+class CancellationWatcher:
+    """Cancels running task jobs when their cancel message arrives"""
+    
+    RECONNECT_DELAY = 5.0  # Seconds
+    
+    def __init__(self):
+        self._running: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.cancelled = 0
+    
+    async def start(self):
+        """Subscribe to cancel messages in the background"""
+        
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+    
+    async def stop(self):
+        """Stop listening"""
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _listen(self):
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(CANCEL_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._cancel(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Cancellation listener disconnected: {e}")
+                await asyncio.sleep(self.RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+    
+    def _cancel(self, task_id: int):
+        job = self._running.get(task_id)
+        if job is not None and task_id not in self._cancelled:
+            print(f"🛑 Cancelling task {task_id}")
+            self._cancelled.add(task_id)
+            self.cancelled += 1
+            job.cancel()
+    
+    @asynccontextmanager
+    async def watch(self, task_id: int) -> AsyncIterator[None]:
+        """
+        Run the block as a cancellable task job
+        
+        Raises:
+            TaskCancelledError: the task was (or gets) cancelled
+        """
+        if await is_cancel_requested(task_id):
+            raise TaskCancelledError(f"Task {task_id} was cancelled")
+        
+        self._running[task_id] = asyncio.current_task()
+        try:
+            yield
+        except asyncio.CancelledError:
+            if task_id not in self._cancelled:
+                raise  # Worker shutdown or job timeout
+            asyncio.current_task().uncancel()
+            raise TaskCancelledError(f"Task {task_id} was cancelled")
+        finally:
+            self._running.pop(task_id, None)
+            self._cancelled.discard(task_id)
+    
+    def stats(self) -> dict:
+        return {
+            "listening": self._task is not None and not self._task.done(),
+            "running": len(self._running),
+            "cancelled": self.cancelled,
+        }
+
+
+# Global singleton
+cancellation_watcher = CancellationWatcher()
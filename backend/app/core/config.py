@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List
 import os
 
 
@@ -14,6 +15,9 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "omnitask"
     POSTGRES_HOST: str = "db"
     POSTGRES_PORT: int = 5432
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # Seconds to wait for a free connection
     
     REDIS_URL: str = "redis://redis:6379/0"
     
@@ -29,6 +33,103 @@ class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://ollama:11434"
     OLLAMA_MODEL: str = "tinyllama"
 
+    # Ollama HTTP transport (shared by providers, agents and test endpoints)
+    OLLAMA_POOL_SIZE: int = 100  # Total open connections
+    OLLAMA_POOL_KEEPALIVE: int = 20  # Idle connections kept for reuse
+    OLLAMA_KEEPALIVE_TIMEOUT: float = 60.0  # Seconds an idle connection is kept
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0  # Seconds
+    OLLAMA_READ_TIMEOUT: float = 300.0  # Seconds (CPU generations are slow)
+    OLLAMA_POOL_TIMEOUT: float = 30.0  # Seconds waiting for a free connection
+    OLLAMA_HTTP2: bool = False
+
+    # LLM response cache (exact match, memory LRU + Redis)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ENTRIES: int = 1000
+    LLM_CACHE_TTL: int = 3600  # Seconds
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.5  # Hotter calls are never cached
+    LLM_CACHE_REDIS: bool = True
+    LLM_COALESCE_ENABLED: bool = True  # Share identical in-flight requests
+    
+    # Provider health prober & circuit breakers
+    AI_HEALTH_PROBE_INTERVAL: float = 30.0  # Seconds between background probes
+    AI_HEALTH_PROBE_TIMEOUT: float = 5.0  # Seconds
+    AI_BREAKER_FAILURE_THRESHOLD: int = 5  # Consecutive failures before opening
+    AI_BREAKER_RECOVERY_TIMEOUT: float = 30.0  # Seconds before a trial call
+    
+    # Adaptive routing for provider="auto"
+    AI_ROUTING_POLICY: str = "cheapest_within_sla"  # cheapest_within_sla|fastest|weighted
+    AI_ROUTING_SLA_SECONDS: float = 60.0  # p95 latency budget per call
+    AI_ROUTING_MAX_ERROR_RATE: float = 0.5  # Avoid backends failing more than this
+    AI_ROUTING_ERROR_HALF_LIFE: float = 60.0  # Seconds, error rate decays while idle
+    AI_ROUTING_LATENCY_WEIGHT: float = 0.5
+    AI_ROUTING_COST_WEIGHT: float = 0.3
+    AI_ROUTING_ERROR_WEIGHT: float = 0.2
+    AI_ROUTING_EWMA_ALPHA: float = 0.2
+    AI_ROUTING_WINDOW: int = 200  # Samples kept for percentiles
+    
+    # Hedged requests (opt-in, ASAP tasks on provider="auto")
+    AI_HEDGING_ENABLED: bool = False
+    AI_HEDGE_PERCENTILE: float = 90.0  # Hedge once the primary is slower than this
+    AI_HEDGE_DEFAULT_DELAY: float = 10.0  # Seconds, until latency is observed
+    AI_HEDGE_MIN_DELAY: float = 1.0  # Seconds
+    AI_HEDGE_BUDGET_RATIO: float = 0.1  # At most ~10% of requests are duplicated
+    AI_HEDGE_BUDGET_BURST: float = 5.0
+    
+    # Provider rate limits, shared by API and workers through Redis
+    # Keys are "provider" or "provider/model" (model-specific wins)
+    AI_LIMITER_ENABLED: bool = True
+    AI_CONCURRENCY_LIMITS: Dict[str, int] = {"ollama": 4, "openai": 20}
+    AI_TPM_LIMITS: Dict[str, int] = {}  # Tokens per minute, e.g. {"openai/gpt-4o": 30000}
+    AI_LIMITER_LEASE_SECONDS: float = 60.0  # Renewed while the call runs, reclaimed this long after a crash
+    AI_LIMITER_DEFAULT_OUTPUT_TOKENS: int = 1000  # Reserved when max_tokens is not set
+    
+    # Adaptive concurrency (worker adjusts per-provider limits, AIMD)
+    AI_ADAPTIVE_CONCURRENCY: bool = True
+    AI_ADAPTIVE_CONCURRENCY_BOUNDS: Dict[str, List[int]] = {"ollama": [1, 8], "openai": [4, 50]}  # [min, max]
+    AI_ADAPTIVE_INTERVAL: float = 10.0  # Seconds between adjustments
+    AI_ADAPTIVE_LATENCY_FACTOR: float = 2.0  # Back off when latency exceeds baseline x this
+    AI_ADAPTIVE_MAX_ERROR_RATE: float = 0.2
+    AI_ADAPTIVE_DECREASE: float = 0.75  # Multiplicative decrease
+    AI_ADAPTIVE_COOLDOWN: float = 30.0  # Seconds between decreases
+    AI_ADAPTIVE_BASELINE_DRIFT: float = 0.01  # Per interval
+    AI_ADAPTIVE_HISTORY: int = 500  # Adjustments kept for reporting
+    WORKER_MAX_JOBS: int = 30  # Ceiling; per-provider limits do the throttling
+    
+    # Token counting
+    TOKENIZER_DEFAULT_ENCODING: str = "cl100k_base"  # For models tiktoken doesn't know
+    TOKENIZER_THREAD_THRESHOLD: int = 100_000  # Characters; larger batches use a thread
+    
+    # Structured (JSON) output
+    STRUCTURED_MAX_RETRIES: int = 1  # Re-asks after invalid JSON
+    OLLAMA_JSON_SCHEMA: bool = True  # Send the schema as "format" (Ollama >= 0.5), else "json"
+    STRUCTURED_STREAMING: bool = True  # Stream JSON calls through the incremental parser
+    STRUCTURED_EARLY_STOP: bool = True  # Stop generating once the object is complete
+    
+    # Task pipeline: "fused" (analysis + plan in one call), "two_step", or "auto"
+    TASK_PIPELINE_MODE: str = "auto"
+    TASK_PIPELINE_FUSED_PROVIDERS: List[str] = ["ollama"]  # Used by "auto"
+    
+    # Plan execution: steps run as separate calls along their dependencies
+    STEP_ENGINE_ENABLED: bool = True
+    STEP_CONCURRENCY: int = 3  # Steps of one task running at the same time
+    STEP_MAX_TOKENS: int = 2000  # Output cap per step
+    
+    # Task queue: earliest deadline first, deadline = enqueue time + SLA
+    TASK_SLA_SECONDS: Dict[str, int] = {"asap": 300, "today": 4 * 3600, "flexible": 24 * 3600}
+    TASK_STARVATION_SECONDS: int = 1800  # Max head start of ASAP over flexible jobs
+    TASK_QUEUE_CONNECT_RETRIES: int = 1  # Per (re)connect of the shared enqueue pool
+    
+    # Live task state (phase, progress) in Redis, written to Postgres at durable points
+    TASK_STATE_TTL: int = 24 * 3600  # Seconds
+    
+    # Task events (Redis stream per user) and the WebSocket feed
+    TASK_EVENTS_MAXLEN: int = 1000  # Events kept per user for resuming
+    TASK_EVENTS_TTL: int = 24 * 3600  # Seconds since the user's last event
+    TASK_EVENTS_BATCH: int = 50  # Events read and sent per round
+    WS_HEARTBEAT_SECONDS: int = 15
+    WS_SEND_TIMEOUT: float = 10.0  # Slower clients are disconnected (they resume)
+    WS_MAX_CONNECTIONS: int = 500  # Per API process, each blocks one Redis connection
+
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> str:
         # Use Render's DATABASE_URL if available
@@ -1,9 +1,9 @@
 """
 Real Ollama LLM Client - NO MOCKS
 """
-import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union
 from app.core.config import settings
+from app.core.ollama_transport import ollama_transport
 
 
 class OllamaClient:
@@ -15,11 +15,14 @@ class OllamaClient:
         self,
         prompt: str,
         system: Optional[str] = None,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        format: Optional[Union[str, Dict[str, Any]]] = None
     ) -> str:
         """
         Call Ollama API and return response text.
         NO SIMULATION. REAL API CALL.
+        
+        format: "json" or a JSON schema for constrained JSON output
         """
         payload: Dict[str, Any] = {
             "model": self.model,
@@ -32,15 +35,14 @@ class OllamaClient:
         
         if system:
             payload["system"] = system
+        if format is not None:
+            payload["format"] = format
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/generate",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("response", "").strip()
+        data = await ollama_transport.post_json(
+            f"{self.base_url}/api/generate",
+            payload
+        )
+        return data.get("response", "").strip()
     
     async def chat(
         self,
@@ -59,15 +61,12 @@ class OllamaClient:
             }
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/chat",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            message = data.get("message", {})
-            return message.get("content", "").strip()
+        data = await ollama_transport.post_json(
+            f"{self.base_url}/api/chat",
+            payload
+        )
+        message = data.get("message", {})
+        return message.get("content", "").strip()
 
 
 # Global singleton
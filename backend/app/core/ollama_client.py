@@ -1,8 +1,8 @@
 """
 Real Ollama AI Client - No Mocks
 """
-import httpx
 from typing import Optional
+from app.core.ollama_transport import ollama_transport
 
 
 class OllamaClient:
@@ -30,11 +30,8 @@ class OllamaClient:
         if system:
             payload["system"] = system
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("response", "")
+        data = await ollama_transport.post_json(url, payload)
+        return data.get("response", "")
 
     async def chat(
         self,
@@ -51,11 +48,8 @@ class OllamaClient:
             "stream": False
         }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("message", {}).get("content", "")
+        data = await ollama_transport.post_json(url, payload)
+        return data.get("message", {}).get("content", "")
 
 
 # Global singleton
@@ -0,0 +1,156 @@
+"""
+Shared Ollama HTTP Transport
+One pooled async client for every Ollama call (providers, agents, test endpoints)
+"""
+import json
+import httpx
+from typing import Any, AsyncGenerator, Dict, Optional
+from app.core.config import settings
+
+
+class OllamaTransport:
+    """Connection-pooled HTTP transport for Ollama"""
+    
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "connections_created": 0,
+        }
+    
+    # ========================================================================
+    # LIFECYCLE
+    # ========================================================================
+    
+    async def open(self):
+        """Create the shared client (called by app and worker startup)"""
+        
+        if self._client is not None and not self._client.is_closed:
+            return
+        
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.OLLAMA_POOL_SIZE,
+                max_keepalive_connections=settings.OLLAMA_POOL_KEEPALIVE,
+                keepalive_expiry=settings.OLLAMA_KEEPALIVE_TIMEOUT
+            ),
+            timeout=httpx.Timeout(
+                settings.OLLAMA_READ_TIMEOUT,
+                connect=settings.OLLAMA_CONNECT_TIMEOUT,
+                pool=settings.OLLAMA_POOL_TIMEOUT
+            ),
+            http2=settings.OLLAMA_HTTP2
+        )
+    
+    async def close(self):
+        """Close the shared client and its connections"""
+        
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared client, opening it on first use"""
+        
+        if self._client is None or self._client.is_closed:
+            await self.open()
+        return self._client
+    
+    async def _trace(self, event_name: str, info: dict):
+        """httpcore trace hook - TCP connects only happen for new connections"""
+        
+        if event_name == "connection.connect_tcp.complete":
+            self._stats["connections_created"] += 1
+    
+    # ========================================================================
+    # REQUESTS
+    # ========================================================================
+    
+    async def post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a JSON payload and return the decoded JSON response"""
+        
+        client = await self._get_client()
+        self._stats["requests"] += 1
+        self._stats["in_flight"] += 1
+        
+        try:
+            response = await client.post(
+                url,
+                json=payload,
+                extensions={"trace": self._trace}
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._stats["in_flight"] -= 1
+    
+    async def stream_json(
+        self,
+        url: str,
+        payload: Dict[str, Any]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """POST a JSON payload and yield each line of the NDJSON response"""
+        
+        client = await self._get_client()
+        self._stats["requests"] += 1
+        self._stats["in_flight"] += 1
+        
+        try:
+            async with client.stream(
+                "POST",
+                url,
+                json=payload,
+                extensions={"trace": self._trace}
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._stats["in_flight"] -= 1
+    
+    async def get(self, url: str) -> httpx.Response:
+        """Plain GET (health checks, model listing)"""
+        
+        client = await self._get_client()
+        self._stats["requests"] += 1
+        
+        return await client.get(url, extensions={"trace": self._trace})
+    
+    # ========================================================================
+    # STATS
+    # ========================================================================
+    
+    def stats(self) -> dict:
+        """Connection pool statistics"""
+        
+        stats = dict(self._stats)
+        stats["connections_reused"] = max(
+            stats["requests"] - stats["connections_created"], 0
+        )
+        stats["open"] = self._client is not None and not self._client.is_closed
+        stats["http2"] = settings.OLLAMA_HTTP2
+        
+        if stats["open"]:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = getattr(pool, "connections", [])
+            stats["connections"] = len(connections)
+            stats["idle"] = sum(1 for conn in connections if conn.is_idle())
+        
+        return stats
+
+
+# Global singleton
+ollama_transport = OllamaTransport()
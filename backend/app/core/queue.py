@@ -0,0 +1,275 @@
+"""
+Task Queue
+Enqueue tasks for the ARQ worker (app/worker.py), earliest deadline first
+
+Every urgency has an SLA deadline (TASK_SLA_SECONDS). ARQ runs due jobs
+in score order, so a job's score is its enqueue time moved back by its
+deadline gap to flexible jobs: more urgent jobs overtake queued, less
+urgent ones in deadline order. The gaps are scaled down to at most
+TASK_STARVATION_SECONDS, so no job is overtaken by jobs enqueued more
+than that much later.
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from arq import create_pool
+from arq.connections import ArqRedis, RedisSettings
+from arq.constants import default_queue_name, in_progress_key_prefix
+from app.core.config import settings
+from app.core.redis import get_redis
+from redis.exceptions import RedisError
+
+
+WAIT_PREFIX = "task_queue:wait:"
+MISSED_KEY = "task_queue:missed"
+WAIT_WINDOW = 200  # Wait samples kept per urgency
+
+
+def _urgency(value: Any) -> str:
+    # Task.urgency is a TaskUrgency enum, requests may pass plain strings
+    urgency = str(getattr(value, "value", value) or "flexible")
+    return urgency if urgency in settings.TASK_SLA_SECONDS else "flexible"
+
+
+def _head_start(urgency: str) -> float:
+    """
+    Seconds a job is ordered ahead of a flexible job enqueued at the same
+    time: the gap between their SLA deadlines, scaled down so the largest
+    gap is at most TASK_STARVATION_SECONDS
+    """
+    slas = settings.TASK_SLA_SECONDS
+    spread = max(slas.values()) - min(slas.values())
+    if spread <= 0:
+        return 0.0
+    scale = min(1.0, settings.TASK_STARVATION_SECONDS / spread)
+    return (max(slas.values()) - slas[urgency]) * scale
+
+
+def schedule_time(urgency: str, now: Optional[float] = None) -> datetime:
+    """ARQ score for a new job: now, minus its head start (always due)"""
+    now = time.time() if now is None else now
+    return datetime.fromtimestamp(now - _head_start(urgency), tz=timezone.utc)
+
+
+class QueueError(Exception):
+    """Raised when a job can't be enqueued (Redis unreachable)"""
+    pass
+
+
+class TaskQueue:
+    """
+    Application-scoped ARQ pool for enqueueing tasks
+    
+    Opened once in the FastAPI lifespan instead of a pool per request.
+    A connection error drops the pool; the call is retried once on a
+    fresh pool and later calls reconnect on demand.
+    """
+    
+    def __init__(self):
+        self._pool: Optional[ArqRedis] = None
+        self._lock = asyncio.Lock()
+        self.enqueued = 0
+        self.failures = 0
+        self.reconnects = 0
+    
+    async def startup(self):
+        """Open the pool (a failure is logged, the next enqueue retries)"""
+        try:
+            await self._get_pool()
+            print("📬 Task queue connected")
+        except Exception as e:
+            print(f"⚠️ Task queue not connected yet: {e}")
+    
+    async def shutdown(self):
+        """Close the pool"""
+        async with self._lock:
+            if self._pool is not None:
+                await self._pool.close()
+                self._pool = None
+    
+    async def _get_pool(self) -> ArqRedis:
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    redis_settings = RedisSettings.from_dsn(settings.REDIS_URL)
+                    redis_settings.conn_retries = settings.TASK_QUEUE_CONNECT_RETRIES
+                    self._pool = await create_pool(redis_settings)
+        return self._pool
+    
+    async def _reset(self, pool: ArqRedis):
+        async with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.reconnects += 1
+                try:
+                    await pool.close()
+                except Exception:
+                    pass
+    
+    async def enqueue(
+        self,
+        task_id: int,
+        urgency: Any = "flexible",
+        key: Optional[str] = None
+    ) -> str:
+        """
+        Enqueue a task for processing by the worker
+        
+        Args:
+            task_id: Task ID to process
+            urgency: Task urgency (flexible/today/asap), sets its priority
+            key: Idempotency key (no ":"), e.g. a checkout session id.
+                ARQ drops a second enqueue with the same task and key
+                while the job is queued, running or its result is kept.
+        
+        Returns:
+            ARQ job id
+        
+        Raises:
+            QueueError: if Redis can't be reached
+        """
+        urgency = _urgency(urgency)
+        # Unique per enqueue unless keyed (a task can be queued again after
+        # clarification), urgency in the id for queue depth metrics
+        job_id = f"task:{task_id}:{urgency}:{key or uuid.uuid4().hex[:8]}"
+        
+        for attempt in range(2):
+            pool = None
+            try:
+                pool = await self._get_pool()
+                job = await pool.enqueue_job(
+                    'process_task',
+                    task_id,
+                    urgency=urgency,
+                    _job_id=job_id,
+                    _defer_until=schedule_time(urgency)
+                )
+                if job is None:
+                    print(f"ℹ️  Task {task_id} already enqueued as {job_id}")
+                else:
+                    self.enqueued += 1
+                return job_id
+            except (RedisError, OSError, asyncio.TimeoutError) as e:
+                if pool is not None:
+                    await self._reset(pool)
+                if attempt == 0:
+                    continue
+                self.failures += 1
+                raise QueueError(f"Failed to enqueue task {task_id}: {e}") from e
+    
+    async def enqueue_many(self, tasks: List[Tuple[int, Any]]) -> List[str]:
+        """
+        Enqueue several tasks over the shared pool
+        
+        Args:
+            tasks: (task_id, urgency) pairs
+        
+        Returns:
+            ARQ job ids, in input order
+        
+        Raises:
+            QueueError: if any task couldn't be enqueued (the others are queued)
+        """
+        results = await asyncio.gather(
+            *(self.enqueue(task_id, urgency) for task_id, urgency in tasks),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise QueueError(f"{len(errors)}/{len(tasks)} task(s) not enqueued: {errors[0]}")
+        return results
+    
+    async def health_check(self) -> bool:
+        """Ping Redis through the shared pool"""
+        try:
+            pool = await self._get_pool()
+            return bool(await pool.ping())
+        except Exception:
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self._pool is not None,
+            "enqueued": self.enqueued,
+            "failures": self.failures,
+            "reconnects": self.reconnects
+        }
+
+
+task_queue = TaskQueue()
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+async def record_wait(urgency: str, enqueued_at: datetime) -> float:
+    """
+    Record how long a job waited in the queue (called by the worker)
+    
+    Returns:
+        Wait in seconds
+    """
+    urgency = _urgency(urgency)
+    wait = max(0.0, time.time() - enqueued_at.timestamp())
+    
+    try:
+        redis = get_redis()
+        pipe = redis.pipeline()
+        pipe.lpush(WAIT_PREFIX + urgency, f"{wait:.3f}")
+        pipe.ltrim(WAIT_PREFIX + urgency, 0, WAIT_WINDOW - 1)
+        if wait > settings.TASK_SLA_SECONDS[urgency]:
+            pipe.hincrby(MISSED_KEY, urgency, 1)
+        await pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Queue wait not recorded: {e}")
+    
+    return wait
+
+
+def _percentile(samples: list, p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def queue_stats() -> Dict[str, Any]:
+    """Queue depth (waiting jobs), running jobs and recent wait times per urgency"""
+    
+    try:
+        redis = get_redis()
+        job_ids = await redis.zrange(default_queue_name, 0, -1)
+        missed = await redis.hgetall(MISSED_KEY)
+        
+        stats = {}
+        for urgency in settings.TASK_SLA_SECONDS:
+            waits = [float(w) for w in await redis.lrange(WAIT_PREFIX + urgency, 0, -1)]
+            stats[urgency] = {
+                "depth": 0,
+                "running": 0,
+                "sla_seconds": settings.TASK_SLA_SECONDS[urgency],
+                "wait_avg": round(sum(waits) / len(waits), 3) if waits else None,
+                "wait_p95": _percentile(waits, 95),
+                "wait_max": max(waits) if waits else None,
+                "missed_deadlines": int(missed.get(urgency, 0))
+            }
+        
+        # Running jobs stay in the ARQ queue until they finish
+        pipe = redis.pipeline()
+        for job_id in job_ids:
+            pipe.exists(in_progress_key_prefix + job_id)
+        running = await pipe.execute() if job_ids else []
+        
+        for job_id, is_running in zip(job_ids, running):
+            parts = job_id.split(":")
+            urgency = parts[2] if len(parts) == 4 and parts[0] == "task" else "other"
+            entry = stats.setdefault(urgency, {"depth": 0, "running": 0})
+            entry["running" if is_running else "depth"] += 1
+        
+        return stats
+    except Exception as e:
+        return {"error": str(e)}
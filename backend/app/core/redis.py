@@ -0,0 +1,28 @@
+"""
+Shared Redis Client
+One connection pool per process for caches, limiters and task state
+"""
+from typing import Optional
+import redis.asyncio as aioredis
+from app.core.config import settings
+
+
+_redis: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Get the process-wide Redis client (created on first use)"""
+    global _redis
+    
+    if _redis is None:
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+async def close_redis():
+    """Close the process-wide Redis client"""
+    global _redis
+    
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
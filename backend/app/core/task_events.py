@@ -0,0 +1,131 @@
+"""
+Task Events
+Progress of running tasks for live clients (WebSocket feed in app/api/tasks.py)
+
+The worker appends phase changes, step output and cost updates to one
+Redis stream per user. Unlike pub/sub, a stream keeps the last
+TASK_EVENTS_MAXLEN events, so a client that reconnects passes the id
+of the last event it saw and gets everything it missed.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+STREAM_PREFIX = "task_events:"
+
+
+def _parse_id(event_id: str) -> Tuple[int, int]:
+    millis, _, sequence = event_id.partition("-")
+    return int(millis), int(sequence or 0)
+
+
+def valid_event_id(event_id: str) -> bool:
+    """Whether event_id looks like a stream id ("<ms>-<seq>")"""
+    try:
+        _parse_id(event_id)
+        return True
+    except ValueError:
+        return False
+
+
+class TaskEvents:
+    """Per-user event streams in Redis"""
+    
+    def __init__(self):
+        self.published = 0
+        self.errors = 0
+        self.connections = 0  # Open WebSocket feeds in this process
+    
+    async def publish(self, user_id: int, task_id: int, event: str, **data):
+        """
+        Append an event to the user's stream (failures are logged, never raised)
+        
+        Args:
+            user_id: Owner of the task
+            task_id: Task the event belongs to
+            event: Event type (status, progress, output, cost)
+            **data: JSON-serializable payload
+        """
+        key = f"{STREAM_PREFIX}{user_id}"
+        try:
+            redis = get_redis()
+            pipe = redis.pipeline()
+            pipe.xadd(
+                key,
+                {"task_id": task_id, "event": event, "data": json.dumps(data, default=str)},
+                maxlen=settings.TASK_EVENTS_MAXLEN,
+                approximate=True
+            )
+            pipe.expire(key, settings.TASK_EVENTS_TTL)
+            await pipe.execute()
+            self.published += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Task event not published for task {task_id}: {e}")
+    
+    async def latest_id(self, user_id: int) -> str:
+        """Id of the user's newest event ("0-0" if there is none)"""
+        
+        entries = await get_redis().xrevrange(f"{STREAM_PREFIX}{user_id}", count=1)
+        return entries[0][0] if entries else "0-0"
+    
+    async def missed_events(self, user_id: int, last_id: str) -> bool:
+        """Whether events after last_id were already trimmed from the stream"""
+        
+        entries = await get_redis().xrange(f"{STREAM_PREFIX}{user_id}", count=1)
+        if not entries:
+            return False
+        oldest = _parse_id(entries[0][0])
+        return oldest > _parse_id(last_id) and _parse_id(last_id) != (0, 0)
+    
+    async def read(
+        self,
+        user_id: int,
+        last_id: str,
+        block_ms: int,
+        task_id: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Wait for the events after last_id
+        
+        Args:
+            user_id: Whose stream to read
+            last_id: Id of the last event the client has
+            block_ms: How long to wait for new events
+            task_id: Only return events of this task
+        
+        Returns:
+            (events, id to continue from)
+        """
+        result = await get_redis().xread(
+            {f"{STREAM_PREFIX}{user_id}": last_id},
+            count=settings.TASK_EVENTS_BATCH,
+            block=block_ms
+        )
+        
+        events = []
+        for _key, entries in result or []:
+            for event_id, fields in entries:
+                last_id = event_id
+                if task_id is not None and int(fields["task_id"]) != task_id:
+                    continue
+                events.append({
+                    "id": event_id,
+                    "task_id": int(fields["task_id"]),
+                    "event": fields["event"],
+                    "data": json.loads(fields["data"])
+                })
+        return events, last_id
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "errors": self.errors,
+            "connections": self.connections
+        }
+
+
+# Global singleton
+task_events = TaskEvents()
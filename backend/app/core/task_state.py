@@ -0,0 +1,144 @@
+"""
+Task State Store
+Write-behind layer for the fast-changing state of running tasks
+
+Phase changes (analyzing, planning, executing) and step progress are
+written to a Redis hash only. They are buffered in the worker and go
+to the tasks row with the next durable write (phase result, completion,
+failure), so a run commits a handful of times instead of once per
+status change. Readers overlay the live state on the row while the row
+shows the task in flight; after a crash the row still holds the last
+checkpoint and the resumable pipeline continues from there.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+KEY_PREFIX = "task_state:"
+
+# Row statuses a live state may refine; any other status is final or
+# waits for the user, and the row is authoritative
+IN_FLIGHT_STATUSES = ("pending", "analyzing", "planning", "executing")
+
+
+def _encode(value: Any) -> str:
+    if isinstance(value, datetime):
+        return json.dumps({"$dt": value.isoformat()})
+    return json.dumps(value)
+
+
+def _decode(raw: str) -> Any:
+    value = json.loads(raw)
+    if isinstance(value, dict) and set(value) == {"$dt"}:
+        return datetime.fromisoformat(value["$dt"])
+    return value
+
+
+class TaskStateStore:
+    """Live task state in Redis, plus the fields not yet written to the row"""
+    
+    def __init__(self):
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self.live_writes = 0
+        self.flushed_fields = 0
+        self.errors = 0
+    
+    async def set(self, task_id: int, **fields):
+        """
+        Record live state: published to Redis, buffered for the next durable write
+        
+        Args:
+            task_id: Task ID
+            **fields: Task column values (status, started_at) or "progress"
+        """
+        self._pending.setdefault(task_id, {}).update(
+            (name, value) for name, value in fields.items() if name != "progress"
+        )
+        
+        try:
+            redis = get_redis()
+            key = f"{KEY_PREFIX}{task_id}"
+            pipe = redis.pipeline()
+            pipe.hset(key, mapping={name: _encode(value) for name, value in fields.items()})
+            pipe.expire(key, settings.TASK_STATE_TTL)
+            await pipe.execute()
+            self.live_writes += 1
+        except Exception as e:
+            # Only visibility is lost, the buffered fields still reach the row
+            self.errors += 1
+            print(f"⚠️ Task state not published for task {task_id}: {e}")
+    
+    def flush(self, task_id: int) -> Dict[str, Any]:
+        """Take the buffered fields, to be written with a durable update"""
+        
+        pending = self._pending.pop(task_id, {})
+        self.flushed_fields += len(pending)
+        return pending
+    
+    async def clear(self, task_id: int):
+        """Drop the live state (the row is authoritative again)"""
+        
+        self._pending.pop(task_id, None)
+        try:
+            await get_redis().delete(f"{KEY_PREFIX}{task_id}")
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Task state not cleared for task {task_id}: {e}")
+    
+    async def get_many(self, task_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Live state per task id (tasks without live state are left out)"""
+        
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        
+        try:
+            pipe = get_redis().pipeline()
+            for task_id in task_ids:
+                pipe.hgetall(f"{KEY_PREFIX}{task_id}")
+            states = await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Task state not read: {e}")
+            return {}
+        
+        return {
+            task_id: {name: _decode(raw) for name, raw in state.items()}
+            for task_id, state in zip(task_ids, states)
+            if state
+        }
+    
+    async def get(self, task_id: int) -> Dict[str, Any]:
+        return (await self.get_many([task_id])).get(task_id, {})
+    
+    @staticmethod
+    def merge(row: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Overlay live state on a task row (as a dict, e.g. a response model dump)
+        
+        Args:
+            row: Task fields from the database
+            state: Live state from get()/get_many()
+        
+        Returns:
+            The merged fields
+        """
+        status = str(getattr(row.get("status"), "value", row.get("status")))
+        if not state or status not in IN_FLIGHT_STATUSES:
+            return row
+        return {**row, **{name: value for name, value in state.items() if name in row}}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live_writes": self.live_writes,
+            "flushed_fields": self.flushed_fields,
+            "buffered_tasks": len(self._pending),
+            "errors": self.errors
+        }
+
+
+# Global singleton
+task_state = TaskStateStore()
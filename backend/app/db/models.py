@@ -2,7 +2,7 @@
 Complete database models for OmniTask
 Following the master rebuild plan
 """
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Boolean, JSON, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Boolean, JSON, Enum as SQLEnum, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
@@ -128,6 +128,7 @@ class Task(Base):
     plan = Column(JSON, nullable=True)  # Execution plan from planner
     analysis = Column(JSON, nullable=True)  # Analysis results
     clarification_questions = Column(JSON, nullable=True)  # Questions for user
+    step_results = Column(JSON, nullable=True)  # Checkpointed step outputs by step number
     
     # Results
     result_text = Column(Text, nullable=True)
@@ -153,6 +154,11 @@ class Task(Base):
     messages = relationship("Message", back_populates="task", cascade="all, delete-orphan")
     files = relationship("File", back_populates="task", cascade="all, delete-orphan")
     payments = relationship("Payment", back_populates="task")
+    
+    __table_args__ = (
+        # Keyset pagination of a user's tasks, newest first (also with a status filter)
+        Index("ix_tasks_user_created_id", user_id, created_at.desc(), id.desc()),
+    )
 
 
 class Message(Base):
@@ -179,6 +185,11 @@ class Message(Base):
     
     # Relationships
     task = relationship("Task", back_populates="messages")
+    
+    __table_args__ = (
+        # Keyset pagination of a task's chat, oldest first
+        Index("ix_messages_task_created_id", task_id, created_at, id),
+    )
 
 
 class Payment(Base):
@@ -0,0 +1,87 @@
+"""
+Keyset Pagination
+Pages ordered by (created_at, id), continued from the last row of the
+previous page instead of skipping rows with OFFSET
+
+The cursor is an opaque token holding the last row's created_at and id.
+With a matching composite index, fetching any page reads only the rows
+of that page, however deep it is.
+"""
+import base64
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import Select, literal, tuple_
+
+
+class InvalidCursorError(ValueError):
+    """The cursor wasn't issued by this API"""
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(
+    query: Select,
+    created_at_column: Any,
+    id_column: Any,
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False
+) -> Select:
+    """
+    Order a query by (created_at, id) and start it after the cursor
+    
+    Fetches limit + 1 rows, pass the result to next_cursor().
+    
+    Args:
+        query: Select with the filters applied
+        created_at_column: Timestamp column to order by
+        id_column: Primary key, breaks ties between equal timestamps
+        cursor: Cursor from the previous page (None for the first page)
+        limit: Page size
+        descending: Newest first
+    
+    Raises:
+        InvalidCursorError: if the cursor can't be decoded
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # Row comparison, so Postgres seeks the index to the cursor
+        # (an OR of both conditions would scan and filter the earlier rows)
+        key = tuple_(created_at_column, id_column)
+        position = tuple_(
+            literal(created_at, created_at_column.type),
+            literal(row_id, id_column.type)
+        )
+        query = query.where(key < position if descending else key > position)
+    
+    if descending:
+        query = query.order_by(created_at_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(created_at_column, id_column)
+    return query.limit(limit + 1)
+
+
+def next_cursor(rows: List[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Split the limit + 1 rows fetched by keyset_page()
+    
+    Returns:
+        (rows of this page, cursor of the next page or None if this is the last)
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,120 @@
+"""
+Load test: parallel credit debits on one user
+Fires hundreds of debits, charges and refunds at the same user at once,
+each in its own session, and checks the books afterwards: no debit
+beyond the balance, no lost update, balance and monthly usage match the
+successful operations exactly. --naive runs the same debits as the old
+read-modify-write on a loaded User for comparison.
+
+Usage:
+    python -m app.loadtest_credits --debits 500 --amount 0.25 --balance 100
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from sqlalchemy import delete, select
+from app.billing.credits import InsufficientCreditsError, charge, debit, refund
+from app.db.base import AsyncSessionLocal
+from app.db.models import User
+
+
+async def _debit(user_id: int, amount: float) -> bool:
+    async with AsyncSessionLocal() as db:
+        try:
+            await debit(db, user_id, amount)
+        except InsufficientCreditsError:
+            return False
+        await db.commit()
+        return True
+
+
+async def _naive_debit(user_id: int, amount: float) -> bool:
+    # What the endpoints used to do: check and change a loaded User
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
+        if user.credits_balance < amount:
+            return False
+        await asyncio.sleep(0)  # Let other requests interleave, as awaits do in a handler
+        user.credits_balance -= amount
+        user.monthly_usage += amount
+        await db.commit()
+        return True
+
+
+async def _charge_and_refund(user_id: int, amount: float):
+    async with AsyncSessionLocal() as db:
+        await charge(db, user_id, amount)
+        await db.commit()
+    async with AsyncSessionLocal() as db:
+        await refund(db, user_id, amount)
+        await db.commit()
+
+
+async def run(debits: int, amount: float, balance: float, naive: bool):
+    mode = "read-modify-write (old)" if naive else "atomic UPDATE ... RETURNING"
+    print(f"🏁 {debits} parallel debits of ${amount:.2f} on a ${balance:.2f} balance, {mode}\n")
+    
+    async with AsyncSessionLocal() as db:
+        user = User(
+            email=f"loadtest-{uuid.uuid4().hex[:8]}@omnitask.ai",
+            hashed_password="loadtest",
+            credits_balance=balance,
+            monthly_usage=0.0
+        )
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+    
+    operation = _naive_debit if naive else _debit
+    started = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(
+            *(operation(user_id, amount) for _ in range(debits)),
+            # Balance-neutral traffic on the same row (worker charges, cancel refunds)
+            *(_charge_and_refund(user_id, amount) for _ in range(debits // 5)),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - started
+        
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(User.credits_balance, User.monthly_usage).where(User.id == user_id)
+            )
+            final_balance, final_usage = result.one()
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+    
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    succeeded = sum(1 for outcome in outcomes[:debits] if outcome is True)
+    expected = min(debits, int(balance // amount))
+    
+    print(f"⏱️  {elapsed:.2f}s for {len(outcomes)} operations")
+    print(f"💳 debits succeeded: {succeeded} (balance covers {expected})")
+    print(f"💰 balance: ${final_balance:.2f} (expected ${balance - succeeded * amount:.2f})")
+    print(f"📈 monthly usage: ${final_usage:.2f} (expected ${succeeded * amount:.2f})")
+    print(f"❌ errors: {len(errors)}")
+    for error in errors[:5]:
+        print(f"   {type(error).__name__}: {error}")
+    
+    consistent = (
+        not errors
+        and succeeded == expected
+        and abs(final_balance - (balance - succeeded * amount)) < 1e-6
+        and abs(final_usage - succeeded * amount) < 1e-6
+        and final_balance >= 0
+    )
+    print("\n✅ Books balance, no lost updates" if consistent else "\n⚠️  Lost updates or overdrawn balance")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel credit debits on one user")
+    parser.add_argument("--debits", type=int, default=500)
+    parser.add_argument("--amount", type=float, default=0.25)
+    parser.add_argument("--balance", type=float, default=100.0)
+    parser.add_argument("--naive", action="store_true", help="Use the old read-modify-write")
+    args = parser.parse_args()
+    
+    asyncio.run(run(args.debits, args.amount, args.balance, args.naive))
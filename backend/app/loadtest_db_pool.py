@@ -0,0 +1,145 @@
+"""
+Load test: DB connection pool under many concurrent tasks
+Runs far more task pipelines at once than the pool has connections,
+with a simulated slow LLM, and samples the pool while they run.
+Tasks only hold a connection for short reads/writes, so the peak
+checkout stays low and no task times out waiting for the pool.
+
+Usage:
+    python -m app.loadtest_db_pool --tasks 100 --latency 2.0
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from sqlalchemy import delete, select
+from app.ai.base import AIResponse
+from app.agents import task_manager
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal, pool_stats
+from app.db.models import Message, Task, User
+
+
+class SlowProvider:
+    """Stand-in for a local model: every call takes `latency` seconds"""
+    
+    name = "ollama"  # A valid AIProvider value for Message.provider_used
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+    
+    def get_default_model(self) -> str:
+        return "loadtest"
+    
+    async def chat_completion(self, messages, json_schema=None, phase=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        
+        analysis = {
+            "intent": "load test",
+            "category": "other",
+            "complexity": "simple",
+            "output_type": "text",
+            "needs_clarification": False
+        }
+        plan = {
+            "steps": [
+                {"step_number": 1, "action": "Draft", "depends_on": []},
+                {"step_number": 2, "action": "Review", "depends_on": []}
+            ]
+        }
+        parsed = {
+            "analysis": analysis,
+            "planning": plan,
+            "analyze_plan": {"analysis": analysis, "plan": plan}
+        }.get(phase)
+        
+        return AIResponse(
+            content="ok",
+            tokens_used=10,
+            cost=0.0,
+            model="loadtest",
+            provider=self.name,
+            parsed=parsed
+        )
+
+
+async def sample_pool(samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        samples.append(pool_stats())
+        await asyncio.sleep(0.05)
+
+
+async def run(task_count: int, latency: float):
+    capacity = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    print(f"🏁 {task_count} concurrent tasks, {latency:.1f}s per LLM call, pool capacity {capacity}\n")
+    
+    provider = SlowProvider(latency)
+    task_manager.get_ai_provider = lambda *args, **kwargs: provider
+    
+    async with AsyncSessionLocal() as db:
+        user = User(
+            email=f"loadtest-{uuid.uuid4().hex[:8]}@omnitask.ai",
+            hashed_password="loadtest",
+            credits_balance=1000.0
+        )
+        db.add(user)
+        await db.commit()
+        
+        tasks = [
+            Task(user_id=user.id, description=f"Load test task {i}", status="pending")
+            for i in range(task_count)
+        ]
+        db.add_all(tasks)
+        await db.commit()
+        task_ids = [task.id for task in tasks]
+        user_id = user.id
+    
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_pool(samples, stop))
+    
+    started = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(
+            *(task_manager.execute_task(task_id) for task_id in task_ids),
+            return_exceptions=True
+        )
+    finally:
+        stop.set()
+        await sampler
+    elapsed = time.perf_counter() - started
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Task.status).where(Task.id.in_(task_ids)))
+        statuses = [str(getattr(status, "value", status)) for status in result.scalars()]
+        
+        # Clean up
+        await db.execute(delete(Message).where(Message.task_id.in_(task_ids)))
+        await db.execute(delete(Task).where(Task.id.in_(task_ids)))
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+    
+    errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    peak = max((sample["checked_out"] for sample in samples), default=0)
+    average = sum(sample["checked_out"] for sample in samples) / max(len(samples), 1)
+    
+    print(f"⏱️  {elapsed:.1f}s for {task_count} tasks ({provider.calls} LLM calls)")
+    print(f"✅ completed: {statuses.count('completed')}/{task_count}")
+    print(f"❌ errors: {len(errors)}")
+    for error in errors[:5]:
+        print(f"   {type(error).__name__}: {error}")
+    print(f"🔌 pool checked out: peak {peak}/{capacity}, average {average:.1f}")
+    
+    healthy = not errors and statuses.count("completed") == task_count and peak < capacity
+    print("\n✅ Pool stayed healthy" if healthy else "\n⚠️  Pool was exhausted or tasks failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DB pool load test with simulated LLM latency")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=2.0, help="Seconds per LLM call")
+    args = parser.parse_args()
+    
+    asyncio.run(run(args.tasks, args.latency))
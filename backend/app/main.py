@@ -8,6 +8,19 @@ from contextlib import asynccontextmanager
 
 from app.api import auth, tasks, chat
 from app.ai.factory import ProviderFactory
+from app.ai.cache import response_cache
+from app.ai.concurrency import adaptive_concurrency
+from app.ai.health import health_monitor
+from app.ai.hedging import hedging_stats
+from app.ai.limiter import provider_limiter
+from app.ai.routing import provider_router
+from app.ai.singleflight import inflight
+from app.ai.structured import streaming_stats, structured_stats
+from app.core.ollama_transport import ollama_transport
+from app.core.queue import queue_stats, task_queue
+from app.core.task_events import task_events
+from app.db.base import pool_stats
+from app.core.redis import close_redis
 
 
 @asynccontextmanager
@@ -16,14 +29,27 @@ async def lifespan(app: FastAPI):
     # Startup
     print("🚀 OmniTask Backend starting...")
     
-    # Check AI providers health
+    # Open shared AI provider pools, start background health prober
+    await ProviderFactory.startup()
+    
+    # AI providers health (first probe ran in ProviderFactory.startup)
     health = await ProviderFactory.health_check_all()
     print(f"📡 AI Providers: {health}")
     
+    # Shared ARQ pool for enqueueing tasks
+    await task_queue.startup()
+    
+    # Report API call latency/errors to the worker's concurrency controller
+    await adaptive_concurrency.start(control=False)
+    
     yield
     
     # Shutdown
     print("👋 OmniTask Backend shutting down...")
+    await adaptive_concurrency.stop()
+    await task_queue.shutdown()
+    await ProviderFactory.shutdown()
+    await close_redis()
 
 
 # Create FastAPI app
@@ -42,6 +68,7 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor of list endpoints
 )
 
 
@@ -66,16 +93,39 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     
-    # Check AI providers
+    # AI providers (cached state from the background prober, no live calls)
     providers = await ProviderFactory.health_check_all()
+    queue_ok = await task_queue.health_check()
     
     return {
-        "status": "healthy",
+        "status": "healthy" if queue_ok else "degraded",
         "database": "connected",  # TODO: Actual DB check
+        "task_queue": "connected" if queue_ok else "unavailable",
         "ai_providers": providers
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics (connection pools, caches, queues)"""
+    
+    return {
+        "ollama_transport": ollama_transport.stats(),
+        "llm_cache": response_cache.stats(),
+        "llm_coalescing": inflight.stats(),
+        "ai_health": health_monitor.snapshot(),
+        "ai_routing": provider_router.snapshot(),
+        "ai_hedging": hedging_stats.snapshot(),
+        "ai_limiter": provider_limiter.stats(),
+        "ai_concurrency": await adaptive_concurrency.snapshot(),
+        "structured_output": structured_stats.snapshot(),
+        "json_streaming": streaming_stats.snapshot(),
+        "db_pool": pool_stats(),
+        "task_queue": {**await queue_stats(), "enqueue": task_queue.stats()},
+        "task_events": task_events.stats()
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
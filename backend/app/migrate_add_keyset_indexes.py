@@ -0,0 +1,58 @@
+"""
+Migration: Add keyset pagination indexes
+Adds: ix_tasks_user_created_id on tasks (user_id, created_at DESC, id DESC)
+      ix_messages_task_created_id on messages (task_id, created_at, id)
+
+Built CONCURRENTLY (outside a transaction) so writes to the tables
+continue while the indexes are created.
+"""
+import asyncio
+from sqlalchemy import text
+from app.db.base import engine
+
+
+INDEXES = {
+    "ix_tasks_user_created_id": "tasks (user_id, created_at DESC, id DESC)",
+    "ix_messages_task_created_id": "messages (task_id, created_at, id)",
+}
+
+
+async def migrate():
+    """Create the composite indexes"""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        
+        for name, definition in INDEXES.items():
+            # Check if index already exists
+            result = await conn.execute(
+                text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                {"name": name}
+            )
+            if result.scalar():
+                print(f"ℹ️  Index {name} already exists")
+                continue
+            
+            await conn.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {definition}"))
+            print(f"✅ Added index: {name}")
+        
+        print("\n✅ Migration completed successfully")
+
+
+async def rollback():
+    """Rollback migration (drop the indexes)"""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        
+        for name in INDEXES:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        
+        print("✅ Migration rolled back successfully")
+
+
+if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        asyncio.run(rollback())
+    else:
+        asyncio.run(migrate())
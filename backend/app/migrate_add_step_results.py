@@ -0,0 +1,52 @@
+"""
+Migration: Add step checkpoints to tasks table
+Adds: step_results column (JSON, per-step outputs of the step engine)
+"""
+import asyncio
+from sqlalchemy import text
+from app.db.base import engine
+
+
+async def migrate():
+    """Add step_results column to tasks table"""
+    async with engine.begin() as conn:
+        # Check if column already exists
+        result = await conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'tasks' 
+            AND column_name = 'step_results'
+        """))
+        existing_columns = {row[0] for row in result.fetchall()}
+        
+        # Add step_results if not exists
+        if 'step_results' not in existing_columns:
+            await conn.execute(text("""
+                ALTER TABLE tasks 
+                ADD COLUMN step_results JSON
+            """))
+            print("✅ Added column: step_results")
+        else:
+            print("ℹ️  Column step_results already exists")
+        
+        print("\n✅ Migration completed successfully")
+
+
+async def rollback():
+    """Rollback migration (remove step_results)"""
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            ALTER TABLE tasks 
+            DROP COLUMN IF EXISTS step_results
+        """))
+        
+        print("✅ Migration rolled back successfully")
+
+
+if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        asyncio.run(rollback())
+    else:
+        asyncio.run(migrate())
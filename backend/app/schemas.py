@@ -126,7 +126,8 @@ class TaskUpdate(BaseModel):
     provider: Optional[AIProviderEnum] = None
 
 
-class TaskResponse(BaseModel):
+class TaskSummary(BaseModel):
+    """Task list entry (no result text, see TaskResponse / TaskDetail)"""
     id: int
     user_id: int
     description: str
@@ -136,7 +137,6 @@ class TaskResponse(BaseModel):
     estimated_cost: float
     final_cost: float
     tokens_used: int
-    result_text: Optional[str] = None
     result_files: Optional[List[int]] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -148,11 +148,16 @@ class TaskResponse(BaseModel):
         from_attributes = True
 
 
+class TaskResponse(TaskSummary):
+    result_text: Optional[str] = None
+
+
 class TaskDetail(TaskResponse):
     """Extended task info with plan and analysis"""
     plan: Optional[Dict[str, Any]] = None
     analysis: Optional[Dict[str, Any]] = None
     clarification_questions: Optional[List[str]] = None
+    progress: Optional[Dict[str, Any]] = None  # Live step progress while executing
 
 
 class PriceEstimate(BaseModel):
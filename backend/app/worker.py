@@ -7,45 +7,95 @@ from arq.connections import RedisSettings
 from app.db.base import AsyncSessionLocal
 from app.db.models import Task
 from app.agents.task_manager import execute_task_async
-from sqlalchemy import select
+from app.ai.factory import ProviderFactory
+from app.ai.cache import response_cache
+from app.ai.concurrency import adaptive_concurrency
+from app.ai.limiter import call_priority, provider_limiter
+from app.ai.singleflight import inflight
+from app.core.cancellation import cancellation_watcher
+from app.core.ollama_transport import ollama_transport
+from app.core.queue import queue_stats, record_wait, schedule_time
+from app.core.task_state import task_state
+from app.core.config import settings
+from app.core.redis import close_redis
+from sqlalchemy import update
 import os
 
 
 async def startup(ctx):
     """Worker startup"""
     print("🚀 OmniTask Worker starting up...")
+    
+    # Open shared AI provider pools, start background health prober
+    await ProviderFactory.startup()
+    
+    # Tune per-provider concurrency from latency, errors and queue depth
+    await adaptive_concurrency.start()
+    
+    # Abort running tasks when the user cancels them
+    await cancellation_watcher.start()
 
 
 async def shutdown(ctx):
     """Worker shutdown"""
     print("👋 OmniTask Worker shutting down...")
+    
+    print(f"📡 Ollama transport stats: {ollama_transport.stats()}")
+    print(f"🗄️ LLM cache stats: {response_cache.stats()}")
+    print(f"🔗 LLM coalescing stats: {inflight.stats()}")
+    print(f"🚦 Provider limiter stats: {provider_limiter.stats()}")
+    print(f"📬 Task queue stats: {await queue_stats()}")
+    print(f"🎚️ Adaptive concurrency: {(await adaptive_concurrency.snapshot()).get('limits')}")
+    print(f"📝 Task state stats: {task_state.stats()}")
+    print(f"🛑 Cancellation stats: {cancellation_watcher.stats()}")
+    await cancellation_watcher.stop()
+    await adaptive_concurrency.stop()
+    await ProviderFactory.shutdown()
+    await close_redis()
 
 
-async def process_task(ctx, task_id: int):
+async def process_task(ctx, task_id: int, urgency: str = "flexible"):
     """
     Process a task through the complete lifecycle
     
     Args:
         ctx: ARQ context
         task_id: Task ID to process
+        urgency: Task urgency the job was queued with
     """
-    print(f"📋 Processing task {task_id}...")
+    wait = await record_wait(urgency, ctx["enqueue_time"])
+    print(f"📋 Processing task {task_id} ({urgency}, waited {wait:.1f}s)...")
+    
+    # Provider slots go to jobs in the same deadline order as the queue
+    priority = schedule_time(urgency, ctx["enqueue_time"].timestamp()).timestamp()
     
     try:
-        await execute_task_async(task_id)
+        with call_priority(priority):
+            await execute_task_async(task_id)
         print(f"✅ Task {task_id} completed successfully")
+    except asyncio.CancelledError:
+        # Job timeout or worker shutdown: don't leave the task mid-phase
+        print(f"⏱️ Task {task_id} interrupted (job timeout or shutdown)")
+        await asyncio.shield(
+            mark_failed(task_id, "Interrupted (job timeout or worker shutdown)")
+        )
+        raise
     except Exception as e:
         print(f"❌ Task {task_id} failed: {e}")
-        
-        # Mark task as failed
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Task).where(Task.id == task_id))
-            task = result.scalar_one_or_none()
-            
-            if task:
-                task.status = "failed"
-                task.error_message = str(e)
-                await db.commit()
+        await mark_failed(task_id, str(e))
+
+
+async def mark_failed(task_id: int, error: str):
+    """Mark a task as failed unless it already finished or was cancelled"""
+    
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Task)
+            .where(Task.id == task_id, Task.status.notin_(("completed", "cancelled")))
+            .values(status="failed", error_message=error)
+        )
+        await db.commit()
+    await task_state.clear(task_id)
 
 
 class WorkerSettings:
@@ -63,6 +113,12 @@ class WorkerSettings:
     on_shutdown = shutdown
     
     # Worker configuration
-    max_jobs = 10
+    # Ceiling only: jobs wait for a provider slot in the limiter (in
+    # deadline order), whose per-provider limits adapt at runtime
+    # (app/ai/concurrency.py). The wait counts against job_timeout.
+    max_jobs = settings.WORKER_MAX_JOBS
+    # Jobs are read in deadline order (app/core/queue.py); polling often
+    # bounds how long a newly queued urgent job waits for the next read
+    poll_delay = 0.2
     job_timeout = 600  # 10 minutes (for Ollama)
     keep_result = 3600  # Keep results for 1 hour